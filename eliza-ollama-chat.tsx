@@ -1,12 +1,312 @@
-import React, { useState, useEffect, useRef } from 'react';
-import { Send, Bot, MoreVertical, Trash2, Settings, User, Brain, Plus, List, Activity, X } from 'lucide-react';
+import React, { useState, useEffect, useRef, useLayoutEffect, useMemo, useCallback } from 'react';
+import { Send, Square, Bot, MoreVertical, Trash2, Settings, User, Brain, Plus, List, Activity, X } from 'lucide-react';
+
+// ============ Persistence (IndexedDB) ============
+// Messages are stored one record per message, keyed by [character, id], so a new or
+// changed message is a single put instead of rewriting the whole conversation.
+// Small state (settings, characters, memories, recent history) lives in the "state" store.
+
+const DB_NAME = 'eliza-chat';
+const DB_VERSION = 1;
+const PERSIST_DEBOUNCE_MS = 300;
+
+let dbPromise = null;
+
+const openDB = () => {
+  if (!dbPromise) {
+    dbPromise = new Promise((resolve, reject) => {
+      if (typeof indexedDB === 'undefined') {
+        reject(new Error('IndexedDB is not available'));
+        return;
+      }
+      const request = indexedDB.open(DB_NAME, DB_VERSION);
+      request.onupgradeneeded = () => {
+        request.result.createObjectStore('messages', { keyPath: ['character', 'id'] });
+        request.result.createObjectStore('state');
+      };
+      request.onsuccess = () => resolve(request.result);
+      request.onerror = () => reject(request.error);
+    });
+  }
+  return dbPromise;
+};
+
+const withStore = async (storeName, mode, fn) => {
+  const db = await openDB();
+  const tx = db.transaction(storeName, mode);
+  const request = fn(tx.objectStore(storeName));
+  await new Promise((resolve, reject) => {
+    tx.oncomplete = resolve;
+    tx.onerror = () => reject(tx.error);
+    tx.onabort = () => reject(tx.error);
+  });
+  return request?.result;
+};
+
+const characterRange = (character) => IDBKeyRange.bound([character, -Infinity], [character, Infinity]);
+
+const loadState = (key) => withStore('state', 'readonly', store => store.get(key));
+const saveState = (key, value) => withStore('state', 'readwrite', store => { store.put(value, key); });
+const loadMessages = (character) => withStore('messages', 'readonly', store => store.getAll(characterRange(character)));
+const putMessages = (messages) => withStore('messages', 'readwrite', store => { messages.forEach(m => store.put(m)); });
+const deleteMessages = (character) => withStore('messages', 'readwrite', store => { store.delete(characterRange(character)); });
+
+// Debounced write of one state record once the saved state has been restored.
+const usePersistedValue = (key, value, hydrated) => {
+  useEffect(() => {
+    if (!hydrated) return;
+    const timer = setTimeout(() => {
+      saveState(key, value).catch(error => console.warn(`Could not save ${key}:`, error));
+    }, PERSIST_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [key, value, hydrated]);
+};
+
+// ============ Ollama client ============
+// fetch has no timeout option; every call gets an AbortSignal instead. Replies are read
+// as NDJSON from a ReadableStream so text renders as the backend produces it.
+
+const BACKEND_CHECK_TIMEOUT_MS = 3000;
+const FIRST_TOKEN_TIMEOUT_MS = 120000;   // covers loading a cold model
+const STREAM_IDLE_TIMEOUT_MS = 30000;    // max silence between tokens once streaming
+
+const ABORT_STOPPED = 'stopped';
+const ABORT_TIMEOUT = 'timeout';
+
+const streamOllama = async ({ url, model, prompt, temperature, maxTokens, signal, onText }) => {
+  const response = await fetch(`${url}/api/generate`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({
+      model: model,
+      prompt: prompt,
+      stream: true,
+      options: {
+        temperature: temperature,
+        num_predict: maxTokens
+      }
+    }),
+    signal
+  });
+
+  if (!response.ok) {
+    throw new Error(`HTTP ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  let text = '';
+  
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const lines = buffered.split('\n');
+    buffered = lines.pop();
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const chunk = JSON.parse(line);
+      if (chunk.error) throw new Error(chunk.error);
+      if (chunk.response) {
+        text += chunk.response;
+        onText(text);
+      }
+      if (chunk.done) return text;
+    }
+  }
+  return text;
+};
+
+// ============ Messages ============
+
+let lastMessageId = 0;
+const nextMessageId = () => (lastMessageId = Math.max(Date.now(), lastMessageId + 1));
+
+const formatTime = () => new Date().toLocaleTimeString('en-US', { hour: 'numeric', minute: '2-digit' });
+
+const makeMessage = (character, text, isBot) => ({ id: nextMessageId(), character, text, isBot, time: formatTime() });
+
+const makeGreeting = (character) => makeMessage(character, "Hello! I'm your AI assistant. How can I help you today?", true);
+
+const MessageBubble = React.memo(function MessageBubble({ message, characterName }) {
+  return (
+    <div className={`flex ${message.isBot ? 'justify-start' : 'justify-end'}`}>
+      <div className={`max-w-[80%] ${message.isBot ? 'order-1' : 'order-2'}`}>
+        {message.isBot && (
+          <div className="flex items-center gap-2 mb-1 px-2">
+            <Bot size={14} className="text-blue-400" />
+            <span className="text-xs text-gray-400">{characterName}</span>
+          </div>
+        )}
+        <div
+          className={`rounded-2xl px-4 py-2 ${
+            message.isBot
+              ? 'bg-gradient-to-br from-blue-600 to-purple-600 text-white rounded-tl-md'
+              : 'bg-gray-700 text-gray-100 rounded-br-md'
+          }`}
+        >
+          <p className="text-sm break-words whitespace-pre-wrap">{message.text}</p>
+        </div>
+        <div
+          className={`text-xs text-gray-500 mt-1 px-2 ${
+            message.isBot ? 'text-left' : 'text-right'
+          }`}
+        >
+          {message.time}
+        </div>
+      </div>
+    </div>
+  );
+});
+
+const TypingIndicator = React.memo(function TypingIndicator({ characterName }) {
+  return (
+    <div className="flex justify-start">
+      <div className="max-w-[80%]">
+        <div className="flex items-center gap-2 mb-1 px-2">
+          <Bot size={14} className="text-blue-400" />
+          <span className="text-xs text-gray-400">{characterName}</span>
+        </div>
+        <div className="bg-gradient-to-br from-blue-600 to-purple-600 text-white rounded-2xl rounded-tl-md px-4 py-3">
+          <div className="flex gap-1">
+            <span className="w-2 h-2 bg-white rounded-full animate-bounce" style={{ animationDelay: '0ms' }}></span>
+            <span className="w-2 h-2 bg-white rounded-full animate-bounce" style={{ animationDelay: '150ms' }}></span>
+            <span className="w-2 h-2 bg-white rounded-full animate-bounce" style={{ animationDelay: '300ms' }}></span>
+          </div>
+        </div>
+      </div>
+    </div>
+  );
+});
+
+// ============ Virtualized message list ============
+// Only rows near the viewport are mounted; the rest are replaced by two spacers sized
+// from measured row heights (estimated until a row has been seen).
+
+const ESTIMATED_ROW_HEIGHT = 72;
+const OVERSCAN_PX = 600;
+const STICK_TO_BOTTOM_PX = 80;
+
+const MeasuredRow = ({ id, onHeight, children }) => {
+  const ref = useRef(null);
+  
+  useLayoutEffect(() => {
+    const el = ref.current;
+    const report = () => onHeight(id, el.offsetHeight);
+    report();
+    if (typeof ResizeObserver === 'undefined') return;
+    const observer = new ResizeObserver(report);
+    observer.observe(el);
+    return () => observer.disconnect();
+  }, [id, onHeight]);
+  
+  return <div ref={ref} className="pb-3">{children}</div>;
+};
+
+const VirtualMessageList = React.memo(function VirtualMessageList({ messages, characterName, isTyping }) {
+  const scrollRef = useRef(null);
+  const heights = useRef(new Map());
+  const stickToBottom = useRef(true);
+  const scrollFrame = useRef(0);
+  const layoutFrame = useRef(0);
+  const [viewport, setViewport] = useState({ top: 0, height: 0 });
+  const [layoutVersion, setLayoutVersion] = useState(0);
+  
+  const onHeight = useCallback((id, height) => {
+    if (heights.current.get(id) === height) return;
+    heights.current.set(id, height);
+    if (!layoutFrame.current) {
+      layoutFrame.current = requestAnimationFrame(() => {
+        layoutFrame.current = 0;
+        setLayoutVersion(v => v + 1);
+      });
+    }
+  }, []);
+  
+  const offsets = useMemo(() => {
+    const result = new Array(messages.length + 1);
+    result[0] = 0;
+    messages.forEach((m, i) => {
+      result[i + 1] = result[i] + (heights.current.get(m.id) ?? ESTIMATED_ROW_HEIGHT);
+    });
+    return result;
+  }, [messages, layoutVersion]);
+  
+  // Index of the last row starting at or above `offset`.
+  const rowAt = (offset) => {
+    let lo = 0;
+    let hi = messages.length;
+    while (lo < hi) {
+      const mid = (lo + hi + 1) >> 1;
+      if (offsets[mid] <= offset) lo = mid;
+      else hi = mid - 1;
+    }
+    return lo;
+  };
+  
+  const start = Math.max(0, Math.min(messages.length - 1, rowAt(viewport.top - OVERSCAN_PX)));
+  const end = Math.min(messages.length, rowAt(viewport.top + viewport.height + OVERSCAN_PX) + 1);
+  
+  const updateViewport = () => {
+    const el = scrollRef.current;
+    if (!el) return;
+    setViewport(prev => (prev.top === el.scrollTop && prev.height === el.clientHeight)
+      ? prev
+      : { top: el.scrollTop, height: el.clientHeight });
+  };
+  
+  const onScroll = () => {
+    const el = scrollRef.current;
+    stickToBottom.current = el.scrollHeight - el.scrollTop - el.clientHeight < STICK_TO_BOTTOM_PX;
+    if (!scrollFrame.current) {
+      scrollFrame.current = requestAnimationFrame(() => {
+        scrollFrame.current = 0;
+        updateViewport();
+      });
+    }
+  };
+  
+  useLayoutEffect(() => {
+    updateViewport();
+    if (typeof ResizeObserver === 'undefined') return;
+    const observer = new ResizeObserver(updateViewport);
+    observer.observe(scrollRef.current);
+    return () => {
+      observer.disconnect();
+      cancelAnimationFrame(scrollFrame.current);
+      cancelAnimationFrame(layoutFrame.current);
+    };
+  }, []);
+  
+  useLayoutEffect(() => {
+    const el = scrollRef.current;
+    if (stickToBottom.current && el) {
+      el.scrollTop = el.scrollHeight;
+    }
+  }, [messages, isTyping, layoutVersion]);
+  
+  return (
+    <div ref={scrollRef} onScroll={onScroll} className="flex-1 overflow-y-auto p-4 bg-gray-800">
+      <div style={{ height: offsets[start] }} />
+      {messages.slice(start, end).map((message) => (
+        <MeasuredRow key={message.id} id={message.id} onHeight={onHeight}>
+          <MessageBubble message={message} characterName={characterName} />
+        </MeasuredRow>
+      ))}
+      <div style={{ height: offsets[messages.length] - offsets[end] }} />
+      {isTyping && <TypingIndicator characterName={characterName} />}
+    </div>
+  );
+});
 
 export default function ELIZAChatInterface() {
-  const [messages, setMessages] = useState([
-    { id: 1, text: "Hello! I'm your AI assistant. How can I help you today?", isBot: true, time: new Date().toLocaleTimeString('en-US', { hour: 'numeric', minute: '2-digit' }) }
-  ]);
+  const [messages, setMessages] = useState(() => [makeGreeting('AI Assistant')]);
   const [inputText, setInputText] = useState('');
-  const [isTyping, setIsTyping] = useState(false);
+  const [isTyping, setIsTyping] = useState(false);          // waiting for the first token
+  const [isGenerating, setIsGenerating] = useState(false);  // a reply is in flight
   const [showSettings, setShowSettings] = useState(false);
   const [showMemory, setShowMemory] = useState(false);
   const [showMenu, setShowMenu] = useState(false);
@@ -22,8 +322,9 @@ export default function ELIZAChatInterface() {
   // Character and memory
   const [characterName, setCharacterName] = useState('AI Assistant');
   const [characterPersonality, setCharacterPersonality] = useState('Helpful, friendly, and knowledgeable assistant');
-  const [conversationHistory, setConversationHistory] = useState([]);
+  const [histories, setHistories] = useState({});
   const [memories, setMemories] = useState([]);
+  const conversationHistory = histories[characterName] || [];
   
   // Character management
   const [characters, setCharacters] = useState({
@@ -43,11 +344,77 @@ export default function ELIZAChatInterface() {
   const [backendStatus, setBackendStatus] = useState('Checking...');
   const [availableModels, setAvailableModels] = useState([]);
   
-  const chatEndRef = useRef(null);
+  // The in-flight reply's controller; set synchronously so a double Enter can't start a second request.
+  const inflight = useRef(null);
+  
+  useEffect(() => () => inflight.current?.abort(ABORT_STOPPED), []);
+  
+  // Restored from IndexedDB on mount; nothing is written back until this is done.
+  const [hydrated, setHydrated] = useState(false);
+  const persistedMessages = useRef(new WeakSet());
+  // Whose messages the list holds right now; a reply streaming for someone else stays out of it.
+  const shownCharacter = useRef(characterName);
+  
+  const showMessages = (loaded, character) => {
+    shownCharacter.current = character;
+    if (loaded.length === 0) {
+      setMessages([makeGreeting(character)]);
+      return;
+    }
+    loaded.forEach(m => persistedMessages.current.add(m));
+    lastMessageId = Math.max(lastMessageId, loaded[loaded.length - 1].id);
+    setMessages(loaded);
+  };
   
   useEffect(() => {
-    chatEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [messages, isTyping]);
+    let cancelled = false;
+    (async () => {
+      try {
+        const [settings, storedCharacters, active, storedMemories, storedHistories] = await Promise.all(
+          ['settings', 'characters', 'active', 'memories', 'histories'].map(loadState)
+        );
+        if (cancelled) return;
+        if (settings) {
+          setOllamaUrl(settings.ollamaUrl);
+          setModel(settings.model);
+          setTemperature(settings.temperature);
+          setMaxTokens(settings.maxTokens);
+        }
+        if (storedCharacters) setCharacters(storedCharacters);
+        if (storedMemories) setMemories(storedMemories);
+        if (storedHistories) setHistories(storedHistories);
+        const name = active?.characterName || characterName;
+        if (active) {
+          setCharacterName(active.characterName);
+          setCharacterPersonality(active.characterPersonality);
+        }
+        const loaded = await loadMessages(name);
+        if (!cancelled) showMessages(loaded, name);
+      } catch (error) {
+        console.warn('Could not restore saved chats:', error);
+      } finally {
+        if (!cancelled) setHydrated(true);
+      }
+    })();
+    return () => { cancelled = true; };
+  }, []);
+  
+  // Incremental writes: only messages that are new or were replaced since the last save.
+  useEffect(() => {
+    if (!hydrated) return;
+    const changed = messages.filter(m => !m.streaming && !persistedMessages.current.has(m));
+    if (changed.length === 0) return;
+    changed.forEach(m => persistedMessages.current.add(m));
+    putMessages(changed).catch(error => console.warn('Could not save messages:', error));
+  }, [messages, hydrated]);
+  
+  const settings = useMemo(() => ({ ollamaUrl, model, temperature, maxTokens }), [ollamaUrl, model, temperature, maxTokens]);
+  const active = useMemo(() => ({ characterName, characterPersonality }), [characterName, characterPersonality]);
+  usePersistedValue('settings', settings, hydrated);
+  usePersistedValue('active', active, hydrated);
+  usePersistedValue('characters', characters, hydrated);
+  usePersistedValue('memories', memories, hydrated);
+  usePersistedValue('histories', histories, hydrated);
 
   const extractMemories = (userMessage, botResponse) => {
     const userLower = userMessage.toLowerCase();
@@ -112,85 +479,117 @@ export default function ELIZAChatInterface() {
     return prompt;
   };
 
-  const callOllama = async (prompt) => {
+  const callOllama = async (prompt, controller, onText) => {
+    let timer = setTimeout(() => controller.abort(ABORT_TIMEOUT), FIRST_TOKEN_TIMEOUT_MS);
     try {
-      const response = await fetch(`${ollamaUrl}/api/generate`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          model: model,
-          prompt: prompt,
-          stream: false,
-          options: {
-            temperature: temperature,
-            num_predict: maxTokens
-          }
-        })
+      return await streamOllama({
+        url: ollamaUrl,
+        model,
+        prompt,
+        temperature,
+        maxTokens,
+        signal: controller.signal,
+        onText: (text) => {
+          clearTimeout(timer);
+          timer = setTimeout(() => controller.abort(ABORT_TIMEOUT), STREAM_IDLE_TIMEOUT_MS);
+          onText(text);
+        }
       });
-
-      if (!response.ok) {
-        throw new Error(`HTTP ${response.status}`);
-      }
-
-      const data = await response.json();
-      return data.response.trim();
     } catch (error) {
+      if (controller.signal.reason === ABORT_STOPPED) throw error;
       console.error('Ollama error:', error);
       throw new Error(
-        error.message.includes('Failed to fetch') 
-          ? "Can't connect to Ollama. Make sure it's running on " + ollamaUrl
-          : `Ollama error: ${error.message}`
+        controller.signal.reason === ABORT_TIMEOUT
+          ? `Ollama stopped responding (${ollamaUrl})`
+          : error.message.includes('Failed to fetch')
+            ? "Can't connect to Ollama. Make sure it's running on " + ollamaUrl
+            : `Ollama error: ${error.message}`
       );
+    } finally {
+      clearTimeout(timer);
     }
   };
 
   const handleSend = async () => {
-    if (!inputText.trim() || isTyping) return;
+    if (!inputText.trim() || inflight.current) return;
     
+    const controller = new AbortController();
+    inflight.current = controller;
+    
+    // The reply belongs to whoever was asked, even if the user switches characters mid-stream.
+    const character = characterName;
     const userMessage = inputText.trim();
-    const userMsg = {
-      id: messages.length + 1,
-      text: userMessage,
-      isBot: false,
-      time: new Date().toLocaleTimeString('en-US', { hour: 'numeric', minute: '2-digit' })
-    };
+    const userMsg = makeMessage(character, userMessage, false);
+    const botMsg = { ...makeMessage(character, '', true), streaming: true };
     
+    shownCharacter.current = character;   // the list on screen is the one this exchange goes into
     setMessages(prev => [...prev, userMsg]);
     setInputText('');
     setIsTyping(true);
+    setIsGenerating(true);
+    
+    // Streamed text is flushed into the message list at most once per frame.
+    let latest = '';
+    let frame = 0;
+    const showReply = (fields) => {
+      if (shownCharacter.current !== character) {
+        // Switched away: the list holds another chat, so save the finished reply directly.
+        if (fields.streaming === false) {
+          putMessages([{ ...botMsg, ...fields }]).catch(error => console.warn('Could not save messages:', error));
+        }
+        return;
+      }
+      setMessages(prev => {
+        const index = prev.findLastIndex(m => m.id === botMsg.id);
+        if (index === -1) return [...prev, { ...botMsg, ...fields }];
+        const next = prev.slice();
+        next[index] = { ...prev[index], ...fields };
+        return next;
+      });
+    };
+    const onText = (text) => {
+      latest = text;
+      if (!frame) {
+        frame = requestAnimationFrame(() => {
+          frame = 0;
+          setIsTyping(false);
+          showReply({ text: latest });
+        });
+      }
+    };
 
     try {
       const prompt = buildPrompt(userMessage);
-      const botResponseText = await callOllama(prompt);
-      
-      const botMsg = {
-        id: messages.length + 2,
-        text: botResponseText,
-        isBot: true,
-        time: new Date().toLocaleTimeString('en-US', { hour: 'numeric', minute: '2-digit' })
-      };
+      const botResponseText = (await callOllama(prompt, controller, onText)).trim();
       
-      setMessages(prev => [...prev, botMsg]);
-      setConversationHistory(prev => [...prev, [userMessage, botResponseText]].slice(-10));
+      showReply({ text: botResponseText, streaming: false });
+      setHistories(prev => ({
+        ...prev,
+        [character]: [...(prev[character] || []), [userMessage, botResponseText]].slice(-10)
+      }));
       
       // Extract memories
       extractMemories(userMessage, botResponseText);
       
     } catch (error) {
-      const errorMsg = {
-        id: messages.length + 2,
-        text: `❌ ${error.message}`,
-        isBot: true,
-        time: new Date().toLocaleTimeString('en-US', { hour: 'numeric', minute: '2-digit' })
-      };
-      setMessages(prev => [...prev, errorMsg]);
+      if (controller.signal.reason === ABORT_STOPPED) {
+        // Keep what arrived, but don't learn from or build on a reply the user cut off.
+        showReply({ text: latest.trim() ? `${latest.trim()} ⏹️` : '⏹️ Stopped', streaming: false });
+      } else {
+        showReply({ text: latest.trim() ? `${latest.trim()}\n\n❌ ${error.message}` : `❌ ${error.message}`, streaming: false });
+      }
     } finally {
+      cancelAnimationFrame(frame);
+      inflight.current = null;
       setIsTyping(false);
+      setIsGenerating(false);
     }
   };
 
+  const stopGenerating = () => {
+    inflight.current?.abort(ABORT_STOPPED);
+  };
+
   const handleKeyPress = (e) => {
     if (e.key === 'Enter' && !e.shiftKey) {
       e.preventDefault();
@@ -199,10 +598,9 @@ export default function ELIZAChatInterface() {
   };
 
   const clearChat = () => {
-    setMessages([
-      { id: 1, text: "Hello! I'm your AI assistant. How can I help you today?", isBot: true, time: new Date().toLocaleTimeString('en-US', { hour: 'numeric', minute: '2-digit' }) }
-    ]);
-    setConversationHistory([]);
+    deleteMessages(characterName).catch(error => console.warn('Could not delete messages:', error));
+    setMessages([makeGreeting(characterName)]);
+    setHistories(prev => ({ ...prev, [characterName]: [] }));
   };
 
   const clearMemories = () => {
@@ -212,7 +610,7 @@ export default function ELIZAChatInterface() {
   const checkBackend = async () => {
     setBackendStatus('Checking...');
     try {
-      const response = await fetch(`${ollamaUrl}/api/tags`, { timeout: 2000 });
+      const response = await fetch(`${ollamaUrl}/api/tags`, { signal: AbortSignal.timeout(BACKEND_CHECK_TIMEOUT_MS) });
       if (response.ok) {
         const data = await response.json();
         setAvailableModels(data.models.map(m => m.name));
@@ -262,6 +660,11 @@ export default function ELIZAChatInterface() {
       const newChars = {...characters};
       delete newChars[name];
       setCharacters(newChars);
+      deleteMessages(name).catch(error => console.warn('Could not delete messages:', error));
+      setHistories(prev => {
+        const { [name]: _removed, ...rest } = prev;
+        return rest;
+      });
       
       if (characterName === name) {
         setCharacterName('AI Assistant');
@@ -275,7 +678,9 @@ export default function ELIZAChatInterface() {
     setCharacterName(char.name);
     setCharacterPersonality(char.personality);
     setShowMenu(false);
-    clearChat();
+    loadMessages(char.name)
+      .then(loaded => showMessages(loaded, char.name))
+      .catch(() => showMessages([], char.name));
   };
 
   const closeAllPanels = () => {
@@ -581,7 +986,7 @@ export default function ELIZAChatInterface() {
                 <div className="font-semibold">{characterName}</div>
                 <div className="text-xs text-green-400 flex items-center gap-1">
                   <span className="w-2 h-2 bg-green-400 rounded-full animate-pulse"></span>
-                  {isTyping ? 'Typing...' : 'Online'}
+                  {isGenerating ? 'Typing...' : 'Online'}
                 </div>
               </div>
             </div>
@@ -687,59 +1092,7 @@ export default function ELIZAChatInterface() {
           </div>
 
           {/* Messages */}
-          <div className="flex-1 overflow-y-auto p-4 space-y-3 bg-gray-800">
-            {messages.map((message) => (
-              <div
-                key={message.id}
-                className={`flex ${message.isBot ? 'justify-start' : 'justify-end'}`}
-              >
-                <div className={`max-w-[80%] ${message.isBot ? 'order-1' : 'order-2'}`}>
-                  {message.isBot && (
-                    <div className="flex items-center gap-2 mb-1 px-2">
-                      <Bot size={14} className="text-blue-400" />
-                      <span className="text-xs text-gray-400">{characterName}</span>
-                    </div>
-                  )}
-                  <div
-                    className={`rounded-2xl px-4 py-2 ${
-                      message.isBot
-                        ? 'bg-gradient-to-br from-blue-600 to-purple-600 text-white rounded-tl-md'
-                        : 'bg-gray-700 text-gray-100 rounded-br-md'
-                    }`}
-                  >
-                    <p className="text-sm break-words whitespace-pre-wrap">{message.text}</p>
-                  </div>
-                  <div
-                    className={`text-xs text-gray-500 mt-1 px-2 ${
-                      message.isBot ? 'text-left' : 'text-right'
-                    }`}
-                  >
-                    {message.time}
-                  </div>
-                </div>
-              </div>
-            ))}
-            
-            {/* Typing indicator */}
-            {isTyping && (
-              <div className="flex justify-start">
-                <div className="max-w-[80%]">
-                  <div className="flex items-center gap-2 mb-1 px-2">
-                    <Bot size={14} className="text-blue-400" />
-                    <span className="text-xs text-gray-400">{characterName}</span>
-                  </div>
-                  <div className="bg-gradient-to-br from-blue-600 to-purple-600 text-white rounded-2xl rounded-tl-md px-4 py-3">
-                    <div className="flex gap-1">
-                      <span className="w-2 h-2 bg-white rounded-full animate-bounce" style={{ animationDelay: '0ms' }}></span>
-                      <span className="w-2 h-2 bg-white rounded-full animate-bounce" style={{ animationDelay: '150ms' }}></span>
-                      <span className="w-2 h-2 bg-white rounded-full animate-bounce" style={{ animationDelay: '300ms' }}></span>
-                    </div>
-                  </div>
-                </div>
-              </div>
-            )}
-            <div ref={chatEndRef} />
-          </div>
+          <VirtualMessageList messages={messages} characterName={characterName} isTyping={isTyping} />
 
           {/* Input */}
           <div className="bg-gray-900 border-t border-gray-700 p-3 flex items-center gap-2">
@@ -750,19 +1103,29 @@ export default function ELIZAChatInterface() {
               onKeyPress={handleKeyPress}
               placeholder="Message AI Assistant..."
               className="flex-1 bg-gray-700 text-white placeholder-gray-400 rounded-full px-4 py-2 text-sm focus:outline-none focus:ring-2 focus:ring-blue-500"
-              disabled={isTyping}
+              disabled={isGenerating}
             />
-            <button
-              onClick={handleSend}
-              disabled={isTyping || !inputText.trim()}
-              className={`rounded-full p-2 transition ${
-                inputText.trim() && !isTyping
-                  ? 'bg-gradient-to-br from-blue-600 to-purple-600 text-white hover:from-blue-700 hover:to-purple-700'
-                  : 'bg-gray-700 text-gray-500 cursor-not-allowed'
-              }`}
-            >
-              <Send size={20} />
-            </button>
+            {isGenerating ? (
+              <button
+                onClick={stopGenerating}
+                className="rounded-full p-2 transition bg-red-600 text-white hover:bg-red-700"
+                title="Stop generating"
+              >
+                <Square size={20} />
+              </button>
+            ) : (
+              <button
+                onClick={handleSend}
+                disabled={!inputText.trim()}
+                className={`rounded-full p-2 transition ${
+                  inputText.trim()
+                    ? 'bg-gradient-to-br from-blue-600 to-purple-600 text-white hover:from-blue-700 hover:to-purple-700'
+                    : 'bg-gray-700 text-gray-500 cursor-not-allowed'
+                }`}
+              >
+                <Send size={20} />
+              </button>
+            )}
           </div>
         </div>
       </div>
@@ -11,38 +11,142 @@ CHANGELOG v0.6:
 
 Requirements:
 pip install gradio requests
+Optional: pip install watchdog   (inotify-based character hot reload; polls without it)
 """
 
-import gradio as gr
+import time
+_PROCESS_START = time.perf_counter()
+
+import asyncio
+import gzip
+import hashlib
+import importlib
 import json
+import math
+import multiprocessing
 import os
 import requests
+import socket
+import sqlite3
+import sys
+import threading
+import urllib3
+import zipfile
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
 import re
 
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+class _LazyModule:
+    """Imports a module on first attribute access, so CLI and headless runs never load gradio."""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+gr = _LazyModule("gradio")
+
 # ============ CONFIGURATION ============
 
 VERSION = "0.6"
 APP_NAME = "ELIZA"
 
 LLM_BACKENDS = {
-    'ollama': {'url': 'http://localhost:11434', 'name': 'Ollama'},
+    'ollama': {'url': os.environ.get("ELIZA_OLLAMA_URL", 'http://localhost:11434'), 'name': 'Ollama'},
     'lm_studio': {'url': 'http://localhost:1234', 'name': 'LM Studio'},
     'text_gen_webui': {'url': 'http://localhost:5000', 'name': 'Text Generation WebUI'}
 }
 
+CHARACTERS_DIR = "characters"
+CHARACTER_INDEX_FILE = f"{CHARACTERS_DIR}/.index.json"   # startup cache of parsed characters, validated by mtime
+STATE_STORE_URL = os.environ.get("ELIZA_STATE_STORE", "files")   # "files" or "sqlite:///eliza.db"
+STATE_SYNC_INTERVAL = 1.0       # seconds between checks for writes made by other workers
+HISTORY_LIMIT = 100             # chat turns kept per character
+STARTUP_TARGET_SECONDS = float(os.environ.get("ELIZA_STARTUP_TARGET", "5.0"))
+PARALLEL_LOAD_THRESHOLD = 200   # character files before startup switches to a process pool
+BULK_CHUNK_SIZE = 256           # archive records handed to the pool per batch
+WATCH_DEBOUNCE_SECONDS = 1.0    # quiet period before a burst of file changes is applied
+WATCH_POLL_INTERVAL = 2.0       # rescan interval when inotify (watchdog) is unavailable
+UI_REFRESH_INTERVAL = 15.0      # how often each open tab checks for reloaded characters and model load state
+MODEL_KEEP_ALIVE = os.environ.get("ELIZA_KEEP_ALIVE", "30m")   # how long Ollama keeps a warm model; -1 pins it
+MODEL_STATUS_TTL = 10.0         # seconds to cache Ollama's loaded-model list
+PREFETCH_MIN_INTERVAL = 5.0     # minimum seconds between speculative prompt prefills per model
+SCENES_DIR = "scenes"
+SCENE_TRANSCRIPT_LINES = 20     # shared transcript lines each speaker sees
+SCENE_MAX_LINES = 300           # transcript lines kept on disk per scene
+SCENE_MODES = [("Everyone replies at once", "parallel"),
+               ("Only mentioned characters (everyone if none)", "mentioned"),
+               ("Round robin, one speaker per message", "round_robin")]
+API_PREFIX = "/v1"
+API_CORS_ORIGINS = [o.strip() for o in os.environ.get("ELIZA_API_CORS", "").split(",") if o.strip()]
+BATCH_CONCURRENCY = int(os.environ.get("ELIZA_BATCH_CONCURRENCY", os.environ.get("OLLAMA_NUM_PARALLEL", "4")))
+BACKEND_CONCURRENCY = int(os.environ.get("ELIZA_BACKEND_CONCURRENCY", os.environ.get("OLLAMA_NUM_PARALLEL", "4")))   # generations in flight per backend
+ADMISSION_QUEUE_LIMIT = int(os.environ.get("ELIZA_QUEUE_LIMIT", "32"))   # waiting generations before new ones are turned away
+ADMISSION_MAX_WAIT = float(os.environ.get("ELIZA_QUEUE_MAX_WAIT", "60"))   # seconds a generation may wait for a slot before giving up
+DEGRADE_QUEUE_DEPTH = int(os.environ.get("ELIZA_DEGRADE_DEPTH", "4"))   # waiting generations before replies get shorter; 0 disables
+DEGRADE_MIN_TOKENS = 64         # max_tokens is never cut below this
+FALLBACK_MODEL = os.environ.get("ELIZA_FALLBACK_MODEL", "")   # smaller model used at twice the degrade depth
+UI_GENERATION_LIMIT = BACKEND_CONCURRENCY + ADMISSION_QUEUE_LIMIT   # UI generation events Gradio passes on to admission control
+TRACE_PATH = os.environ.get("ELIZA_RECORD_TRACE", "")   # append anonymized per-turn events here (JSONL)
+PROFILE_SETTING = os.environ.get("ELIZA_PROFILE", "off")   # "off", "next:N" (a window of N turns) or "every:N"
+PROFILE_ALLOCATIONS = os.environ.get("ELIZA_PROFILE_ALLOC", "") not in ("", "0")
+PROFILE_DIR = "profiles"
+PROFILE_SAMPLE_INTERVAL = 0.005   # seconds between stack samples while a turn is profiled
+PROFILE_ALLOC_TOP = 40            # allocation sites listed per profiled turn
+PROFILE_MODES = [("Off", "off"), ("Next N turns", "next"), ("Every Nth turn", "every")]
+STATIC_DIR = "static"             # self-hosted fonts go in static/fonts/ as Family-Weight.woff2 (e.g. Poppins-400.woff2)
+STATIC_ROUTE = "/eliza-static"    # versioned CSS and fonts, cached by browsers for a year
+STATIC_MAX_AGE = 365 * 24 * 3600
+LOW_MOTION_DEFAULT = os.environ.get("ELIZA_LOW_MOTION", "") not in ("", "0")   # start with the reduced-motion theme
+# End-of-turn markers per model family (name prefix before ':'), for templates that leak them into the text.
+MODEL_STOP_SEQUENCES = {"llama3": ["<|eot_id|>"], "phi3": ["<|end|>"], "qwen": ["<|im_end|>"],
+                        "gemma": ["<end_of_turn>"], "mistral": ["[INST]"]}
+try:
+    # Extra markers per family, added to the built-in ones: ELIZA_MODEL_STOPS='{"mymodel": ["###"]}'
+    for _family, _markers in json.loads(os.environ.get("ELIZA_MODEL_STOPS", "{}")).items():
+        _markers = [_markers] if isinstance(_markers, str) else [str(marker) for marker in _markers]
+        MODEL_STOP_SEQUENCES[_family] = list(dict.fromkeys(MODEL_STOP_SEQUENCES.get(_family, []) + _markers))
+except (ValueError, TypeError, AttributeError) as e:
+    print(f"⚠️ Ignoring ELIZA_MODEL_STOPS ({e}); expected JSON like '{{\"mymodel\": [\"###\"]}}'")
+MAX_CANDIDATES = 4                # alternative replies per turn ("swipes"), generated in parallel
+CANDIDATE_HOLD_LIMIT = 256        # unchosen candidate sets kept for API clients before the oldest are dropped
+MOCK_LLM_MODEL = "mock"
+MOCK_LLM_TOKENS_PER_SECOND = 30.0     # per slot, roughly a 7B model on a consumer GPU
+MOCK_LLM_PREFILL_CHARS_PER_SECOND = 4000.0
+KEEP_ALIVE_CHOICES = [("5 minutes", "5m"), ("30 minutes", "30m"), ("2 hours", "2h"),
+                      ("Pinned (never unload)", "-1"), ("Unload after each reply", "0")]
+
 # Global state
 characters = {}
 chat_histories = {}
+conversation_trees = {}         # name -> ConversationTree, or None when the character never branched (loaded lazily)
 character_memories = {}
+group_scenes = {}
 active_llm = None
 available_models = []
+model_keep_alive = MODEL_KEEP_ALIVE
+character_index_version = 0     # bumped whenever the character set changes outside a UI callback
+_known_mtimes = {}              # path -> mtime_ns as last loaded/written (None = absent); watcher skips matches
+character_stems = {}            # file stem -> character name, for files named differently from the character
+character_lock = threading.RLock()   # held while the character set changes or is listed (watcher/sync threads vs UI)
 
 # ============ ENHANCED CUSTOM CSS ============
 
 CUSTOM_CSS = """
-@import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600;700&display=swap');
-
 :root {
     --bg-primary: #0a0a0f;
     --bg-secondary: #151520;
@@ -234,6 +338,127 @@ textarea:focus, input:focus {
 }
 """
 
+# Reduced-motion / low-GPU rules. {scope} is empty inside the prefers-reduced-motion
+# media query and "body.eliza-lite " for the theme toggle in the Setup tab.
+LITE_CSS = """
+{scope}.gradio-container {
+    animation: none !important;
+    background: var(--bg-primary) !important;
+}
+
+{scope}*, {scope}*::before, {scope}*::after {
+    transition: none !important;
+    animation-duration: 0s !important;
+    animation-iteration-count: 1 !important;
+}
+
+{scope}.panel-container:hover, {scope}button.primary:hover, {scope}.stat-card:hover {
+    transform: none !important;
+}
+
+{scope}.header-container, {scope}.panel-container, {scope}.panel-container:hover, {scope}.character-avatar,
+{scope}button.primary, {scope}button.primary:hover, {scope}.memory-tag {
+    box-shadow: none !important;
+}
+"""
+
+# Applies the saved theme choice on page load and returns it for the Setup tab checkbox.
+LITE_THEME_JS = """() => {
+    const saved = localStorage.getItem('eliza-lite');
+    const lite = saved === null ? %s : saved === '1';
+    document.body.classList.toggle('eliza-lite', lite);
+    return lite;
+}""" % ("true" if LOW_MOTION_DEFAULT else "false")
+
+TOGGLE_LITE_THEME_JS = """(lite) => {
+    document.body.classList.toggle('eliza-lite', lite);
+    localStorage.setItem('eliza-lite', lite ? '1' : '0');
+}"""
+
+# ============ STATIC ASSETS ============
+
+FONT_FILE = re.compile(r"^(?P<family>[A-Za-z0-9 ]+)-(?P<weight>[1-9]00)\.(?P<ext>woff2|woff|ttf)$")
+FONT_FORMATS = {"woff2": ("font/woff2", "woff2"), "woff": ("font/woff", "woff"), "ttf": ("font/ttf", "truetype")}
+
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+class StaticAssets:
+    """The UI's CSS and fonts, served by the app itself so first paint never waits on the internet.
+    
+    Built once: the stylesheet is minified and gzipped in memory, and every URL carries
+    a hash of the file's content, so browsers may cache it for a year without
+    revalidating and a changed file simply gets a new URL.
+    """
+    
+    def __init__(self, css, fonts_dir=f"{STATIC_DIR}/fonts", route=STATIC_ROUTE):
+        self.route = route
+        self.files = {}     # versioned name -> (bytes, gzipped bytes or None, media type, etag)
+        self.fonts = []
+        font_css = self._add_fonts(fonts_dir)
+        lite_css = (f"@media (prefers-reduced-motion: reduce) {{{LITE_CSS.replace('{scope}', '')}}}"
+                    + LITE_CSS.replace("{scope}", "body.eliza-lite "))
+        self.stylesheet = self.add("eliza.css", minify_css(font_css + css + lite_css).encode(), "text/css; charset=utf-8")
+    
+    def add(self, name, data, media_type, compress=True):
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        versioned = f"{stem}.{digest}{ext}"
+        self.files[versioned] = (data, gzip.compress(data, mtime=0) if compress else None, media_type, f'"{digest}"')
+        return f"{self.route}/{versioned}"
+    
+    def _add_fonts(self, fonts_dir):
+        if not os.path.isdir(fonts_dir):
+            return ""
+        css = ""
+        for filename in sorted(os.listdir(fonts_dir)):
+            match = FONT_FILE.match(filename)
+            if not match:
+                continue
+            media_type, font_format = FONT_FORMATS[match["ext"]]
+            with open(os.path.join(fonts_dir, filename), 'rb') as f:
+                url = self.add(filename, f.read(), media_type, compress=False)
+            self.fonts.append((url, media_type))
+            css += (f"@font-face {{font-family: '{match['family']}'; font-style: normal; font-weight: {match['weight']}; "
+                    f"font-display: swap; src: url({url}) format('{font_format}');}}\n")
+        return css
+    
+    def head(self):
+        links = [f'<link rel="preload" href="{url}" as="font" type="{media_type}" crossorigin>' for url, media_type in self.fonts]
+        links.append(f'<link rel="stylesheet" href="{self.stylesheet}">')
+        return "\n".join(links)
+    
+    def serve(self, request):
+        from starlette.responses import Response
+        
+        asset = self.files.get(request.path_params["name"])
+        if asset is None:
+            return Response(status_code=404)
+        data, compressed, media_type, etag = asset
+        headers = {"Cache-Control": f"public, max-age={STATIC_MAX_AGE}, immutable", "ETag": etag, "Vary": "Accept-Encoding"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        if compressed is not None and "gzip" in request.headers.get("accept-encoding", ""):
+            data = compressed
+            headers["Content-Encoding"] = "gzip"
+        return Response(data, media_type=media_type, headers=headers)
+    
+    def routes(self):
+        from starlette.routing import Route
+        return [Route(f"{self.route}/{{name}}", self.serve, methods=["GET", "HEAD"])]
+
+_static_assets = None
+
+def get_static_assets():
+    global _static_assets
+    if _static_assets is None:
+        _static_assets = StaticAssets(CUSTOM_CSS)
+    return _static_assets
+
 # ============ BACKEND DETECTION ============
 
 class BackendDetector:
@@ -257,7 +482,7 @@ class BackendDetector:
     @staticmethod
     def get_ollama_models():
         try:
-            response = requests.get('http://localhost:11434/api/tags', timeout=2)
+            response = requests.get(f"{LLM_BACKENDS['ollama']['url']}/api/tags", timeout=2)
             if response.status_code == 200:
                 data = response.json()
                 return [model['name'] for model in data.get('models', [])]
@@ -265,30 +490,543 @@ class BackendDetector:
             pass
         return []
 
+# ============ ADMISSION CONTROL ============
+
+class Overloaded(Exception):
+    """Raised instead of queueing a generation the backend can't start in time."""
+    
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"⏳ Busy right now, retry in {retry_after} s")
+
+class AdmissionController:
+    """Caps concurrent generations per backend and queues the rest fairly.
+    
+    Waiting generations are grouped by owner (user + character) and slots are handed out
+    round robin across owners, so one chatty client or a big group scene can't starve the
+    others. Once `degrade_depth` generations are waiting, admitted ones get a smaller
+    max_tokens (and at twice that depth the fallback model) so the queue drains faster.
+    Past `queue_limit`, or after `max_wait`, callers get Overloaded with a retry estimate.
+    """
+    
+    def __init__(self, capacity=BACKEND_CONCURRENCY, queue_limit=ADMISSION_QUEUE_LIMIT,
+                 degrade_depth=DEGRADE_QUEUE_DEPTH, max_wait=ADMISSION_MAX_WAIT):
+        self.capacity = max(1, capacity)
+        self.queue_limit = queue_limit
+        self.degrade_depth = degrade_depth
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active = {}   # backend -> generations in flight
+        self._queues = {}   # backend -> OrderedDict(owner -> deque of waiting tickets)
+        self._hold = {}     # backend -> moving average of seconds a slot is held
+    
+    def _waiting(self, backend):
+        return sum(len(tickets) for tickets in self._queues.get(backend, {}).values())
+    
+    def _retry_after(self, backend):
+        hold = self._hold.get(backend, 10.0)
+        return max(1, math.ceil(hold * (self._waiting(backend) + 1) / self.capacity))
+    
+    def _dispatch(self, backend):
+        queues = self._queues.get(backend)
+        while queues and self._active.get(backend, 0) < self.capacity:
+            owner, tickets = queues.popitem(last=False)
+            ticket = tickets.popleft()
+            if tickets:
+                queues[owner] = tickets   # back of the line: round robin across owners
+            ticket['depth'] = self._waiting(backend)
+            ticket['granted'] = True
+            self._active[backend] = self._active.get(backend, 0) + 1
+        self._cond.notify_all()
+    
+    def _withdraw(self, backend, owner, ticket):
+        queues = self._queues.get(backend, {})
+        tickets = queues.get(owner)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del queues[owner]
+    
+    def degrade(self, depth, model, max_tokens):
+        """Shorter replies, then a smaller model, as the queue behind this generation grows."""
+        if not self.degrade_depth or depth < self.degrade_depth:
+            return model, max_tokens
+        if max_tokens > DEGRADE_MIN_TOKENS:
+            max_tokens = max(DEGRADE_MIN_TOKENS, int(max_tokens) * self.degrade_depth // (depth + 1))
+        if FALLBACK_MODEL and depth >= 2 * self.degrade_depth:
+            model = FALLBACK_MODEL
+        return model, max_tokens
+    
+    @contextmanager
+    def slot(self, backend, owner, model, max_tokens, cancel=None):
+        """Hold one of the backend's slots; yields the (model, max_tokens) to use, or None if cancelled while waiting."""
+        ticket = {'granted': False, 'depth': 0}
+        with self._cond:
+            if self._active.get(backend, 0) >= self.capacity and self._waiting(backend) >= self.queue_limit:
+                raise Overloaded(self._retry_after(backend))
+            self._queues.setdefault(backend, OrderedDict()).setdefault(owner, deque()).append(ticket)
+            self._dispatch(backend)
+            
+            deadline = time.monotonic() + self.max_wait
+            while not ticket['granted']:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(backend, owner, ticket)
+                    raise Overloaded(self._retry_after(backend))
+                if cancel is not None and cancel.is_set():
+                    self._withdraw(backend, owner, ticket)
+                    break
+                self._cond.wait(min(remaining, 0.25))
+        
+        if not ticket['granted']:
+            yield None
+            return
+        
+        started = time.monotonic()
+        try:
+            yield self.degrade(ticket['depth'], model, max_tokens)
+        finally:
+            held = time.monotonic() - started
+            with self._cond:
+                self._active[backend] -= 1
+                self._hold[backend] = 0.8 * self._hold.get(backend, held) + 0.2 * held
+                self._dispatch(backend)
+    
+    def busy(self, backend):
+        with self._cond:
+            return self._active.get(backend, 0) >= self.capacity
+    
+    def spare(self, backend):
+        """Slots nobody is using or waiting for."""
+        with self._cond:
+            return max(0, self.capacity - self._active.get(backend, 0) - self._waiting(backend))
+    
+    def status(self, backend):
+        with self._cond:
+            return {
+                "active": self._active.get(backend, 0),
+                "waiting": self._waiting(backend),
+                "capacity": self.capacity,
+                "retry_after": self._retry_after(backend)
+            }
+
+admission = AdmissionController()
+
 # ============ AI CLIENT ============
 
+def keep_alive_value(keep_alive):
+    """Ollama reads bare numbers as seconds (negative = forever) and strings as durations like '30m'."""
+    try:
+        return int(keep_alive)
+    except (TypeError, ValueError):
+        return keep_alive
+
+class StopScanner:
+    """Cuts streamed text at the first stop sequence.
+    
+    The backend is asked to stop too, but not every backend or template honours that,
+    so text is checked as it arrives. A tail that could be the start of a stop sequence
+    is held back until the next piece shows whether it is one.
+    """
+    
+    def __init__(self, stops):
+        self.stops = [stop for stop in stops if stop]
+        self.hold = max((len(stop) for stop in self.stops), default=1) - 1
+        self.buffer = ""
+        self.stopped = False
+    
+    def feed(self, piece):
+        """Returns the text that is safe to emit; sets `stopped` once a stop sequence is seen."""
+        self.buffer += piece
+        hits = [i for i in (self.buffer.find(stop) for stop in self.stops) if i >= 0]
+        if hits:
+            self.stopped = True
+            text, self.buffer = self.buffer[:min(hits)], ""
+            return text
+        cut = max(0, len(self.buffer) - self.hold)
+        text, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return text
+    
+    def flush(self):
+        text, self.buffer = self.buffer, ""
+        return text
+
+def cut_at_stop(text, stops):
+    scanner = StopScanner(stops or [])
+    return scanner.feed(text) + ("" if scanner.stopped else scanner.flush())
+
+def split_prompt_template(template, system=""):
+    """(head, tail) around {{ .Prompt }} in an Ollama model template, rendered with the model's system prompt.
+    
+    Only the plain single-prompt form is understood: if/else on .System, .Prompt, .Messages
+    and .Tools, trim markers, and {{ .Response }} ending the render. Anything else
+    (ranges over messages, functions) returns None and the backend keeps templating.
+    """
+    truth = {".System": bool(system), ".Prompt": True, ".Messages": False, ".Tools": False}
+    parts = re.split(r"({{-?\s*.*?\s*-?}})", template)
+    for i, part in enumerate(parts):
+        if part.startswith("{{-") and i > 0:
+            parts[i - 1] = parts[i - 1].rstrip()
+        if part.endswith("-}}") and i + 1 < len(parts):
+            parts[i + 1] = parts[i + 1].lstrip()
+    
+    out, head = [], None
+    stack = []   # one flag per open block: are we emitting inside it?
+    for part in parts:
+        if not part.startswith("{{"):
+            if all(stack):
+                out.append(part)
+            continue
+        action = part.strip("{}-").strip()
+        emitting = all(stack)
+        if action.startswith("if "):
+            if emitting and action[3:].strip() not in truth:
+                return None
+            stack.append(emitting and truth.get(action[3:].strip(), False))
+        elif action.startswith(("range ", "with ", "block ")):
+            if emitting:
+                return None
+            stack.append(False)
+        elif action.startswith("else"):
+            if not stack or (action != "else" and all(stack[:-1])):
+                return None
+            stack[-1] = action == "else" and not stack[-1] and all(stack[:-1])
+        elif action == "end":
+            if not stack:
+                return None
+            stack.pop()
+        elif not emitting:
+            continue
+        elif action == ".System":
+            out.append(system)
+        elif action == ".Prompt" and head is None:
+            head, out = "".join(out), []
+        elif action == ".Response":
+            break
+        else:
+            return None
+    if head is None:
+        return None
+    return head, "".join(out)
+
+class PromptTemplates:
+    """Per-model prompt templates, applied here so a prompt prefix can be sent with the same wrapping.
+    
+    Ollama wraps a non-raw prompt in the model template, whose tail (the assistant header)
+    lands right after the text. A prefix sent that way never matches the start of the real
+    request, so its KV cache can't be reused. Rendering the template (and the Modelfile's
+    system prompt) locally and sending both raw keeps them token-for-token identical up to
+    the user's message. Only requests that extend a prefetched prefix are sent this way;
+    everything else is a plain prompt templated by Ollama, and no template is ever looked
+    up unless prefetching is on.
+    """
+    
+    def __init__(self):
+        self._parts = {}   # (url, model) -> (head, tail), or None when the template can't be rendered here
+        self._lock = threading.Lock()
+    
+    def parts(self, url, model):
+        key = (url, model)
+        with self._lock:
+            if key in self._parts:
+                return self._parts[key]
+        try:
+            response = requests.post(f"{url}/api/show", json={"model": model}, timeout=5)
+            shown = response.json() if response.ok else {}
+        except Exception:
+            return None   # not cached: the backend may be down or still pulling the model
+        template, system = shown.get("template"), shown.get("system") or ""
+        parts = split_prompt_template(template, system) if isinstance(template, str) else None
+        with self._lock:
+            self._parts[key] = parts
+        return parts
+    
+    def request_fields(self, url, model, prompt):
+        """The prompt fields of a generate request: rendered and raw if it extends the prefetched prefix."""
+        prefix = prompt_prefetcher.warmed_prefix(model)
+        if not prefix or not prompt.startswith(prefix):
+            return {"prompt": prompt}
+        with self._lock:
+            parts = self._parts.get((url, model))   # looked up by the prefetch; None if it couldn't render
+        if parts is None:
+            return {"prompt": prompt}
+        head, tail = parts
+        return {"prompt": head + prompt + tail, "raw": True}
+    
+    def prefix_fields(self, url, model, prefix):
+        """Fields for prefilling just `prefix`, or None when it couldn't match the real request."""
+        parts = self.parts(url, model)
+        if parts is None:
+            return None
+        return {"prompt": parts[0] + prefix, "raw": True}
+
+prompt_templates = PromptTemplates()
+
+_checkout = threading.local()   # where the pools below report the connection a streaming_post is using
+
+class _ReportingPool:
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        holder = getattr(_checkout, 'holder', None)
+        if holder is not None:
+            holder['conn'] = conn
+        return conn
+
+class _ReportingHTTPPool(_ReportingPool, urllib3.HTTPConnectionPool):
+    pass
+
+class _ReportingHTTPSPool(_ReportingPool, urllib3.HTTPSConnectionPool):
+    pass
+
+def _reporting_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=32)
+    adapter.poolmanager.pool_classes_by_scheme = {"http": _ReportingHTTPPool, "https": _ReportingHTTPSPool}
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_stream_http = _reporting_session()
+
+@contextmanager
+def streaming_post(url, cancel=None, **kwargs):
+    """A streamed POST that `cancel` can cut at any point, not just between lines of the body.
+    
+    Ollama sends no headers until prefill is done, so a stop during prefill (or while
+    waiting to connect) would otherwise wait for the first token. A watcher shuts the
+    socket down as soon as `cancel` is set; the blocked read fails, and the backend sees
+    the client go and stops working on the request. Yields the response.
+    """
+    holder = {}
+    done = threading.Event()
+    
+    def watch():
+        while not done.wait(0.05):
+            sock = getattr(holder.get('conn'), 'sock', None)
+            if cancel.is_set() and sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+    
+    if cancel is not None:
+        threading.Thread(target=watch, name="stream-cancel", daemon=True).start()
+    try:
+        _checkout.holder = holder
+        try:
+            response = _stream_http.post(url, stream=True, **kwargs)
+        finally:
+            _checkout.holder = None
+        with response:
+            yield response
+    finally:
+        done.set()
+
 class LocalLLMClient:
-    def __init__(self, backend_key):
+    def __init__(self, backend_key, session=None):
         self.backend = backend_key
         self.url = LLM_BACKENDS[backend_key]['url']
+        self.http = session or requests
     
-    def generate(self, prompt, model, temperature=0.8, max_tokens=200):
+    def generate(self, prompt, model, temperature=0.8, max_tokens=200, keep_alive=None, owner=None, stop=None):
+        """Interactive callers pass an owner and go through admission control; offline tools pace themselves."""
+        if owner is not None:
+            with admission.slot(self.backend, owner, model, max_tokens) as (model, max_tokens):
+                return self.generate(prompt, model, temperature, max_tokens, keep_alive, stop=stop)
         try:
             if self.backend == 'ollama':
-                response = requests.post(
+                response = self.http.post(
                     f"{self.url}/api/generate",
                     json={
                         "model": model,
-                        "prompt": prompt,
+                        **prompt_templates.request_fields(self.url, model, prompt),
                         "stream": False,
-                        "options": {"temperature": temperature, "num_predict": max_tokens}
+                        "keep_alive": keep_alive_value(keep_alive if keep_alive is not None else model_keep_alive),
+                        "options": self._options(temperature, max_tokens, stop)
                     },
                     timeout=120
                 )
                 response.raise_for_status()
-                return response.json()["response"]
+                return cut_at_stop(response.json()["response"], stop)
         except Exception as e:
             raise Exception(f"AI error: {str(e)}")
+    
+    @staticmethod
+    def _options(temperature, max_tokens, stop):
+        options = {"temperature": temperature, "num_predict": max_tokens}
+        if stop:
+            options["stop"] = list(stop)
+        return options
+    
+    def generate_stream(self, prompt, model, temperature=0.8, max_tokens=200, keep_alive=None, cancel=None, owner=None,
+                        stop=None):
+        """Yield response text as the backend produces it.
+        
+        Setting `cancel` (a threading.Event) or closing the generator closes the HTTP
+        stream, which makes Ollama stop generating server-side. The same happens as soon
+        as the text reaches one of the `stop` sequences, which are also sent to the
+        backend. With an owner, the admission slot is held until the stream ends.
+        """
+        if owner is not None:
+            with admission.slot(self.backend, owner, model, max_tokens, cancel) as grant:
+                if grant:
+                    model, max_tokens = grant
+                    yield from self.generate_stream(prompt, model, temperature, max_tokens, keep_alive, cancel, stop=stop)
+            return
+        if self.backend != 'ollama':
+            yield self.generate(prompt, model, temperature, max_tokens, keep_alive, stop=stop)
+            return
+        
+        scanner = StopScanner(stop or [])
+        request = {
+            "model": model,
+            **prompt_templates.request_fields(self.url, model, prompt),
+            "stream": True,
+            "keep_alive": keep_alive_value(keep_alive if keep_alive is not None else model_keep_alive),
+            "options": self._options(temperature, max_tokens, stop)
+        }
+        try:
+            with streaming_post(f"{self.url}/api/generate", cancel, json=request, timeout=120) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if cancel is not None and cancel.is_set():
+                        break
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise Exception(f"AI error: {chunk['error']}")
+                    if chunk.get("response"):
+                        text = scanner.feed(chunk["response"])
+                        if text:
+                            yield text
+                        if scanner.stopped:
+                            return   # leaving the with block closes the stream; Ollama stops generating
+                    if chunk.get("done"):
+                        break
+        except requests.RequestException as e:
+            if cancel is None or not cancel.is_set():
+                raise Exception(f"AI error: {str(e)}")
+            # cut by the cancel watcher: a stop, not an error
+        tail = scanner.flush()
+        if tail:
+            yield tail
+    
+    def generate_batch(self, prompts, model, temperature=0.8, max_tokens=200, concurrency=None, progress=None, owner=None,
+                       stop=None, stops=None):
+        """Generate for many prompts over the backend's parallel slots.
+        
+        Returns (response, error) pairs in the same order as prompts. At most
+        `concurrency` requests are in flight; they share one keep-alive session.
+        `stops`, one list per prompt, replaces the shared `stop` when prompts differ.
+        """
+        concurrency = max(1, concurrency or BATCH_CONCURRENCY)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        client = LocalLLMClient(self.backend, session=session)
+        
+        results = [None] * len(prompts)
+        done = 0
+        
+        def run(index):
+            try:
+                return index, (client.generate(prompts[index], model, temperature, max_tokens, owner=owner,
+                                               stop=stops[index] if stops else stop).strip(), None)
+            except Exception as e:
+                return index, (None, str(e))
+        
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for future in as_completed([pool.submit(run, i) for i in range(len(prompts))]):
+                    index, result = future.result()
+                    results[index] = result
+                    done += 1
+                    if progress:
+                        progress(done, len(prompts))
+        finally:
+            session.close()
+        
+        return results
+    
+    def preload(self, model, keep_alive=None):
+        """An Ollama generate with no prompt only loads the model and applies keep_alive."""
+        if self.backend == 'ollama':
+            response = requests.post(
+                f"{self.url}/api/generate",
+                json={"model": model, "keep_alive": keep_alive_value(keep_alive if keep_alive is not None else model_keep_alive)},
+                timeout=300
+            )
+            response.raise_for_status()
+    
+    def loaded_models(self):
+        if self.backend == 'ollama':
+            response = requests.get(f"{self.url}/api/ps", timeout=2)
+            response.raise_for_status()
+            return {m['name'] for m in response.json().get('models', [])}
+        return set()
+
+class ModelWarmer:
+    """Preloads models in the background so the first turn after idle or a model switch doesn't pay load time."""
+    
+    def __init__(self):
+        self._loading = set()
+        self._errors = {}
+        self._loaded = set()
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def warm(self, model):
+        if not active_llm or not model or model == "No models":
+            return
+        with self._lock:
+            if model in self._loading:
+                return
+            self._loading.add(model)
+            self._errors.pop(model, None)
+        threading.Thread(target=self._preload, args=(active_llm, model), name=f"warm-{model}", daemon=True).start()
+    
+    def _preload(self, backend, model):
+        try:
+            LocalLLMClient(backend).preload(model)
+            with self._lock:
+                self._loaded.add(model)
+        except Exception as e:
+            with self._lock:
+                self._errors[model] = str(e)
+        finally:
+            with self._lock:
+                self._loading.discard(model)
+    
+    def mark_loaded(self, model):
+        with self._lock:
+            self._loaded.add(model)
+    
+    def _refresh_loaded(self):
+        if time.monotonic() - self._checked_at < MODEL_STATUS_TTL or not active_llm:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            loaded = LocalLLMClient(active_llm).loaded_models()
+        except Exception:
+            return
+        with self._lock:
+            self._loaded = loaded
+    
+    def status(self, model):
+        self._refresh_loaded()
+        with self._lock:
+            if model in self._loading:
+                return 'loading'
+            if model in self._errors:
+                return 'error'
+            if model in self._loaded:
+                return 'loaded'
+        return 'cold'
+
+model_warmer = ModelWarmer()
 
 # ============ MEMORY SYSTEM ============
 
@@ -354,6 +1092,19 @@ class MemoryBank:
             'last_topics': self.last_topics
         }
     
+    def merge_from(self, data):
+        """Fold in entries another worker saved concurrently; this copy wins on conflicting preferences."""
+        for fact in data.get('user_facts', []):
+            self.add_user_fact(fact['fact'], fact.get('timestamp'))
+        known_moments = {(m['moment'], m['timestamp']) for m in self.important_moments}
+        for moment in data.get('important_moments', []):
+            if (moment['moment'], moment['timestamp']) not in known_moments:
+                self.important_moments.append(moment)
+        for category, value in data.get('preferences', {}).items():
+            self.preferences.setdefault(category, value)
+        for topic in data.get('last_topics', []):
+            self.add_topic(topic)
+    
     @staticmethod
     def from_dict(character_name, data):
         memory = MemoryBank(character_name)
@@ -397,106 +1148,280 @@ def get_character_avatar(name):
     index = (ord(name[0].upper()) - 65) % len(avatars)
     return avatars[index]
 
-def create_character(name, personality, backstory, appearance, example_dialogue):
+def is_valid_character_name(name):
+    """Names become file names under CHARACTERS_DIR, so no path separators or leading dots."""
+    return name == name.strip() and not any(c in name for c in '/\\') and not name.startswith('.')
+
+def add_character(name, personality, backstory="", appearance="", example_dialogue=""):
+    """Create and persist a character. Raises ValueError with a user-facing message."""
     if not name or not name.strip():
-        return "<div class='alert alert-error'>❌ Name cannot be empty</div>", gr.Dropdown(), ""
+        raise ValueError("Name cannot be empty")
     
     name = name.strip()
     
+    if not is_valid_character_name(name):
+        raise ValueError(f"Invalid name '{name}' (no slashes or leading dots)")
+    
     if not personality or not personality.strip():
-        return "<div class='alert alert-error'>❌ Personality is required!</div>", gr.Dropdown(), ""
-    
-    if name in characters:
-        return f"<div class='alert alert-error'>❌ Character '{name}' already exists!</div>", gr.Dropdown(), ""
-    
-    characters[name] = {
-        "name": name,
-        "personality": personality.strip(),
-        "backstory": backstory.strip() if backstory else "",
-        "appearance": appearance.strip() if appearance else "",
-        "example_dialogue": example_dialogue.strip() if example_dialogue else "",
-        "created": datetime.now().isoformat(),
-        "avatar": get_character_avatar(name)
-    }
+        raise ValueError("Personality is required!")
+    
+    with character_lock:
+        if name in characters:
+            raise ValueError(f"Character '{name}' already exists!")
+        
+        characters[name] = {
+            "name": name,
+            "personality": personality.strip(),
+            "backstory": backstory.strip() if backstory else "",
+            "appearance": appearance.strip() if appearance else "",
+            "example_dialogue": example_dialogue.strip() if example_dialogue else "",
+            "created": datetime.now().isoformat(),
+            "avatar": get_character_avatar(name)
+        }
+        
+        chat_histories[name] = []
+        character_memories[name] = MemoryBank(name)
     
-    chat_histories[name] = []
-    character_memories[name] = MemoryBank(name)
+    try:
+        save_character(name)
+    except Exception as e:
+        unregister_character(name)
+        raise ValueError(f"Failed to save: {str(e)}")
     
+    return characters[name]
+
+def update_character(name, fields):
+    """Apply edits to an existing character's editable fields and persist them."""
+    with character_lock:   # a hot reload or delete must not land between the check and the save
+        if name not in characters:
+            raise KeyError(name)
+        
+        char = dict(characters[name])
+        for key in ("personality", "backstory", "appearance", "example_dialogue", "avatar"):
+            if key in fields and fields[key] is not None:
+                char[key] = fields[key].strip()
+        if fields.get("stop_sequences") is not None:
+            stops = [stop for stop in fields["stop_sequences"] if stop.strip()]
+            if stops:
+                char["stop_sequences"] = stops
+            else:
+                char.pop("stop_sequences", None)
+        
+        if not char["personality"]:
+            raise ValueError("Personality is required!")
+        
+        characters[name] = char
+        save_character(name)
+        return char
+
+def get_stop_sequences_text(name):
+    """A character's extra stop sequences, one per line, with line breaks written as \\n."""
+    return "\n".join(stop.replace("\n", "\\n") for stop in characters.get(name, {}).get("stop_sequences", []))
+
+def save_stop_sequences(name, text):
+    if not name or name not in characters:
+        return "<div class='alert alert-error'>❌ Select a character first</div>"
     try:
-        save_character_to_file(name)
+        char = update_character(name, {"stop_sequences": [line.replace("\\n", "\n") for line in (text or "").splitlines()]})
     except Exception as e:
-        del characters[name]
-        return f"<div class='alert alert-error'>❌ Failed to save: {str(e)}</div>", gr.Dropdown(), ""
+        return f"<div class='alert alert-error'>❌ Error: {str(e)}</div>"
+    return f"<div class='alert alert-success'>✅ {len(char.get('stop_sequences', []))} stop sequence(s) saved for '{name}'</div>"
+
+def create_character(name, personality, backstory, appearance, example_dialogue):
+    try:
+        char = add_character(name, personality, backstory, appearance, example_dialogue)
+    except ValueError as e:
+        return f"<div class='alert alert-error'>❌ {str(e)}</div>", gr.Dropdown(), ""
     
     char_list = get_character_list()
     
     return (
-        f"<div class='alert alert-success'>✅ Character '{name}' created!</div>",
-        gr.Dropdown(choices=char_list, value=name),
+        f"<div class='alert alert-success'>✅ Character '{char['name']}' created!</div>",
+        gr.Dropdown(choices=char_list, value=char['name']),
         ""
     )
 
-def save_character_to_file(name):
-    os.makedirs("characters", exist_ok=True)
+def save_character(name, merge_memory=True):
+    """Persist a character and its memory through the configured state store (turns go through record_chat_turn)."""
+    state_store.save(name, merge_memory=merge_memory)
+
+def write_character_files(name):
+    os.makedirs(CHARACTERS_DIR, exist_ok=True)
     
-    with open(f"characters/{name}.json", 'w', encoding='utf-8') as f:
-        json.dump(characters[name], f, indent=2)
+    files = [(f"{CHARACTERS_DIR}/{name}.json", characters[name]),
+             (f"{CHARACTERS_DIR}/{name}_history.json", chat_histories.get(name, []))]
+    if name in character_memories:
+        files.append((f"{CHARACTERS_DIR}/{name}_memory.json", character_memories[name].to_dict()))
+    
+    for path, data in files:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+    remember_file_state(name)
+
+def _character_paths(stem):
+    return [f"{CHARACTERS_DIR}/{stem}{suffix}.json" for suffix in ("", "_history", "_memory")]
+
+def _mtime_or_none(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def remember_file_state(stem):
+    for path in _character_paths(stem):
+        _known_mtimes[path] = _mtime_or_none(path)
+
+def is_character_file(filename):
+    return (filename.endswith(".json") and not filename.startswith(".")
+            and "_history" not in filename and "_memory" not in filename)
+
+def read_character_files(filename):
+    """Parse one character plus its history/memory sidecars. Runs in pool workers, so no globals."""
+    with open(f"{CHARACTERS_DIR}/{filename}", 'r', encoding='utf-8') as f:
+        char_data = json.load(f)
+    name = char_data["name"]
     
-    with open(f"characters/{name}_history.json", 'w', encoding='utf-8') as f:
-        json.dump(chat_histories.get(name, []), f, indent=2)
+    history = []
+    history_file = f"{CHARACTERS_DIR}/{name}_history.json"
+    if os.path.exists(history_file):
+        with open(history_file, 'r', encoding='utf-8') as hf:
+            history = json.load(hf)
     
-    if name in character_memories:
-        with open(f"characters/{name}_memory.json", 'w', encoding='utf-8') as f:
-            json.dump(character_memories[name].to_dict(), f, indent=2)
+    memory_data = None
+    memory_file = f"{CHARACTERS_DIR}/{name}_memory.json"
+    if os.path.exists(memory_file):
+        with open(memory_file, 'r', encoding='utf-8') as mf:
+            memory_data = json.load(mf)
+    
+    return char_data, history, memory_data
+
+def _read_character_files_safe(filename):
+    try:
+        return filename, read_character_files(filename), None
+    except Exception as e:
+        return filename, None, str(e)
+
+def register_character(char_data, history, memory_data):
+    name = char_data["name"]
+    if 'avatar' not in char_data:
+        char_data['avatar'] = get_character_avatar(name)
+    memory = MemoryBank.from_dict(name, memory_data) if memory_data is not None else MemoryBank(name)
+    
+    with character_lock:
+        characters[name] = char_data
+        chat_histories[name] = history or []
+        conversation_trees.pop(name, None)
+        character_memories[name] = memory
 
-def load_characters_from_files():
-    if not os.path.exists("characters"):
+def unregister_character(name):
+    """Drop a character from memory only; its stored state is left alone."""
+    with character_lock:
+        characters.pop(name, None)
+        chat_histories.pop(name, None)
+        conversation_trees.pop(name, None)
+        character_memories.pop(name, None)
+
+def _read_character_index():
+    try:
+        with open(CHARACTER_INDEX_FILE, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        return index["entries"] if index.get("version") == 1 else {}
+    except Exception:
+        return {}
+
+def write_character_index(stems):
+    """Snapshot loaded characters into CHARACTER_INDEX_FILE in the background; next startup reads one file."""
+    entries = {}
+    for stem, name in stems.items():
+        if name not in characters:
+            continue
+        memory = character_memories.get(name)
+        entries[stem] = {
+            "mtimes": [_known_mtimes.get(path) for path in _character_paths(stem)],
+            "character": dict(characters[name]),
+            "history": list(chat_histories.get(name, [])),
+            "memory": {k: (v.copy() if hasattr(v, 'copy') else v) for k, v in memory.to_dict().items()} if memory else None
+        }
+    
+    def write():
+        tmp_file = f"{CHARACTER_INDEX_FILE}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"version": 1, "entries": entries}, f)
+            os.replace(tmp_file, CHARACTER_INDEX_FILE)
+        except Exception as e:
+            print(f"Could not write character index: {e}")
+    
+    threading.Thread(target=write, name="character-index", daemon=True).start()
+
+def load_characters_from_files(parallel=None, use_index=True):
+    """Load every character, reusing CHARACTER_INDEX_FILE entries whose file mtimes still match."""
+    if not os.path.exists(CHARACTERS_DIR):
         return
     
-    for filename in os.listdir("characters"):
-        if filename.endswith(".json") and "_history" not in filename and "_memory" not in filename:
-            try:
-                with open(f"characters/{filename}", 'r', encoding='utf-8') as f:
-                    char_data = json.load(f)
-                    name = char_data["name"]
-                    
-                    if 'avatar' not in char_data:
-                        char_data['avatar'] = get_character_avatar(name)
-                    
-                    characters[name] = char_data
-                    
-                    history_file = f"characters/{name}_history.json"
-                    if os.path.exists(history_file):
-                        with open(history_file, 'r') as hf:
-                            chat_histories[name] = json.load(hf)
-                    else:
-                        chat_histories[name] = []
-                    
-                    memory_file = f"characters/{name}_memory.json"
-                    if os.path.exists(memory_file):
-                        with open(memory_file, 'r') as mf:
-                            memory_data = json.load(mf)
-                            character_memories[name] = MemoryBank.from_dict(name, memory_data)
-                    else:
-                        character_memories[name] = MemoryBank(name)
-            except Exception as e:
-                print(f"Error loading {filename}: {e}")
+    filenames = [fn for fn in os.listdir(CHARACTERS_DIR) if is_character_file(fn)]
+    index = _read_character_index() if use_index else {}
+    loaded = {}
+    to_parse = []
+    
+    for filename in filenames:
+        stem = filename[:-len(".json")]
+        paths = _character_paths(stem)
+        mtimes = [_mtime_or_none(path) for path in paths]
+        entry = index.get(stem)
+        if entry and entry.get("mtimes") == mtimes:
+            register_character(entry["character"], entry["history"], entry["memory"])
+            _known_mtimes.update(zip(paths, mtimes))
+            loaded[stem] = character_stems[stem] = entry["character"]["name"]
+        else:
+            to_parse.append(filename)
+    
+    # Spawned pool workers re-import this module; never start a nested pool from one.
+    if parallel is None:
+        parallel = len(to_parse) >= PARALLEL_LOAD_THRESHOLD and multiprocessing.parent_process() is None
+    
+    if parallel:
+        with ProcessPoolExecutor() as pool:
+            results = list(pool.map(_read_character_files_safe, to_parse, chunksize=32))
+    else:
+        results = [_read_character_files_safe(fn) for fn in to_parse]
+    
+    for filename, parsed, error in results:
+        if error:
+            print(f"Error loading {filename}: {error}")
+            continue
+        register_character(*parsed)
+        stem = filename[:-len(".json")]
+        remember_file_state(stem)
+        loaded[stem] = character_stems[stem] = parsed[0]["name"]
+    
+    if use_index and (to_parse or set(index) != set(loaded)):
+        write_character_index(loaded)
+
+def remove_character(name):
+    unregister_character(name)
+    state_store.delete(name)
+
+def delete_character_files(name):
+    for suffix in ["", "_history", "_memory"]:
+        file_path = f"{CHARACTERS_DIR}/{name}{suffix}.json"
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    delete_branch_log_file(name)
+
+def branch_log_path(name):
+    return f"{CHARACTERS_DIR}/{name}_branches.jsonl"
+
+def delete_branch_log_file(name):
+    if os.path.exists(branch_log_path(name)):
+        os.remove(branch_log_path(name))
 
 def delete_character(name):
     if not name or name not in characters:
         return "<div class='alert alert-error'>❌ Select a character first</div>", gr.Dropdown()
     
     try:
-        del characters[name]
-        if name in chat_histories:
-            del chat_histories[name]
-        if name in character_memories:
-            del character_memories[name]
-        
-        for suffix in ["", "_history", "_memory"]:
-            file_path = f"characters/{name}{suffix}.json"
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        remove_character(name)
         
         char_list = get_character_list()
         new_selection = char_list[0] if char_list else None
@@ -509,7 +1434,8 @@ def delete_character(name):
         return f"<div class='alert alert-error'>❌ Error: {str(e)}</div>", gr.Dropdown()
 
 def get_character_list():
-    return sorted(characters.keys()) if characters else []
+    with character_lock:
+        return sorted(characters)
 
 def get_character_info(name):
     if not name or name not in characters:
@@ -552,154 +1478,1744 @@ def get_character_info(name):
     info += "</div>"
     return info
 
-# ============ MEMORY MANAGEMENT ============
+# ============ STATE STORE ============
 
-def get_memory_display(character_name):
-    if not character_name or character_name not in character_memories:
-        return "<div class='panel-container'>Select a character</div>"
+class HistoryConflict(Exception):
+    """Another worker added turns to a chat this worker was about to rewrite (fork, branch switch, clear)."""
     
-    memory = character_memories[character_name]
-    char = characters[character_name]
-    avatar = char.get('avatar', '👤')
+    def __init__(self, name, reason="got new messages from another window; reload the chat and try again"):
+        super().__init__(f"'{name}' {reason}")
+
+class BranchBusy(HistoryConflict):
+    """A branch switch while a reply is still being written; the reply would land on the wrong branch."""
     
-    display = f"""<div class='panel-container'>
-    <div style='text-align: center;'><div class='character-avatar' style='display: inline-flex;'>{avatar}</div>
-    <h2 style='color: var(--accent-primary);'>🧠 Memory: {character_name}</h2></div>
-    <h3 style='color: var(--accent-secondary);'>📝 Facts About You</h3>"""
+    def __init__(self, name):
+        super().__init__(name, "is still writing a reply; switch branches once it's done")
+
+class FileStateStore:
+    """Default store: JSON files under CHARACTERS_DIR, owned by a single worker process."""
     
-    if memory.user_facts:
-        display += "<ul>"
-        for fact in memory.user_facts[-10:]:
-            display += f"<li>{fact['fact']}</li>"
-        display += "</ul>"
-    else:
-        display += "<p><em>No facts yet. Chat more!</em></p>"
+    shared = False
     
-    display += "<h3 style='color: var(--accent-secondary);'>⭐ Important Moments</h3>"
-    if memory.important_moments:
-        display += "<ul>"
-        for moment in memory.important_moments[-5:]:
-            tags = ', '.join(moment['tags']) if moment['tags'] else 'general'
-            display += f"<li><span class='memory-tag'>{tags}</span> {moment['moment']}</li>"
-        display += "</ul>"
-    else:
-        display += "<p><em>No moments tagged yet.</em></p>"
+    def describe(self):
+        return f"files in {CHARACTERS_DIR}/"
     
-    display += "</div>"
-    return display
-
-def add_manual_memory(character_name, fact_text):
-    if not character_name or character_name not in character_memories:
-        return "<div class='alert alert-error'>❌ Select a character</div>", get_memory_display(character_name)
+    def load_all(self):
+        load_characters_from_files()
     
-    if not fact_text or not fact_text.strip():
-        return "<div class='alert alert-warning'>⚠️ Enter a fact</div>", get_memory_display(character_name)
+    def save(self, name, merge_memory=True):
+        write_character_files(name)
     
-    memory = character_memories[character_name]
-    memory.add_user_fact(fact_text.strip())
-    save_character_to_file(character_name)
+    def record_turn(self, name, user_message, ai_response):
+        write_character_files(name)
     
-    return f"<div class='alert alert-success'>✅ Added to memory!</div>", get_memory_display(character_name)
-
-def clear_memories(character_name):
-    if not character_name or character_name not in character_memories:
-        return "<div class='alert alert-error'>❌ Select a character</div>", ""
+    def replace_history(self, name):
+        write_character_files(name)
     
-    character_memories[character_name] = MemoryBank(character_name)
-    save_character_to_file(character_name)
+    def delete(self, name):
+        delete_character_files(name)
     
-    return f"<div class='alert alert-success'>✅ Memories cleared</div>", get_memory_display(character_name)
-
-def tag_moment(character_name, moment_text, tags_text):
-    if not character_name or character_name not in character_memories:
-        return "<div class='alert alert-error'>❌ Select a character</div>", get_memory_display(character_name)
+    def read_branch_log(self, name):
+        try:
+            with open(branch_log_path(name), 'r', encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
     
-    if not moment_text or not moment_text.strip():
-        return "<div class='alert alert-warning'>⚠️ Describe the moment</div>", get_memory_display(character_name)
+    def append_branch_log(self, name, entries):
+        os.makedirs(CHARACTERS_DIR, exist_ok=True)
+        with open(branch_log_path(name), 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
     
-    tags = [t.strip() for t in tags_text.split(',')] if tags_text else []
+    def delete_branch_log(self, name):
+        delete_branch_log_file(name)
     
-    memory = character_memories[character_name]
-    memory.add_important_moment(moment_text.strip(), tags)
-    save_character_to_file(character_name)
+    def list_scenes(self):
+        if not os.path.exists(SCENES_DIR):
+            return []
+        return sorted(fn[:-len(".json")] for fn in os.listdir(SCENES_DIR) if fn.endswith(".json"))
     
-    return "<div class='alert alert-success'>✅ Moment tagged!</div>", get_memory_display(character_name)
-
-# ============ CHAT FUNCTIONS ============
-
-def build_prompt(character_name, user_message):
-    if character_name not in characters:
-        return None
+    def read_scene(self, key):
+        try:
+            with open(f"{SCENES_DIR}/{key}.json", 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
     
-    char = characters[character_name]
-    memory = character_memories.get(character_name)
+    def append_scene_lines(self, key, members, lines):
+        scene = self.read_scene(key) or {"members": members, "transcript": []}
+        self.replace_scene(key, members, (scene["transcript"] + [list(line) for line in lines])[-SCENE_MAX_LINES:])
     
-    prompt = f"""You are roleplaying as {char['name']}.
-
-Character:
-- Name: {char['name']}
-- Personality: {char['personality']}"""
+    def replace_scene(self, key, members, transcript):
+        os.makedirs(SCENES_DIR, exist_ok=True)
+        with open(f"{SCENES_DIR}/{key}.json", 'w', encoding='utf-8') as f:
+            json.dump({"members": members, "transcript": transcript}, f, indent=2)
+    
+    def sync(self):
+        return []
+
+class SQLiteStateStore:
+    """Shared store for several ELIZA workers (processes or hosts on a shared disk).
+    
+    WAL mode lets readers run alongside a writer, and every write is a BEGIN IMMEDIATE
+    transaction. Chat turns and scene lines are append-only rows, so concurrent turns
+    never overwrite each other; save() only writes the character row, and memory is
+    merged with the stored copy inside the transaction. The few operations that rewrite
+    a history (fork, branch switch, clear) are refused with HistoryConflict if another
+    worker appended turns since this one last read them. Each write bumps a global
+    version; sync() reloads whatever other workers changed since we last looked.
+    """
+    
+    shared = True
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+    CREATE TABLE IF NOT EXISTS characters (
+        name TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        memory TEXT,
+        version INTEGER NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS turns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        user_message TEXT NOT NULL,
+        ai_response TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS turns_by_name ON turns (name, id);
+    CREATE TABLE IF NOT EXISTS branch_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        entry TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS branch_log_by_name ON branch_log (name, id);
+    CREATE TABLE IF NOT EXISTS scenes (key TEXT PRIMARY KEY, members TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS scene_lines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL,
+        speaker TEXT NOT NULL,
+        text TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS scene_lines_by_key ON scene_lines (key, id);
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._versions = {}      # name -> row version this process last loaded or wrote
+        self._last_turns = {}    # name -> newest turn id this process has seen
+        self._seen_version = 0
+        self._sync_lock = threading.Lock()
+        self._conn().executescript(self.SCHEMA)
+    
+    def describe(self):
+        return f"SQLite (WAL) at {self.path}"
+    
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def _bump(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+    
+    def _history(self, conn, name):
+        rows = conn.execute(
+            "SELECT id, user_message, ai_response FROM turns WHERE name = ? ORDER BY id DESC LIMIT ?",
+            (name, HISTORY_LIMIT)
+        ).fetchall()
+        self._last_turns[name] = rows[0][0] if rows else 0
+        return [(user_message, ai_response) for _, user_message, ai_response in reversed(rows)]
+    
+    def _newest_turn(self, conn, name):
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM turns WHERE name = ?", (name,)).fetchone()[0]
+    
+    def _trim_turns(self, conn, name):
+        conn.execute(
+            "DELETE FROM turns WHERE name = ? AND id NOT IN "
+            "(SELECT id FROM turns WHERE name = ? ORDER BY id DESC LIMIT ?)",
+            (name, name, HISTORY_LIMIT)
+        )
+    
+    def _write_row(self, conn, name, merge_memory):
+        memory = character_memories.get(name)
+        if memory and merge_memory:
+            row = conn.execute("SELECT memory FROM characters WHERE name = ? AND deleted = 0", (name,)).fetchone()
+            if row and row[0]:
+                memory.merge_from(json.loads(row[0]))
+        version = self._bump(conn)
+        conn.execute(
+            "INSERT INTO characters (name, data, memory, version, deleted) VALUES (?, ?, ?, ?, 0) "
+            "ON CONFLICT(name) DO UPDATE SET data = excluded.data, memory = excluded.memory, "
+            "version = excluded.version, deleted = 0",
+            (name, json.dumps(characters[name]), json.dumps(memory.to_dict()) if memory else None, version)
+        )
+        self._versions[name] = version
+    
+    def load_all(self):
+        conn = self._conn()
+        with self._sync_lock:
+            self._seen_version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            for name, data, memory, version in conn.execute(
+                    "SELECT name, data, memory, version FROM characters WHERE deleted = 0").fetchall():
+                register_character(json.loads(data), self._history(conn, name), json.loads(memory) if memory else None)
+                self._versions[name] = version
+    
+    def save(self, name, merge_memory=True):
+        """Write the character and its memory. Turns are left alone: other workers may be appending."""
+        with self._write() as conn:
+            self._write_row(conn, name, merge_memory)
+            if self._newest_turn(conn, name) != self._last_turns.get(name, 0):
+                # Our row version now hides other workers' turns from sync(); adopt them here.
+                chat_histories[name] = self._history(conn, name)
+    
+    def record_turn(self, name, user_message, ai_response):
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO turns (name, user_message, ai_response) VALUES (?, ?, ?)",
+                (name, user_message, ai_response)
+            )
+            self._trim_turns(conn, name)
+            self._write_row(conn, name, merge_memory=True)
+            # Other workers may have added turns too; adopt the merged history.
+            chat_histories[name] = self._history(conn, name)
+    
+    def replace_history(self, name):
+        """Swap the stored turns for this worker's history, unless someone appended since we last read them."""
+        with self._write() as conn:
+            if self._newest_turn(conn, name) != self._last_turns.get(name, 0):
+                raise HistoryConflict(name)
+            conn.execute("DELETE FROM turns WHERE name = ?", (name,))
+            conn.executemany(
+                "INSERT INTO turns (name, user_message, ai_response) VALUES (?, ?, ?)",
+                [(name, u, r) for u, r in chat_histories.get(name, [])]
+            )
+            self._write_row(conn, name, merge_memory=True)
+            self._history(conn, name)
+    
+    def delete(self, name):
+        with self._write() as conn:
+            version = self._bump(conn)
+            conn.execute("UPDATE characters SET deleted = 1, version = ? WHERE name = ?", (version, name))
+            conn.execute("DELETE FROM turns WHERE name = ?", (name,))
+            conn.execute("DELETE FROM branch_log WHERE name = ?", (name,))
+            self._versions[name] = version
+    
+    def read_branch_log(self, name):
+        rows = self._conn().execute("SELECT entry FROM branch_log WHERE name = ? ORDER BY id", (name,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    def append_branch_log(self, name, entries):
+        with self._write() as conn:
+            conn.executemany("INSERT INTO branch_log (name, entry) VALUES (?, ?)",
+                             [(name, json.dumps(entry)) for entry in entries])
+    
+    def delete_branch_log(self, name):
+        with self._write() as conn:
+            conn.execute("DELETE FROM branch_log WHERE name = ?", (name,))
+    
+    def list_scenes(self):
+        return [row[0] for row in self._conn().execute("SELECT key FROM scenes ORDER BY key").fetchall()]
+    
+    def read_scene(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT members FROM scenes WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        lines = conn.execute(
+            "SELECT speaker, text FROM scene_lines WHERE key = ? ORDER BY id DESC LIMIT ?", (key, SCENE_MAX_LINES)
+        ).fetchall()
+        return {"members": json.loads(row[0]), "transcript": [list(line) for line in reversed(lines)]}
+    
+    def append_scene_lines(self, key, members, lines):
+        with self._write() as conn:
+            conn.execute("INSERT OR IGNORE INTO scenes (key, members) VALUES (?, ?)", (key, json.dumps(members)))
+            conn.executemany("INSERT INTO scene_lines (key, speaker, text) VALUES (?, ?, ?)",
+                             [(key, speaker, text) for speaker, text in lines])
+            conn.execute(
+                "DELETE FROM scene_lines WHERE key = ? AND id NOT IN "
+                "(SELECT id FROM scene_lines WHERE key = ? ORDER BY id DESC LIMIT ?)",
+                (key, key, SCENE_MAX_LINES)
+            )
+    
+    def replace_scene(self, key, members, transcript):
+        with self._write() as conn:
+            conn.execute("INSERT OR REPLACE INTO scenes (key, members) VALUES (?, ?)", (key, json.dumps(members)))
+            conn.execute("DELETE FROM scene_lines WHERE key = ?", (key,))
+            conn.executemany("INSERT INTO scene_lines (key, speaker, text) VALUES (?, ?, ?)",
+                             [(key, speaker, text) for speaker, text in transcript[-SCENE_MAX_LINES:]])
+    
+    def sync(self):
+        """Reload characters other workers changed since the last call; returns their names."""
+        global character_index_version
+        
+        conn = self._conn()
+        with self._sync_lock:
+            current = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            if current == self._seen_version:
+                return []
+            rows = conn.execute(
+                "SELECT name, data, memory, version, deleted FROM characters WHERE version > ?",
+                (self._seen_version,)
+            ).fetchall()
+            self._seen_version = current
+        
+        changed = []
+        for name, data, memory, version, deleted in rows:
+            if self._versions.get(name) == version:
+                continue
+            self._versions[name] = version
+            if deleted:
+                unregister_character(name)
+            else:
+                register_character(json.loads(data), self._history(conn, name), json.loads(memory) if memory else None)
+            changed.append(name)
+        
+        if changed:
+            character_index_version += 1
+        return changed
+
+def open_state_store(url):
+    if not url or url == "files":
+        return FileStateStore()
+    if url.startswith("sqlite:"):
+        # sqlite:///eliza.db is relative, sqlite:////srv/eliza.db absolute (the usual URL convention)
+        path = url[len("sqlite:"):]
+        path = path[3:] if path.startswith("///") else path
+        return SQLiteStateStore(path or "eliza.db")
+    raise ValueError(f"Unknown state store '{url}' (use 'files' or 'sqlite:///eliza.db')")
+
+def start_state_sync(interval=STATE_SYNC_INTERVAL):
+    """Poll a shared store for other workers' writes so every worker serves current state."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                state_store.sync()
+            except Exception as e:
+                print(f"State sync failed: {e}")
+    
+    threading.Thread(target=loop, name="state-sync", daemon=True).start()
+
+state_store = FileStateStore()
+
+# ============ CHARACTER HOT-RELOAD ============
+
+def character_stem(filename):
+    """Map any of a character's files to the stem of its main JSON file, or None."""
+    if not filename.endswith(".json") or filename.startswith("."):
+        return None
+    stem = filename[:-len(".json")]
+    for suffix in ("_history", "_memory"):
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)]
+    return stem
+
+def _changed_by_someone_else(stem):
+    return any(_known_mtimes.get(path, -1) != _mtime_or_none(path) for path in _character_paths(stem))
+
+def reload_character(stem):
+    """Re-read, add or drop a single character after its files changed on disk."""
+    global character_index_version
+    
+    if not _changed_by_someone_else(stem):
+        return False
+    
+    main_file = f"{stem}.json"
+    with character_lock:
+        previous = character_stems.get(stem, stem)
+        if os.path.exists(f"{CHARACTERS_DIR}/{main_file}"):
+            try:
+                char_data, history, memory_data = read_character_files(main_file)
+            except Exception as e:
+                print(f"Error reloading {main_file}: {e}")
+                return False
+            if previous != char_data["name"]:
+                unregister_character(previous)   # renamed inside the file
+            register_character(char_data, history, memory_data)
+            character_stems[stem] = char_data["name"]
+            print(f"🔄 Reloaded character '{char_data['name']}'")
+        elif previous in characters:
+            unregister_character(previous)
+            character_stems.pop(stem, None)
+            print(f"🗑️ Removed character '{previous}' (deleted on disk)")
+        else:
+            return False
+        
+        remember_file_state(stem)
+        character_index_version += 1
+    return True
+
+class _WatchdogHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+    
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if path:
+                self.watcher.notify(os.path.basename(path))
+
+class CharacterWatcher:
+    """Watches CHARACTERS_DIR and reloads only the characters whose files changed.
+    
+    Uses inotify through watchdog when installed, otherwise polls mtimes. Bursts of
+    events are debounced so a character written as three files reloads once.
+    """
+    
+    def __init__(self, debounce=WATCH_DEBOUNCE_SECONDS, poll_interval=WATCH_POLL_INTERVAL):
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._timer = None
+        self._observer = None
+        self._stop = threading.Event()
+    
+    @property
+    def mode(self):
+        return "inotify" if self._observer else "polling"
+    
+    def start(self):
+        os.makedirs(CHARACTERS_DIR, exist_ok=True)
+        if WATCHDOG_AVAILABLE:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_WatchdogHandler(self), CHARACTERS_DIR, recursive=False)
+                self._observer.daemon = True
+                self._observer.start()
+                return self
+            except Exception as e:
+                print(f"⚠️  inotify watcher unavailable ({e}), falling back to polling")
+                self._observer = None
+        threading.Thread(target=self._poll_loop, name="character-poller", daemon=True).start()
+        return self
+    
+    def stop(self):
+        self._stop.set()
+        if self._observer:
+            self._observer.stop()
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+    
+    def notify(self, filename):
+        stem = character_stem(filename)
+        if not stem:
+            return
+        with self._lock:
+            self._pending.add(stem)
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def _flush(self):
+        with self._lock:
+            stems, self._pending = self._pending, set()
+            self._timer = None
+        for stem in sorted(stems):
+            reload_character(stem)
+    
+    def _snapshot(self):
+        snapshot = {}
+        try:
+            with os.scandir(CHARACTERS_DIR) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json"):
+                        snapshot[entry.name] = entry.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+        return snapshot
+    
+    def _poll_loop(self):
+        previous = self._snapshot()
+        while not self._stop.wait(self.poll_interval):
+            current = self._snapshot()
+            for filename in previous.keys() | current.keys():
+                if previous.get(filename) != current.get(filename):
+                    self.notify(filename)
+            previous = current
+
+def refresh_character_dropdowns(seen_version, chat_name, memory_name, manage_name, scene_names):
+    """Timer callback: push the new character list to every dropdown after a hot reload."""
+    if seen_version == character_index_version:
+        return seen_version, gr.update(), gr.update(), gr.update(), gr.update()
+    
+    char_list = get_character_list()
+    def pick(current):
+        return gr.Dropdown(choices=char_list, value=current if current in char_list else (char_list[0] if char_list else None))
+    scene_pick = gr.Dropdown(choices=char_list, value=[n for n in (scene_names or []) if n in char_list])
+    return character_index_version, pick(chat_name), pick(memory_name), pick(manage_name), scene_pick
+
+# ============ BULK IMPORT / EXPORT ============
+
+ARCHIVE_RECORDS = "characters.jsonl"
+ARCHIVE_SCENES = "scenes.jsonl"
+ARCHIVE_MANIFEST = "manifest.json"
+
+def validate_character_record(record):
+    errors = []
+    if not isinstance(record, dict):
+        return None, ["record is not an object"]
+    
+    char = record.get("character")
+    if not isinstance(char, dict):
+        return None, ["missing 'character' object"]
+    
+    name = char.get("name")
+    if not isinstance(name, str) or not name.strip():
+        errors.append("name cannot be empty")
+        name = None
+    elif not is_valid_character_name(name):
+        errors.append(f"invalid name '{name}'")
+    
+    if not isinstance(char.get("personality"), str) or not char["personality"].strip():
+        errors.append("personality is required")
+    
+    history = record.get("history", [])
+    if not isinstance(history, list) or any(not isinstance(turn, (list, tuple)) or len(turn) != 2 for turn in history):
+        errors.append("history must be a list of [user, reply] pairs")
+    
+    if record.get("memory") is not None and not isinstance(record["memory"], dict):
+        errors.append("memory must be an object")
+    
+    branches = record.get("branches", [])
+    if not isinstance(branches, list) or any(not isinstance(entry, dict) for entry in branches):
+        errors.append("branches must be a list of log entries")
+    
+    return name, errors
+
+def validate_scene_record(record):
+    """Returns (members, transcript) for a well-formed scene record, else None."""
+    if not isinstance(record, dict):
+        return None
+    members, transcript = record.get("members"), record.get("transcript")
+    if (not isinstance(members, list) or len(set(members)) < 2
+            or any(not isinstance(m, str) or not is_valid_character_name(m) for m in members)):
+        return None
+    if not isinstance(transcript, list) or any(
+            not isinstance(line, (list, tuple)) or len(line) != 2 or not all(isinstance(part, str) for part in line)
+            for line in transcript):
+        return None
+    return sorted(set(members)), [list(line) for line in transcript]
+
+def _parse_archive_line(line):
+    """Decode and validate one JSONL record."""
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return None, None, [f"bad JSON: {e}"]
+    name, errors = validate_character_record(record)
+    return name, (None if errors else record), errors
+
+def _read_archive_scenes(path):
+    """Scene records from a zip archive; JSONL archives carry characters only."""
+    if not zipfile.is_zipfile(path):
+        return []
+    with zipfile.ZipFile(path) as zf:
+        if ARCHIVE_SCENES not in zf.namelist():
+            return []
+        with zf.open(ARCHIVE_SCENES) as raw:
+            return [line.decode('utf-8') for line in raw if line.strip()]
+
+def _iter_archive_lines(path):
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            total = None
+            if ARCHIVE_MANIFEST in zf.namelist():
+                total = json.loads(zf.read(ARCHIVE_MANIFEST)).get("count")
+            yield total
+            with zf.open(ARCHIVE_RECORDS) as raw:
+                for line in raw:
+                    if line.strip():
+                        yield line.decode('utf-8')
+    else:
+        yield None
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def save_imported_character(name, branches):
+    """An imported record replaces the stored character, memory, history and branch log outright."""
+    save_character(name, merge_memory=False)
+    state_store.replace_history(name)
+    state_store.delete_branch_log(name)
+    if branches:
+        state_store.append_branch_log(name, branches)
+
+def import_characters_archive(path, dry_run=False, overwrite=False, progress=None):
+    """Stream records from a zip/JSONL archive, validate them, then register and save.
+    
+    Parsing runs inline: handing lines to a process pool costs about as much pickling
+    as json.loads itself. A dry run reports exactly what the real import would do,
+    including names that appear twice in the archive (the first record wins).
+    """
+    summary = {'imported': 0, 'skipped': 0, 'invalid': 0, 'scenes': 0, 'errors': []}
+    lines = _iter_archive_lines(path)
+    total = next(lines)
+    done = 0
+    seen = {}   # name -> record number that claimed it
+    to_save = []
+    
+    for chunk in _chunked(lines, BULK_CHUNK_SIZE):
+        for index, line in enumerate(chunk, done + 1):
+            name, record, errors = _parse_archive_line(line)
+            if not errors and name in seen:
+                errors = [f"duplicate of record {seen[name]}"]
+            if errors:
+                summary['invalid'] += 1
+                summary['errors'].append(f"record {index} ({name or '?'}): {'; '.join(errors)}")
+                continue
+            seen[name] = index
+            if name in characters and not overwrite:
+                summary['skipped'] += 1
+            else:
+                summary['imported'] += 1
+                if not dry_run:
+                    register_character(record["character"], [tuple(t) for t in record.get("history", [])], record.get("memory"))
+                    to_save.append((name, record.get("branches", [])))
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+    
+    if to_save:
+        with ThreadPoolExecutor(max_workers=8) as io_pool:
+            list(io_pool.map(lambda item: save_imported_character(*item), to_save))
+    
+    for index, line in enumerate(_read_archive_scenes(path), 1):
+        try:
+            scene = validate_scene_record(json.loads(line))
+        except ValueError:
+            scene = None
+        if scene is None:
+            summary['invalid'] += 1
+            summary['errors'].append(f"scene {index}: needs two or more valid members and [speaker, text] lines")
+            continue
+        members, transcript = scene
+        key = GroupScene(members).key
+        if state_store.read_scene(key) is not None and not overwrite:
+            summary['skipped'] += 1
+            continue
+        summary['scenes'] += 1
+        if not dry_run:
+            state_store.replace_scene(key, members, transcript[-SCENE_MAX_LINES:])
+            group_scenes.pop(key, None)
+    
+    return summary
+
+def export_characters_archive(path, names=None, progress=None):
+    """Write characters (with history, memory and branch log) as one JSONL stream inside a zip
+    archive, plus the group scenes whose members are all exported."""
+    names = get_character_list() if names is None else [n for n in names if n in characters]
+    included = set(names)
+    scenes = [scene for scene in map(state_store.read_scene, state_store.list_scenes())
+              if scene and set(scene["members"]) <= included]
+    
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(ARCHIVE_MANIFEST, json.dumps({
+            "app": APP_NAME,
+            "version": VERSION,
+            "exported": datetime.now().isoformat(),
+            "count": len(names),
+            "scenes": len(scenes)
+        }))
+        with zf.open(ARCHIVE_RECORDS, 'w') as raw:
+            for done, name in enumerate(names, 1):
+                memory = character_memories.get(name)
+                record = {
+                    "character": characters[name],
+                    "history": chat_histories.get(name, []),
+                    "memory": memory.to_dict() if memory else None,
+                    "branches": state_store.read_branch_log(name)
+                }
+                raw.write((json.dumps(record) + "\n").encode('utf-8'))
+                if progress and (done % BULK_CHUNK_SIZE == 0 or done == len(names)):
+                    progress(done, len(names))
+        with zf.open(ARCHIVE_SCENES, 'w') as raw:
+            for scene in scenes:
+                raw.write((json.dumps({"members": scene["members"], "transcript": scene["transcript"]}) + "\n").encode('utf-8'))
+    
+    return len(names)
+
+def import_characters_ui(archive, dry_run, overwrite, progress=None):
+    if not archive:
+        return "<div class='alert alert-warning'>⚠️ Choose an archive first</div>", gr.Dropdown()
+    
+    path = getattr(archive, 'name', archive)
+    try:
+        summary = import_characters_archive(
+            path, dry_run=dry_run, overwrite=overwrite,
+            progress=(lambda done, total: progress((done, total), desc="Importing", unit="characters")) if progress else None
+        )
+    except Exception as e:
+        return f"<div class='alert alert-error'>❌ Import failed: {str(e)}</div>", gr.Dropdown()
+    
+    verb = "would be imported" if dry_run else "imported"
+    status = "alert-warning" if summary['invalid'] else "alert-success"
+    html = (f"<div class='alert {status}'>{'🔎' if dry_run else '✅'} {summary['imported']} {verb}, "
+            f"{summary['skipped']} skipped (already exist), {summary['invalid']} invalid, "
+            f"{summary['scenes']} scenes</div>")
+    if summary['errors']:
+        html += "<ul>" + "".join(f"<li>{e}</li>" for e in summary['errors'][:20]) + "</ul>"
+    
+    char_list = get_character_list()
+    return html, gr.Dropdown(choices=char_list, value=char_list[0] if char_list else None)
+
+def export_characters_ui(progress=None):
+    os.makedirs("exports", exist_ok=True)
+    path = f"exports/eliza_characters_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    try:
+        count = export_characters_archive(
+            path, progress=(lambda done, total: progress((done, total), desc="Exporting", unit="characters")) if progress else None
+        )
+    except Exception as e:
+        return f"<div class='alert alert-error'>❌ Export failed: {str(e)}</div>", None
+    return f"<div class='alert alert-success'>✅ Exported {count} characters</div>", path
+
+# ============ MEMORY MANAGEMENT ============
+
+def get_memory_display(character_name):
+    if not character_name or character_name not in character_memories:
+        return "<div class='panel-container'>Select a character</div>"
+    
+    memory = character_memories[character_name]
+    char = characters[character_name]
+    avatar = char.get('avatar', '👤')
+    
+    display = f"""<div class='panel-container'>
+    <div style='text-align: center;'><div class='character-avatar' style='display: inline-flex;'>{avatar}</div>
+    <h2 style='color: var(--accent-primary);'>🧠 Memory: {character_name}</h2></div>
+    <h3 style='color: var(--accent-secondary);'>📝 Facts About You</h3>"""
+    
+    if memory.user_facts:
+        display += "<ul>"
+        for fact in memory.user_facts[-10:]:
+            display += f"<li>{fact['fact']}</li>"
+        display += "</ul>"
+    else:
+        display += "<p><em>No facts yet. Chat more!</em></p>"
+    
+    display += "<h3 style='color: var(--accent-secondary);'>⭐ Important Moments</h3>"
+    if memory.important_moments:
+        display += "<ul>"
+        for moment in memory.important_moments[-5:]:
+            tags = ', '.join(moment['tags']) if moment['tags'] else 'general'
+            display += f"<li><span class='memory-tag'>{tags}</span> {moment['moment']}</li>"
+        display += "</ul>"
+    else:
+        display += "<p><em>No moments tagged yet.</em></p>"
+    
+    display += "</div>"
+    return display
+
+def add_manual_memory(character_name, fact_text):
+    if not character_name or character_name not in character_memories:
+        return "<div class='alert alert-error'>❌ Select a character</div>", get_memory_display(character_name)
+    
+    if not fact_text or not fact_text.strip():
+        return "<div class='alert alert-warning'>⚠️ Enter a fact</div>", get_memory_display(character_name)
+    
+    memory = character_memories[character_name]
+    memory.add_user_fact(fact_text.strip())
+    save_character(character_name)
+    
+    return f"<div class='alert alert-success'>✅ Added to memory!</div>", get_memory_display(character_name)
+
+def clear_memories(character_name):
+    if not character_name or character_name not in character_memories:
+        return "<div class='alert alert-error'>❌ Select a character</div>", ""
+    
+    character_memories[character_name] = MemoryBank(character_name)
+    save_character(character_name, merge_memory=False)
+    
+    return f"<div class='alert alert-success'>✅ Memories cleared</div>", get_memory_display(character_name)
+
+def tag_moment(character_name, moment_text, tags_text):
+    if not character_name or character_name not in character_memories:
+        return "<div class='alert alert-error'>❌ Select a character</div>", get_memory_display(character_name)
+    
+    if not moment_text or not moment_text.strip():
+        return "<div class='alert alert-warning'>⚠️ Describe the moment</div>", get_memory_display(character_name)
+    
+    tags = [t.strip() for t in tags_text.split(',')] if tags_text else []
+    
+    memory = character_memories[character_name]
+    memory.add_important_moment(moment_text.strip(), tags)
+    save_character(character_name)
+    
+    return "<div class='alert alert-success'>✅ Moment tagged!</div>", get_memory_display(character_name)
+
+# ============ PROFILING ============
+
+# Innermost frames of threads that are parked, not working; their samples are dropped. Where the OS
+# reports per-thread CPU time, threads that used none since the last sample are dropped as well,
+# which also catches waits these frames miss (a socket read inside a C extension, time.sleep).
+_IDLE_FRAMES = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("selectors.py", "select"),
+                ("queue.py", "get"), ("thread.py", "_worker"), ("socket.py", "accept"), ("socketserver.py", "serve_forever"),
+                ("socket.py", "readinto"), ("ssl.py", "read"), ("ssl.py", "recv_into"),
+                ("wait.py", "poll_wait_for_socket"), ("wait.py", "select_wait_for_socket")}
+_IDLE_CPU_FRACTION = 0.1   # a thread busier than this share of the sample interval counts as working
+
+def _thread_cpu_time(ident):
+    """CPU seconds a thread has used, or None where per-thread clocks aren't available."""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+def _ordinal(n):
+    suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+def _sample_stack(frame):
+    """Collapsed-stack frames, outermost first, or None when the thread is idle."""
+    leaf = frame.f_code
+    if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_FRAMES:
+        return None
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ","))
+        frame = frame.f_back
+    return names[::-1]
+
+class RequestProfiler:
+    """Opt-in sampling profiler for chat turns: a window of the next N turns, or every Nth turn.
+    
+    While a profiled turn runs, a background thread samples every thread's Python stack,
+    so time spent in Gradio, uvicorn and the store shows up next to the turn's own code.
+    Each turn is written to PROFILE_DIR as a collapsed-stack file (flamegraph.pl, speedscope)
+    and a speedscope JSON profile. With allocation tracking on, tracemalloc runs only during
+    profiled turns and their top allocation sites are written alongside. When off, a turn
+    pays a single attribute check.
+    """
+    
+    def __init__(self, directory=PROFILE_DIR, interval=PROFILE_SAMPLE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.armed = False
+        self.mode = "off"
+        self.count = 1
+        self.allocations = False
+        self.written = deque(maxlen=5)
+        self._seen = 0
+        self._remaining = 0
+        self._sessions = []
+        self._sampler = None
+        self._lock = threading.Lock()
+    
+    def configure(self, mode, count=1, allocations=False):
+        if mode not in {value for _, value in PROFILE_MODES}:
+            raise ValueError(f"Unknown profiling mode '{mode}'")
+        with self._lock:
+            self.mode = mode
+            self.count = max(1, int(count or 1))
+            self.allocations = bool(allocations)
+            self._seen = 0
+            self._remaining = self.count
+            self.armed = mode != "off"
+        return self
+    
+    def configure_from_setting(self, setting, allocations=False):
+        """Parse ELIZA_PROFILE: "off", "next:N" or "every:N". Anything else warns and leaves profiling off."""
+        mode, _, count = (setting or "off").partition(":")
+        try:
+            return self.configure(mode.strip().lower(), int(count or 1), allocations)
+        except ValueError:
+            print(f"⚠️ Ignoring ELIZA_PROFILE='{setting}' (use off, next:N or every:N); profiling is off")
+            return self.configure("off")
+    
+    def begin(self, label):
+        """Start profiling a turn if the current mode selects it; returns a session for end(), or None."""
+        with self._lock:
+            if not self.armed:
+                return None
+            self._seen += 1
+            if self.mode == "next":
+                self._remaining -= 1
+                if self._remaining <= 0:
+                    self.armed = False
+                    self.mode = "off"
+            elif self._seen % self.count:
+                return None
+            
+            session = {'label': f"{label}-{self._seen:05d}", 'started': time.perf_counter(),
+                       'stacks': Counter(), 'alloc': None}
+            if self.allocations:
+                import tracemalloc
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(10)
+                session['alloc'] = tracemalloc.take_snapshot()
+            self._sessions.append(session)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._sampler.start()
+        return session
+    
+    def end(self, session):
+        duration = time.perf_counter() - session['started']
+        alloc_stats = None
+        with self._lock:
+            self._sessions.remove(session)
+            if session['alloc'] is not None:
+                import tracemalloc
+                alloc_stats = tracemalloc.take_snapshot().compare_to(session['alloc'], 'lineno')[:PROFILE_ALLOC_TOP]
+                if not any(other['alloc'] is not None for other in self._sessions):
+                    tracemalloc.stop()
+        threading.Thread(target=self._write, args=(session, duration, alloc_stats), name="profile-writer", daemon=True).start()
+    
+    def _sample(self):
+        sampler = threading.get_ident()
+        cpu_seen = {}
+        while True:
+            time.sleep(self.interval)
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler:
+                    continue
+                cpu, previous = _thread_cpu_time(ident), cpu_seen.get(ident)
+                cpu_seen[ident] = cpu
+                if cpu is not None and (previous is None or cpu - previous < self.interval * _IDLE_CPU_FRACTION):
+                    continue   # blocked (waiting on the LLM, a lock, a socket) since the last sample
+                stack = _sample_stack(frame)
+                if stack:
+                    stacks.append(";".join([names.get(ident, f"thread-{ident}")] + stack))
+            with self._lock:
+                if not self._sessions:
+                    self._sampler = None
+                    return
+                for session in self._sessions:
+                    session['stacks'].update(stacks)
+    
+    def _write(self, session, duration, alloc_stats):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{datetime.now():%Y%m%d-%H%M%S}-{session['label']}")
+        stacks = session['stacks']
+        
+        with open(f"{base}.collapsed", 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        
+        frames, frame_index, samples, weights = [], {}, [], []
+        for stack, count in stacks.items():
+            indices = []
+            for name in stack.split(";"):
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                indices.append(frame_index[name])
+            samples.append(indices)
+            weights.append(count * self.interval)
+        with open(f"{base}.speedscope.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "name": session['label'],
+                "exporter": f"{APP_NAME} {VERSION}",
+                "shared": {"frames": frames},
+                "profiles": [{
+                    "type": "sampled", "name": f"{session['label']} ({duration:.2f}s wall)", "unit": "seconds",
+                    "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights
+                }]
+            }, f)
+        
+        if alloc_stats is not None:
+            with open(f"{base}.alloc.txt", 'w', encoding='utf-8') as f:
+                f.write(f"Top {len(alloc_stats)} allocation sites during {session['label']} ({duration:.2f}s)\n\n")
+                for stat in alloc_stats:
+                    f.write(f"{stat}\n")
+        
+        self.written.appendleft(base)
+    
+    def status(self):
+        with self._lock:
+            if self.mode == "next":
+                state = f"🔬 Profiling the next {self._remaining} turn(s)"
+            elif self.mode == "every":
+                state = f"🔬 Profiling every {_ordinal(self.count)} turn" if self.count > 1 else "🔬 Profiling every turn"
+            else:
+                state = "⚪ Profiling off"
+            if self.armed and self.allocations:
+                state += " with allocation tracking"
+        recent = "".join(f"<br><code>{base}.*</code>" for base in self.written)
+        return f"<div class='model-status'>{state}{recent}</div>"
+
+request_profiler = RequestProfiler().configure_from_setting(PROFILE_SETTING, PROFILE_ALLOCATIONS)
+
+def set_profiling(mode, count, allocations):
+    try:
+        request_profiler.configure(mode, count, allocations)
+    except ValueError as e:
+        return f"<div class='alert alert-error'>❌ {str(e)}</div>"
+    return request_profiler.status()
+
+# ============ CONVERSATION BRANCHES ============
+
+class ConversationTree:
+    """Every branch of one character's chat, stored copy-on-write.
+    
+    A branch is a parent pointer, how many of the parent's turns it inherits (fork_at)
+    and only the turns added on it since. Regenerating or editing a message forks a new
+    branch without copying the shared prefix, so storage grows with new turns only, and
+    materializing a branch walks its ancestors: O(branch depth), not O(tree size).
+    The tree is rebuilt from an append-only log kept by the state store.
+    """
+    
+    def __init__(self):
+        self.branches = {}      # id -> {"parent", "fork_at", "turns"}
+        self.active = None
+        self._pending = None    # (branch entry, previous active) until the fork's first turn is logged
+        self._unlogged = []     # a freshly seeded root, logged together with the first fork's first turn
+    
+    @classmethod
+    def from_log(cls, entries):
+        tree = cls()
+        for entry in entries:
+            tree.apply(entry)
+        return tree
+    
+    def apply(self, entry):
+        op = entry["op"]
+        if op == "branch":
+            self.branches[entry["id"]] = {"parent": entry["parent"], "fork_at": entry["fork_at"],
+                                          "turns": [tuple(turn) for turn in entry.get("turns", [])]}
+            self.active = entry["id"]
+        elif op == "turn":
+            self.branches[entry["branch"]]["turns"].append((entry["user"], entry["reply"]))
+        elif op == "switch":
+            self.active = entry["branch"]
+    
+    def length(self, branch_id=None):
+        branch = self.branches[self.active if branch_id is None else branch_id]
+        return branch["fork_at"] + len(branch["turns"])
+    
+    def path(self, branch_id=None):
+        """All turns of a branch: its own turns after the prefix inherited from each ancestor."""
+        branch_id = self.active if branch_id is None else branch_id
+        segments, limit = [], None
+        while branch_id is not None:
+            branch = self.branches[branch_id]
+            turns = branch["turns"]
+            if limit is not None:
+                turns = turns[:max(0, limit - branch["fork_at"])]
+            segments.append(turns)
+            limit = branch["fork_at"] if limit is None else min(limit, branch["fork_at"])
+            branch_id = branch["parent"]
+        return [turn for segment in reversed(segments) for turn in segment]
+    
+    def fork(self, at):
+        """Start a branch that shares the active path's first `at` turns. Logged with its first turn."""
+        self.abandon()
+        parent = self.active
+        while at < self.branches[parent]["fork_at"]:
+            parent = self.branches[parent]["parent"]
+        entry = {"op": "branch", "id": max(self.branches) + 1, "parent": parent, "fork_at": at}
+        self._pending = (entry, self.active)
+        self.apply(entry)
+    
+    def abandon(self):
+        """Drop a fork that never got a turn (the reply failed or was stopped) and go back."""
+        if self._pending:
+            entry, previous = self._pending
+            self._pending = None
+            del self.branches[entry["id"]]
+            self.active = previous
+    
+    def add_turn(self, user_message, ai_response):
+        """Append to the active branch; returns the log entries to persist."""
+        entries = self._unlogged + ([self._pending[0]] if self._pending else [])
+        self._pending, self._unlogged = None, []
+        entry = {"op": "turn", "branch": self.active, "user": user_message, "reply": ai_response}
+        self.apply(entry)
+        return entries + [entry]
+    
+    def switch(self, branch_id):
+        entry = {"op": "switch", "branch": branch_id}
+        self.abandon()
+        self.apply(entry)
+        return [entry]
+
+_branch_lock = threading.RLock()
+_replies_in_flight = {}   # name -> turns being generated for it right now (guarded by _branch_lock)
+
+def begin_reply(name):
+    with _branch_lock:
+        _replies_in_flight[name] = _replies_in_flight.get(name, 0) + 1
+
+def end_reply(name):
+    with _branch_lock:
+        _replies_in_flight[name] -= 1
+        if not _replies_in_flight[name]:
+            del _replies_in_flight[name]
+
+def get_conversation_tree(name, create=False):
+    """The character's tree, read from the store once. With create, seeds a root branch from the current history."""
+    with _branch_lock:
+        if name not in conversation_trees:
+            entries = state_store.read_branch_log(name)
+            conversation_trees[name] = ConversationTree.from_log(entries) if entries else None
+        tree = conversation_trees[name]
+        if tree is None and create:
+            entry = {"op": "branch", "id": 0, "parent": None, "fork_at": 0,
+                     "turns": [list(turn) for turn in chat_histories.get(name, [])]}
+            tree = conversation_trees[name] = ConversationTree.from_log([entry])
+            tree._unlogged = [entry]
+        return tree
+
+def _show_active_branch(name, tree):
+    chat_histories[name] = tree.path()[-HISTORY_LIMIT:]
+
+def fork_conversation(name, index):
+    """Make history end just before turn `index` (as shown) so the next turn starts a new branch."""
+    with _branch_lock:
+        shown = chat_histories.get(name, [])
+        if not 0 <= index < len(shown):
+            raise ValueError(f"No turn #{index + 1} to branch from")
+        tree = get_conversation_tree(name, create=True)
+        tree.fork(tree.length() - len(shown) + index)
+        _show_active_branch(name, tree)
+
+def fork_pending(name):
+    """True while a fork waits for its first turn (a reply to it is being generated or chosen)."""
+    with _branch_lock:
+        tree = conversation_trees.get(name)
+        return bool(tree and tree._pending)
+
+def abandon_fork(name):
+    with _branch_lock:
+        tree = conversation_trees.get(name)
+        if tree and tree._pending:
+            tree.abandon()
+            _show_active_branch(name, tree)
+            if tree._unlogged:
+                conversation_trees[name] = None   # the seed was never stored; the next fork seeds afresh
+
+def record_branch_turn(name, user_message, ai_response):
+    """Log a finished turn on the active branch (and the branch itself, if this turn starts a fork)."""
+    with _branch_lock:
+        tree = get_conversation_tree(name)
+        if tree is not None:
+            state_store.append_branch_log(name, tree.add_turn(user_message, ai_response))
+
+def switch_branch(name, branch_id):
+    """Show another branch. Raises BranchBusy while a reply is in flight: it belongs to the branch it was asked on."""
+    with _branch_lock:
+        if _replies_in_flight.get(name):
+            raise BranchBusy(name)
+        tree = get_conversation_tree(name)
+        if tree is None and branch_id == 0:
+            return chat_histories.get(name, [])
+        if tree is None or branch_id not in tree.branches:
+            raise ValueError(f"Unknown branch {branch_id}")
+        if branch_id != tree.active:
+            shown = chat_histories.get(name, [])
+            entries = tree.switch(branch_id)
+            _show_active_branch(name, tree)
+            try:
+                state_store.replace_history(name)
+            except HistoryConflict:
+                chat_histories[name] = shown
+                conversation_trees.pop(name, None)   # rebuilt from the log, where the switch never happened
+                raise
+            state_store.append_branch_log(name, entries)
+        return chat_histories[name]
+
+def reset_conversation_tree(name):
+    with _branch_lock:
+        if get_conversation_tree(name) is not None:
+            state_store.delete_branch_log(name)
+        conversation_trees[name] = None
+
+def list_branches(name):
+    """[(label, id)] for every branch plus the active id. Characters that never branched have just 'main'."""
+    tree = get_conversation_tree(name) if name in characters else None
+    if tree is None:
+        return [("🌱 main", 0)], 0
+    choices = []
+    for branch_id, branch in tree.branches.items():
+        if branch["parent"] is None:
+            label = "🌱 main"
+        else:
+            first = branch["turns"][0][0] if branch["turns"] else ""
+            preview = f" · “{first[:30]}{'…' if len(first) > 30 else ''}”" if first else ""
+            label = f"🌿 {branch_id} · from turn {branch['fork_at'] + 1}{preview}"
+        choices.append((f"{label} · {tree.length(branch_id)} turns", branch_id))
+    return choices, tree.active
+
+def branch_selector(name):
+    choices, active = list_branches(name)
+    return gr.update(choices=choices, value=active)
+
+def switch_branch_ui(name, branch_id):
+    if not name or name not in characters or branch_id is None:
+        return load_chat_history(name)
+    try:
+        return switch_branch(name, int(branch_id))
+    except (ValueError, HistoryConflict):
+        return load_chat_history(name)
+
+def history_index_for_row(name, rows, row):
+    """The stored turn a chat display row shows, or None for rows that aren't stored turns
+    (error messages, a stopped reply that wasn't kept, candidates not yet kept)."""
+    stored = load_chat_history(name)
+    turn = 0
+    for index, shown in enumerate(rows or []):
+        matches = turn < len(stored) and tuple(shown) == tuple(stored[turn])
+        if index == row:
+            return turn if matches else None
+        if matches:
+            turn += 1
+    return None
+
+# ============ CHAT FUNCTIONS ============
+
+def build_prompt_prefix(character_name, history=None):
+    """Everything in the prompt that is known before the user types: persona, memory and history."""
+    if character_name not in characters:
+        return None
+    
+    char = characters[character_name]
+    memory = character_memories.get(character_name)
+    
+    prompt = f"""You are roleplaying as {char['name']}.
+
+Character:
+- Name: {char['name']}
+- Personality: {char['personality']}"""
     
     if char.get('backstory'):
         prompt += f"\n- Backstory: {char['backstory']}"
     
-    if memory:
-        memory_context = memory.get_context_string()
-        if memory_context.strip():
-            prompt += f"\n{memory_context}"
+    if memory:
+        memory_context = memory.get_context_string()
+        if memory_context.strip():
+            prompt += f"\n{memory_context}"
+    
+    history = chat_histories.get(character_name, []) if history is None else history
+    if history:
+        prompt += f"\n\nRecent conversation:\n"
+        for user_msg, ai_msg in history[-5:]:
+            prompt += f"User: {user_msg}\n{char['name']}: {ai_msg}\n"
+    
+    prompt += "\n\nUser:"
+    
+    return prompt
+
+def build_prompt(character_name, user_message, history=None):
+    prefix = build_prompt_prefix(character_name, history)
+    if prefix is None:
+        return None
+    return f"{prefix} {user_message}\n{characters[character_name]['name']}:"
+
+def stop_sequences(model, speakers, custom=()):
+    """Where a reply ends: the transcript moving on to the next "Name:" line, plus per-model and custom stops."""
+    stops = [f"\n{speaker}:" for speaker in ["User", *speakers]]
+    family = (model or "").split(":")[0].split("/")[-1].lower()
+    stops += next((markers for prefix, markers in MODEL_STOP_SEQUENCES.items() if family.startswith(prefix)), [])
+    stops += custom
+    return list(dict.fromkeys(stop for stop in stops if stop))
+
+def chat_stop_sequences(character_name, model):
+    char = characters.get(character_name, {})
+    return stop_sequences(model, [char.get("name", character_name)], char.get("stop_sequences", []))
+
+class PromptPrefetcher:
+    """Opt-in speculative prefill: sends the stable prompt prefix while the user is typing.
+    
+    Ollama keeps the KV cache of the last prompt per loaded model, so when the real
+    request arrives only the user's message still has to be processed. Both are sent raw
+    with the model template applied by prompt_templates, so the prefix really is a prefix.
+    Prefetches are rate-limited per model, skipped when the prefix is unchanged, and
+    cancelled (by closing the connection) when the real request needs a different prefix.
+    """
+    
+    def __init__(self, min_interval=PREFETCH_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._last = {}         # model -> (prefix, monotonic time sent)
+        self._inflight = None   # {'prefix', 'cancelled' Event}
+        self._lock = threading.Lock()
+    
+    def prefetch(self, character_name, model):
+        if not active_llm or not model or model == "No models" or admission.busy(active_llm):
+            return False
+        prefix = build_prompt_prefix(character_name)
+        if not prefix:
+            return False
+        
+        now = time.monotonic()
+        with self._lock:
+            last_prefix, sent_at = self._last.get(model, (None, 0.0))
+            if prefix == last_prefix or now - sent_at < self.min_interval:
+                return False
+            self._last[model] = (prefix, now)
+        
+        self.cancel()
+        threading.Thread(target=self._send, args=(active_llm, model, prefix), name="prompt-prefetch", daemon=True).start()
+        return True
+    
+    def _send(self, backend, model, prefix):
+        url = LLM_BACKENDS[backend]['url']
+        cancelled = threading.Event()
+        inflight = {'prefix': prefix, 'cancelled': cancelled}
+        with self._lock:
+            self._inflight = inflight
+        
+        try:
+            fields = prompt_templates.prefix_fields(url, model, prefix)
+            if fields is None or cancelled.is_set():
+                return   # a prefix the backend templates itself would never line up with the real prompt
+            with streaming_post(
+                f"{url}/api/generate",
+                cancelled,
+                json={
+                    "model": model,
+                    **fields,
+                    "stream": True,
+                    "keep_alive": keep_alive_value(model_keep_alive),
+                    "options": {"num_predict": 1}
+                },
+                timeout=120
+            ) as response:
+                for _ in response.iter_lines():
+                    if cancelled.is_set():
+                        break
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                if self._inflight is inflight:
+                    self._inflight = None
+    
+    def warmed_prefix(self, model):
+        """The prefix last prefetched for this model, which a matching real request should be sent like."""
+        with self._lock:
+            return self._last.get(model, (None, 0.0))[0]
+    
+    def cancel(self, keep_prefix=None):
+        """Abort the in-flight prefetch unless it is warming keep_prefix, which the caller is about to reuse.
+        
+        Setting the flag cuts the connection even before Ollama has sent headers.
+        """
+        with self._lock:
+            inflight = self._inflight
+            if not inflight or (keep_prefix is not None and inflight['prefix'] == keep_prefix):
+                return
+            self._inflight = None
+        inflight['cancelled'].set()
+
+prompt_prefetcher = PromptPrefetcher()
+
+def prefetch_prompt(character_name, model, enabled):
+    if enabled:
+        prompt_prefetcher.prefetch(character_name, model)
+
+def record_chat_turn(character_name, user_message, ai_response, auto_memory):
+    """Append a finished turn to history, learn from it, and persist. Shared by the UI and the API."""
+    if character_name not in chat_histories:
+        chat_histories[character_name] = []
+    
+    forked = fork_pending(character_name)
+    chat_histories[character_name].append((user_message, ai_response))
+    
+    if auto_memory:
+        extract_memories_from_conversation(character_name, user_message, ai_response)
+    
+    if len(chat_histories[character_name]) > HISTORY_LIMIT:
+        chat_histories[character_name] = chat_histories[character_name][-HISTORY_LIMIT:]
+    
+    if forked:
+        # First turn of a new branch: the stored history still holds the old branch.
+        # Raises HistoryConflict before anything is logged if another worker got there first.
+        state_store.replace_history(character_name)
+    else:
+        state_store.record_turn(character_name, user_message, ai_response)
+    record_branch_turn(character_name, user_message, ai_response)
+
+class GenerationControl:
+    """Cancel flags for in-flight generations, keyed by UI session, shared by the Stop button and the stream loop."""
+    
+    def __init__(self):
+        self._events = {}
+        self._lock = threading.Lock()
+    
+    def start(self, key):
+        cancel = threading.Event()
+        with self._lock:
+            self._events[key] = cancel
+        return cancel
+    
+    def cancel(self, key):
+        with self._lock:
+            cancel = self._events.get(key)
+        if cancel:
+            cancel.set()
+        return cancel is not None
+    
+    def finish(self, key, cancel):
+        with self._lock:
+            if self._events.get(key) is cancel:
+                del self._events[key]
+
+generation_control = GenerationControl()
+
+def stream_chat_turn(character_name, user_message, model, temperature=0.9, max_tokens=200, auto_memory=True,
+                     cancel=None, keep_partial=False, user=None, fork_at=None):
+    """Yield reply text as it streams, then record the turn. Shared by the Chat tab and the API.
+    
+    If `cancel` is set (Stop button, client gone) the backend stream is closed. The partial
+    reply is then kept in history only when keep_partial is true, and never feeds memory.
+    With fork_at, the turn replaces history from that (0-based) turn on, on a new branch;
+    the old turns stay on theirs. Raises Overloaded when admission control turns the turn away.
+    """
+    profile = request_profiler.begin("chat") if request_profiler.armed else None
+    recorded = False
+    begin_reply(character_name)
+    try:
+        if fork_at is not None:
+            fork_conversation(character_name, fork_at)
+        prompt = build_prompt(character_name, user_message)
+        prompt_prefetcher.cancel(keep_prefix=build_prompt_prefix(character_name))
+        
+        stream = LocalLLMClient(active_llm).generate_stream(prompt, model, temperature, max_tokens, cancel=cancel,
+                                                            owner=(user, character_name),
+                                                            stop=chat_stop_sequences(character_name, model))
+        parts = []
+        finished = False
+        conflict = None
+        started, first_token, outcome = time.time(), None, "error"
+        history_turns = len(chat_histories.get(character_name, []))
+        try:
+            for piece in stream:
+                if first_token is None:
+                    first_token = time.time()
+                parts.append(piece)
+                yield piece
+            finished = not (cancel and cancel.is_set())
+            outcome = "ok" if finished else "stopped"
+        except Overloaded:
+            outcome = "busy"
+            raise
+        except GeneratorExit:
+            outcome = "stopped"
+            raise
+        finally:
+            stream.close()
+            reply = "".join(parts).strip()
+            try:
+                if finished:
+                    model_warmer.mark_loaded(model)
+                    record_chat_turn(character_name, user_message, reply, auto_memory)
+                    recorded = True
+                elif keep_partial and reply:
+                    record_chat_turn(character_name, user_message, reply, auto_memory=False)
+                    recorded = True
+            except HistoryConflict as e:
+                # Raised below once the trace is recorded, and only if the stream ended normally:
+                # from this finally it would replace a GeneratorExit and skip the cleanup.
+                conflict, outcome = e, "error"
+                print(f"⚠️ Reply for '{character_name}' not saved: {e}")
+            if turn_recorder is not None:
+                turn_recorder.record(user, character_name, user_message, prompt, history_turns, max_tokens, temperature,
+                                     auto_memory, started, first_token, reply, outcome)
+        if conflict is not None:
+            raise conflict
+    finally:
+        if fork_at is not None and not recorded:
+            abandon_fork(character_name)
+        end_reply(character_name)
+        if profile is not None:
+            request_profiler.end(profile)
+
+class CandidateReplies:
+    """Alternative replies to one message, held per session (or API choice id) until one is kept.
     
+    Nothing reaches history or the memory bank before that; the other candidates are
+    simply dropped, so MemoryBank extraction only ever sees the reply the user chose.
+    A held set doesn't fork the conversation either: it remembers the history it was
+    generated against and where it would fork, and keep() forks and records in one go,
+    refusing (HistoryConflict) if the chat has moved on since.
+    """
+    
+    def __init__(self, limit=CANDIDATE_HOLD_LIMIT):
+        self.limit = limit
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def hold(self, key, character_name, user_message, replies, auto_memory, base, fork_at=None):
+        key = key or os.urandom(8).hex()
+        with self._lock:
+            self._pending[key] = {"character": character_name, "user": user_message, "replies": replies,
+                                  "index": 0, "auto_memory": auto_memory, "base": base, "fork_at": fork_at}
+            self._pending.move_to_end(key)
+            while len(self._pending) > self.limit:
+                self._pending.popitem(last=False)
+        return key
+    
+    def get(self, key):
+        with self._lock:
+            return self._pending.get(key)
+    
+    def swipe(self, key, step):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending:
+                pending["index"] = (pending["index"] + step) % len(pending["replies"])
+            return pending
+    
+    def keep(self, key, index=None):
+        """Record the shown (or given) candidate as the turn. Returns its reply, or None if nothing is held."""
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                return None
+            index = pending["index"] if index is None else index
+            if not 0 <= index < len(pending["replies"]):
+                raise ValueError(f"No candidate {index}")
+            del self._pending[key]
+        name, reply = pending["character"], pending["replies"][index]
+        with _branch_lock:
+            if chat_histories.get(name) != pending["base"]:
+                raise HistoryConflict(name)
+            if pending["fork_at"] is not None:
+                fork_conversation(name, pending["fork_at"])
+            try:
+                record_chat_turn(name, pending["user"], reply, pending["auto_memory"])
+            except Exception:
+                abandon_fork(name)
+                raise
+        return reply
+    
+    def settle(self, key):
+        """Keep what's on screen before the chat moves on; a set the chat has outgrown is dropped."""
+        try:
+            self.keep(key)
+        except HistoryConflict:
+            pass
+    
+    def discard(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+candidate_replies = CandidateReplies()
+
+def stream_candidates(character_name, user_message, model, count, temperature=0.9, max_tokens=200, cancel=None,
+                      user=None, fork_at=None, auto_memory=True):
+    """Generate up to `count` alternative replies at once; yields the list of texts so far. Records nothing.
+    
+    Each candidate is its own streamed request through admission control. Extra candidates
+    only start on backend slots nobody is using or waiting for, so under load this quietly
+    falls back to one reply. The last value yielded is the stripped, non-empty replies;
+    if none succeeded (and nobody cancelled) the first error is raised instead.
+    """
+    profile = request_profiler.begin("candidates") if request_profiler.armed else None
     history = chat_histories.get(character_name, [])
-    if history:
-        prompt += f"\n\nRecent conversation:\n"
-        for user_msg, ai_msg in history[-5:]:
-            prompt += f"User: {user_msg}\n{char['name']}: {ai_msg}\n"
+    if fork_at is not None:
+        history = history[:fork_at]
+    prompt = build_prompt(character_name, user_message, history)
+    prompt_prefetcher.cancel(keep_prefix=build_prompt_prefix(character_name, history))
     
-    prompt += f"\n\nUser: {user_message}\n{char['name']}:"
+    count = 1 + min(count - 1, max(0, admission.spare(active_llm) - 1))
+    stops = chat_stop_sequences(character_name, model)
+    stop = cancel or threading.Event()
+    texts = [""] * count
+    errors = []
+    updated = threading.Event()
+    started, first_token = time.time(), None
     
-    return prompt
+    def run(index):
+        nonlocal first_token
+        try:
+            for piece in LocalLLMClient(active_llm).generate_stream(prompt, model, temperature, max_tokens, cancel=stop,
+                                                                    owner=(user, character_name), stop=stops):
+                first_token = first_token or time.time()
+                texts[index] += piece
+                updated.set()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            updated.set()
+    
+    pool = ThreadPoolExecutor(max_workers=count, thread_name_prefix="candidate")
+    futures = [pool.submit(run, i) for i in range(count)]
+    finished = False
+    outcome = "error"
+    try:
+        while not all(future.done() for future in futures):
+            updated.wait(0.25)
+            updated.clear()
+            yield list(texts)
+        finished = True
+        replies = [text.strip() for text in texts if text.strip()]
+        if stop.is_set():
+            outcome = "stopped"
+        elif replies:
+            outcome = "ok"
+            model_warmer.mark_loaded(model)
+        elif errors:
+            overloaded = next((e for e in errors if isinstance(e, Overloaded)), None)
+            outcome = "busy" if overloaded else "error"
+            raise overloaded or errors[0]
+        else:
+            raise Exception("AI error: no candidate produced any text")
+        if errors:
+            print(f"⚠️ {len(errors)} of {count} candidates for '{character_name}' failed: {errors[0]}")
+        yield replies
+    finally:
+        if not finished:
+            stop.set()   # generator closed: the client went away
+            outcome = "stopped"
+        pool.shutdown(wait=False)
+        if turn_recorder is not None:
+            turn_recorder.record(user, character_name, user_message, prompt, len(history), max_tokens, temperature,
+                                 auto_memory, started, first_token, max(texts, key=len).strip(), outcome,
+                                 candidates=count)
+        if profile is not None:
+            request_profiler.end(profile)
 
-def chat_with_character(character_name, user_message, history, model, temperature, max_tokens, auto_memory):
-    global active_llm
+def chat_with_character(character_name, user_message, history, model, temperature, max_tokens, auto_memory,
+                        keep_partial=True, session=None, fork_at=None, candidates=1):
+    """Chat tab handler: streams the reply into the chatbot; the Stop button cancels via generation_control.
     
+    fork_at (0-based turn) resends on a new branch, as Regenerate and Edit do. With several
+    candidates they are held for swiping; sending the next message keeps the one on screen.
+    """
     if not active_llm:
-        return history + [(user_message, "❌ No AI backend detected. Check Setup tab.")], ""
+        yield history + [(user_message, "❌ No AI backend detected. Check Setup tab.")], ""
+        return
     
     if not character_name or character_name not in characters:
-        return history + [(user_message, "❌ Please select a character first.")], ""
+        yield history + [(user_message, "❌ Please select a character first.")], ""
+        return
     
     if not user_message or not user_message.strip():
-        return history, ""
+        yield history, ""
+        return
     
     user_message = user_message.strip()
-    
-    prompt = build_prompt(character_name, user_message)
+    candidate_replies.settle(session)
+    base = list(load_chat_history(character_name))
+    if fork_at is not None:
+        history = base[:fork_at]
+    cancel = generation_control.start(session)
+    reply = ""
     
     try:
-        client = LocalLLMClient(active_llm)
-        ai_response = client.generate(prompt, model, temperature, max_tokens).strip()
+        yield history + [(user_message, "")], ""
+        if candidates > 1:
+            texts = []
+            for texts in stream_candidates(character_name, user_message, model, candidates, temperature, max_tokens,
+                                           cancel=cancel, user=session, fork_at=fork_at, auto_memory=auto_memory):
+                reply = texts[0] if texts else ""
+                yield history + [(user_message, reply)], gr.update()
+            if texts and (keep_partial or not cancel.is_set()):
+                candidate_replies.hold(session, character_name, user_message, texts, auto_memory and not cancel.is_set(),
+                                       base, fork_at)
+                if len(texts) == 1:
+                    candidate_replies.keep(session)   # nothing to choose between
+        else:
+            for piece in stream_chat_turn(character_name, user_message, model, temperature, max_tokens, auto_memory,
+                                          cancel=cancel, keep_partial=keep_partial, user=session, fork_at=fork_at):
+                reply += piece
+                yield history + [(user_message, reply)], gr.update()
         
-        if character_name not in chat_histories:
-            chat_histories[character_name] = []
-        
-        chat_histories[character_name].append((user_message, ai_response))
-        
-        if auto_memory:
-            extract_memories_from_conversation(character_name, user_message, ai_response)
-        
-        if len(chat_histories[character_name]) > 100:
-            chat_histories[character_name] = chat_histories[character_name][-100:]
-        
-        save_character_to_file(character_name)
-        
-        return history + [(user_message, ai_response)], ""
+        if cancel.is_set():
+            reply = f"{reply.strip()} ⏹️" if reply.strip() else "⏹️ Stopped"
+        yield history + [(user_message, reply.strip())], gr.update()
         
+    except Overloaded as e:
+        yield history + [(user_message, str(e))], user_message
     except Exception as e:
-        return history + [(user_message, f"❌ {str(e)}")], ""
+        yield history + [(user_message, f"❌ {str(e)}")], gr.update()
+    finally:
+        generation_control.finish(session, cancel)
+
+def stop_generation(session=None):
+    generation_control.cancel(session)
+
+def regenerate_reply(character_name, history, model, temperature, max_tokens, auto_memory, keep_partial=True, session=None,
+                     candidates=1):
+    """Ask the last message again on a new branch; the previous reply stays on its own."""
+    candidate_replies.settle(session)
+    shown = load_chat_history(character_name)
+    if not shown:
+        yield history, gr.update()
+        return
+    yield from chat_with_character(character_name, shown[-1][0], history, model, temperature, max_tokens, auto_memory,
+                                   keep_partial, session=session, fork_at=len(shown) - 1, candidates=candidates)
+
+def edit_message(character_name, turn_number, new_message, history, model, temperature, max_tokens, auto_memory,
+                 keep_partial=True, session=None, candidates=1):
+    """Replace message #turn_number (1-based, as shown) and continue from it on a new branch."""
+    candidate_replies.settle(session)
+    shown = load_chat_history(character_name)
+    if not turn_number or not 1 <= int(turn_number) <= len(shown):
+        yield history, new_message
+        return
+    yield from chat_with_character(character_name, new_message, history, model, temperature, max_tokens, auto_memory,
+                                   keep_partial, session=session, fork_at=int(turn_number) - 1, candidates=candidates)
+
+def candidate_bar(session=None):
+    """(row visibility, label) for the swipe controls under the chat."""
+    pending = candidate_replies.get(session)
+    if not pending or len(pending["replies"]) < 2:
+        return gr.update(visible=False), ""
+    return gr.update(visible=True), f"**{pending['index'] + 1} / {len(pending['replies'])}**"
+
+def swipe_candidate(history, step, session=None):
+    pending = candidate_replies.swipe(session, step)
+    if not pending or not history:
+        return (history,) + candidate_bar(session)
+    return (history[:-1] + [(pending["user"], pending["replies"][pending["index"]])],) + candidate_bar(session)
+
+def clear_history(character_name):
+    """Forget every turn and branch. Raises HistoryConflict if another worker just added one."""
+    shown = chat_histories.get(character_name, [])
+    chat_histories[character_name] = []
+    try:
+        state_store.replace_history(character_name)
+    except HistoryConflict:
+        chat_histories[character_name] = shown
+        raise
+    reset_conversation_tree(character_name)
 
 def clear_chat(character_name):
     if character_name and character_name in chat_histories:
-        chat_histories[character_name] = []
-        save_character_to_file(character_name)
+        try:
+            clear_history(character_name)
+        except HistoryConflict:
+            return load_chat_history(character_name)
     return []
 
 def load_chat_history(character_name):
@@ -707,6 +3223,216 @@ def load_chat_history(character_name):
         return chat_histories[character_name]
     return []
 
+# ============ GROUP SCENES ============
+
+class GroupScene:
+    """A multi-character conversation: one shared transcript, one persona and memory per speaker."""
+    
+    def __init__(self, members, transcript=None):
+        self.members = list(members)
+        self.transcript = transcript or []   # [speaker, text]; speaker is "User" or a character name
+        self.unsaved = []                    # lines added since the last save_group_scene
+        self.lock = threading.Lock()         # held for a whole turn, so two senders can't interleave lines
+        self.sync_cursor()
+    
+    @property
+    def key(self):
+        return " & ".join(sorted(self.members))
+    
+    def sync_cursor(self):
+        """Round robin resumes with the member after whoever spoke last, even after a reload."""
+        spoken = [speaker for speaker, _ in self.transcript if speaker in self.members]
+        self.cursor = (self.members.index(spoken[-1]) + 1) % len(self.members) if spoken else 0
+    
+    def speakers_for(self, user_message, mode):
+        """Turn scheduler: who answers this user message, in what order."""
+        present = [m for m in self.members if m in characters]
+        if mode == 'mentioned':
+            mentioned = [m for m in present
+                         if re.search(rf"(?<!\w){re.escape(m)}(?!\w)", user_message, re.IGNORECASE)]
+            return mentioned or present
+        if mode == 'round_robin':
+            for step in range(len(self.members)):
+                speaker = self.members[(self.cursor + step) % len(self.members)]
+                if speaker in characters:
+                    self.cursor = (self.cursor + step + 1) % len(self.members)
+                    return [speaker]
+            return []
+        return present
+    
+    def add_line(self, speaker, text):
+        self.transcript.append([speaker, text])
+        self.unsaved.append([speaker, text])
+        if len(self.transcript) > SCENE_MAX_LINES:
+            self.transcript = self.transcript[-SCENE_MAX_LINES:]
+    
+    def display_history(self):
+        """Fold the transcript into chatbot tuples: one user message per row, all replies below it."""
+        rows = []
+        for speaker, text in self.transcript:
+            if speaker == "User":
+                rows.append([text, ""])
+            else:
+                reply = f"**{characters.get(speaker, {}).get('avatar', '👤')} {speaker}:** {text}"
+                if not rows:
+                    rows.append([None, reply])
+                else:
+                    rows[-1][1] = f"{rows[-1][1]}\n\n{reply}" if rows[-1][1] else reply
+        return [tuple(row) for row in rows]
+    
+    def to_dict(self):
+        return {'members': self.members, 'transcript': self.transcript}
+    
+    @staticmethod
+    def from_dict(data):
+        return GroupScene(data.get('members', []), data.get('transcript', []))
+
+def get_group_scene(members):
+    """The scene for these members; a shared store is re-read so other workers' lines show up."""
+    key = " & ".join(sorted(members))
+    if key not in group_scenes or state_store.shared:
+        data = state_store.read_scene(key)
+        if key not in group_scenes:
+            group_scenes.setdefault(key, GroupScene.from_dict(data) if data else GroupScene(members))
+        elif data:
+            scene = group_scenes[key]
+            # A turn in progress already has the latest lines; don't swap the transcript under it.
+            if scene.lock.acquire(blocking=False):
+                try:
+                    scene.transcript = data["transcript"]
+                    scene.sync_cursor()
+                finally:
+                    scene.lock.release()
+    return group_scenes[key]
+
+def save_group_scene(scene):
+    """Append the lines added since the last save; concurrent workers' lines interleave, none are lost."""
+    if scene.unsaved:
+        state_store.append_scene_lines(scene.key, scene.members, scene.unsaved)
+        scene.unsaved = []
+
+def build_group_prompt(scene, speaker):
+    char = characters[speaker]
+    memory = character_memories.get(speaker)
+    others = [m for m in scene.members if m != speaker and m in characters]
+    
+    prompt = f"""You are roleplaying as {char['name']} in a group conversation with the User"""
+    prompt += f" and {', '.join(others)}.\n" if others else ".\n"
+    prompt += f"""
+Character:
+- Name: {char['name']}
+- Personality: {char['personality']}"""
+    
+    if char.get('backstory'):
+        prompt += f"\n- Backstory: {char['backstory']}"
+    
+    for other in others:
+        prompt += f"\n- {other} is here too: {characters[other]['personality'][:200]}"
+    
+    if memory:
+        memory_context = memory.get_context_string()
+        if memory_context.strip():
+            prompt += f"\n{memory_context}"
+    
+    prompt += f"\n\nReply only as {char['name']}, in one turn.\n\nConversation:\n"
+    for line_speaker, text in scene.transcript[-SCENE_TRANSCRIPT_LINES:]:
+        prompt += f"{line_speaker}: {text}\n"
+    prompt += f"{char['name']}:"
+    
+    return prompt
+
+def generate_scene_turn(scene, user_message, model, temperature, max_tokens, mode, user=None, auto_memory=True):
+    """Add the user's line, then generate each scheduled speaker's reply.
+    
+    Speakers that only react to the user (parallel/mentioned) are independent, so
+    their prompts are built from the same transcript and generated concurrently.
+    Round robin picks one speaker per message, the next in turn. Callers hold scene.lock.
+    """
+    def record(speaker, prompt, history_turns, started, reply):
+        if turn_recorder is not None:
+            turn_recorder.record(user, speaker, user_message, prompt, history_turns, max_tokens, temperature, auto_memory,
+                                 started, None, reply or "", "ok" if reply else "error", scene=mode)
+    
+    scene.add_line("User", user_message)
+    speakers = scene.speakers_for(user_message, mode)
+    client = LocalLLMClient(active_llm)
+    replies = []
+    members = [m for m in scene.members if m in characters]
+    stops = stop_sequences(model, members, [stop for m in members for stop in characters[m].get("stop_sequences", [])])
+    
+    if mode == 'round_robin':
+        for speaker in speakers:
+            prompt, history_turns, started = build_group_prompt(scene, speaker), len(scene.transcript), time.time()
+            try:
+                reply, error = client.generate(prompt, model, temperature, max_tokens,
+                                               owner=(user, speaker), stop=stops).strip(), None
+            except Exception as e:
+                reply, error = None, str(e)
+            record(speaker, prompt, history_turns, started, reply)
+            replies.append((speaker, reply, error))
+            if reply:
+                scene.add_line(speaker, reply)
+    else:
+        prompts = [build_group_prompt(scene, speaker) for speaker in speakers]
+        history_turns, started = len(scene.transcript), time.time()
+        results = client.generate_batch(prompts, model, temperature, max_tokens, concurrency=len(prompts),
+                                        owner=(user, scene.key), stop=stops)
+        for speaker, prompt, (reply, error) in zip(speakers, prompts, results):
+            record(speaker, prompt, history_turns, started, reply)
+            replies.append((speaker, reply, error))
+            if reply:
+                scene.add_line(speaker, reply)
+    
+    model_warmer.mark_loaded(model)
+    return replies
+
+def group_chat(members, user_message, history, model, temperature, max_tokens, mode, auto_memory, session=None):
+    if not active_llm:
+        return history + [(user_message, "❌ No AI backend detected. Check Setup tab.")], ""
+    
+    members = [m for m in (members or []) if m in characters]
+    if len(members) < 2:
+        return history + [(user_message, "❌ Pick at least two characters for a scene.")], ""
+    
+    if not user_message or not user_message.strip():
+        return history, ""
+    
+    user_message = user_message.strip()
+    scene = get_group_scene(members)
+    with scene.lock:
+        replies = generate_scene_turn(scene, user_message, model, temperature, max_tokens, mode, user=session,
+                                      auto_memory=auto_memory)
+        
+        if auto_memory:
+            for speaker, reply, error in replies:
+                if reply:
+                    extract_memories_from_conversation(speaker, user_message, reply)
+                    save_character(speaker)
+        
+        save_group_scene(scene)
+        display = scene.display_history()
+    
+    errors = "".join(f"\n\n❌ {speaker}: {error}" for speaker, _, error in replies if error)
+    if errors and display:
+        display[-1] = (display[-1][0], (display[-1][1] or "") + errors)
+    return display, ""
+
+def load_group_scene(members):
+    members = [m for m in (members or []) if m in characters]
+    if len(members) < 2:
+        return []
+    return get_group_scene(members).display_history()
+
+def clear_group_scene(members):
+    members = [m for m in (members or []) if m in characters]
+    if len(members) >= 2:
+        scene = get_group_scene(members)
+        with scene.lock:
+            scene.transcript, scene.unsaved = [], []
+            scene.sync_cursor()
+            state_store.replace_scene(scene.key, scene.members, [])
+    return []
+
 # ============ BACKEND MANAGEMENT ============
 
 def check_backends():
@@ -714,398 +3440,1568 @@ def check_backends():
     
     llm_backends = BackendDetector.detect_llm_backends()
     
-    status = "<div class='panel-container'><h2>🔍 Backend Status</h2>"
+    status = "<div class='panel-container'><h2>🔍 Backend Status</h2>"
+    
+    if llm_backends:
+        status += "<h3 style='color: var(--success);'>✅ LLM Active</h3><ul>"
+        for key, name in llm_backends:
+            if key == 'ollama':
+                models = BackendDetector.get_ollama_models()
+                if models:
+                    status += f"<li><strong>{name}</strong>: {len(models)} models</li>"
+                    if not active_llm:
+                        active_llm = key
+                        available_models = models
+        status += "</ul>"
+    else:
+        status += "<h3 style='color: var(--error);'>❌ No LLM Detected</h3>"
+        status += "<p>Install <a href='https://ollama.ai' target='_blank'>Ollama</a></p>"
+    
+    status += "</div>"
+    return status
+
+def refresh_models():
+    global active_llm, available_models
+    
+    llm_backends = BackendDetector.detect_llm_backends()
+    
+    if llm_backends:
+        for key, name in llm_backends:
+            if key == 'ollama':
+                models = BackendDetector.get_ollama_models()
+                if models:
+                    active_llm = key
+                    available_models = models
+                    return (
+                        gr.Dropdown(choices=models, value=models[0]),
+                        gr.Dropdown(choices=models, value=models[0]),
+                        f"<div class='alert alert-success'>✅ Found {len(models)} models</div>"
+                    )
+    
+    return (
+        gr.Dropdown(choices=["No models"], value="No models"),
+        gr.Dropdown(choices=["No models"], value="No models"),
+        "<div class='alert alert-error'>❌ No backends detected</div>"
+    )
+
+def get_model_status(model):
+    if not active_llm or not model or model == "No models":
+        return "<div class='model-status'>⚪ No model</div>"
+    labels = {
+        'loaded': "🟢 Loaded &amp; warm",
+        'loading': "⏳ Loading into memory...",
+        'error': "🔴 Failed to load",
+        'cold': "⚪ Not loaded (first reply will be slower)"
+    }
+    return f"<div class='model-status'>{labels[model_warmer.status(model)]}</div>"
+
+def warm_selected_model(model):
+    model_warmer.warm(model)
+    return get_model_status(model)
+
+def set_keep_alive(keep_alive, model):
+    global model_keep_alive
+    model_keep_alive = keep_alive
+    # Re-send the preload so the new policy applies to the already-loaded model.
+    model_warmer.warm(model)
+    return get_model_status(model)
+
+# ============ TRAFFIC RECORDING & REPLAY ============
+
+class TurnRecorder:
+    """Appends one JSON line per chat turn with sizes and timings only: no text, names or session ids.
+    
+    Sessions and characters are replaced by salted hashes (a new salt per recording), so a
+    trace shows who talked to whom and how, but not what was said.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._salt = os.urandom(16)
+        self._last_end = {}   # anonymized session -> wall time its previous turn ended
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+    
+    def anonymize(self, value):
+        return hashlib.sha256(self._salt + str(value).encode('utf-8')).hexdigest()[:12]
+    
+    def record(self, user, character_name, user_message, prompt, history_turns, max_tokens, temperature, auto_memory,
+               started, first_token, reply, outcome, candidates=1, scene=None):
+        ended = time.time()
+        char_data = characters.get(character_name, {})
+        session = self.anonymize(user)
+        event = {
+            "t": round(started, 3),
+            "session": session,
+            "character": self.anonymize(character_name),
+            "persona_chars": sum(len(char_data.get(field) or "") for field in ("personality", "backstory", "appearance", "example_dialogue")),
+            "history_turns": history_turns,
+            "message_chars": len(user_message),
+            "prompt_chars": len(prompt),
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "auto_memory": bool(auto_memory),
+            "reply_chars": len(reply),
+            "ttft_s": round(first_token - started, 3) if first_token else None,
+            "duration_s": round(ended - started, 3),
+            "outcome": outcome
+        }
+        if candidates > 1:
+            event["candidates"] = candidates
+        if scene:
+            event["scene"] = scene   # one event per speaker; its mode says whether they answered together
+        with self._lock:
+            previous_end = self._last_end.get(session)
+            event["think_s"] = round(max(0.0, started - previous_end), 3) if previous_end else None
+            self._last_end[session] = ended
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+
+turn_recorder = None   # opened in __main__ when --record-trace (default ELIZA_RECORD_TRACE) names a file
+
+def run_mock_llm(port, parallel=BACKEND_CONCURRENCY, tokens_per_second=MOCK_LLM_TOKENS_PER_SECOND,
+                 prefill_chars_per_second=MOCK_LLM_PREFILL_CHARS_PER_SECOND):
+    """Serve a fake Ollama API for load tests: `parallel` slots, realistic prefill and token pacing, no GPU."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    slots = threading.BoundedSemaphore(max(1, parallel))
+    model_list = json.dumps({"models": [{"name": MOCK_LLM_MODEL, "model": MOCK_LLM_MODEL}]}).encode('utf-8')
+    
+    class MockOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def log_message(self, *args):
+            pass
+        
+        def send_json(self, body):
+            body = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def send_chunk(self, body):
+            line = json.dumps(body).encode('utf-8') + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+        
+        def do_GET(self):
+            if self.path in ("/api/tags", "/api/ps"):
+                self.send_json(model_list)
+            else:
+                self.send_error(404)
+        
+        def do_POST(self):
+            if self.path != "/api/generate":
+                self.send_error(404)
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if not request.get("prompt"):
+                self.send_json({"model": MOCK_LLM_MODEL, "response": "", "done": True})
+                return
+            
+            tokens = max(1, int((request.get("options") or {}).get("num_predict") or 128))
+            with slots:
+                time.sleep(len(request["prompt"]) / prefill_chars_per_second)
+                if not request.get("stream", True):
+                    time.sleep(tokens / tokens_per_second)
+                    self.send_json({"model": MOCK_LLM_MODEL, "response": "lorem " * tokens, "done": True})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for _ in range(tokens):
+                        self.send_chunk({"response": "lorem ", "done": False})
+                        time.sleep(1 / tokens_per_second)
+                    self.send_chunk({"response": "", "done": True})
+                    self.wfile.write(b"0\r\n\r\n")
+                except OSError:
+                    pass   # client closed the stream: stop generating, like Ollama
+    
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockOllamaHandler)
+    server.daemon_threads = True
+    print(f"🧪 Mock LLM on http://127.0.0.1:{port} ({parallel} slots, {tokens_per_second:g} tok/s, model '{MOCK_LLM_MODEL}')")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def load_trace(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return sorted((json.loads(line) for line in f if line.strip()), key=lambda event: event["t"])
+
+def _percentiles(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    pick = lambda q: values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": values[-1]}
+
+def replay_trace(events, target, speed=1.0, model=None, progress=None):
+    """Drive recorded sessions against a running instance's API and measure what clients see.
+    
+    Each session is replayed in its own thread, starting at its recorded offset and pausing
+    for its recorded think times (both divided by `speed`). Turns within a session wait for
+    the previous reply, as a real user does. Messages and personas are filler of the recorded
+    sizes, and max_tokens is set to the recorded reply length so a mock LLM reproduces it.
+    
+    Every session talks to its own scratch copy of each character, created for this run and
+    deleted after it, so no live character's history or memory is touched and one session's
+    turns don't grow another's prompts. Scene speakers that answered together are sent together.
+    """
+    api = f"{target.rstrip('/')}{API_PREFIX}"
+    run = os.urandom(3).hex()
+    sessions = {}
+    personas = {}
+    for event in events:
+        sessions.setdefault(event["session"], []).append(event)
+        personas[event["character"]] = max(personas.get(event["character"], 1), event.get("persona_chars") or 1)
+    scratch = {(event["session"], event["character"]): f"Replay {run} {event['session'][:6]} {event['character'][:6]}"
+               for event in events}
+    
+    filler = lambda size: ("lorem ipsum dolor sit amet " * (size // 27 + 1))[:max(1, size)]
+    
+    results = []
+    lock = threading.Lock()
+    origin = events[0]["t"] if events else 0.0
+    
+    def send(event):
+        body = {
+            "character": scratch[(event["session"], event["character"])],
+            "message": filler(event.get("message_chars") or 1),
+            "max_tokens": max(1, min(event.get("max_tokens") or 200, math.ceil((event.get("reply_chars") or 4) / 4))),
+            "temperature": event.get("temperature", 0.9),
+            "auto_memory": event.get("auto_memory", True),
+            "user": event["session"],
+            "stream": True
+        }
+        if model:
+            body["model"] = model
+        sent = time.monotonic()
+        result = {"outcome": "error", "ttft_s": None, "latency_s": None}
+        try:
+            if event.get("scene"):
+                # Scene replies aren't streamed and scenes have no API: each speaker is one plain turn.
+                body["stream"] = False
+                response = requests.post(f"{api}/chat", json=body, timeout=300)
+                if response.status_code == 503:
+                    result["outcome"] = "busy"
+                response.raise_for_status()
+                result["outcome"] = "ok"
+            elif event.get("candidates", 1) > 1:
+                # Candidate sets aren't streamed; the first one is kept so the history grows as recorded.
+                body.update(candidates=event["candidates"], stream=False)
+                response = requests.post(f"{api}/chat", json=body, timeout=300)
+                if response.status_code == 503:
+                    result["outcome"] = "busy"
+                response.raise_for_status()
+                requests.post(f"{api}/chat/candidates/{response.json()['choice']}", json={"index": 0},
+                              timeout=30).raise_for_status()
+                result["outcome"] = "ok"
+            else:
+                with requests.post(f"{api}/chat", json=body, stream=True, timeout=300) as response:
+                    if response.status_code == 503:
+                        result["outcome"] = "busy"
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line.startswith(b"data: "):
+                            continue
+                        frame = json.loads(line[6:])
+                        if "token" in frame and result["ttft_s"] is None:
+                            result["ttft_s"] = time.monotonic() - sent
+                        elif frame.get("done"):
+                            result["outcome"] = "ok"
+                        elif "error" in frame:
+                            result["outcome"] = "busy" if "retry_after" in frame else "error"
+        except Exception:
+            pass
+        result["latency_s"] = time.monotonic() - sent
+        with lock:
+            results.append(result)
+            if progress:
+                progress(len(results), len(events))
+    
+    def run_session(turns):
+        index = 0
+        while index < len(turns):
+            event = turns[index]
+            if index == 0:
+                delay = (event["t"] - origin) / speed - (time.monotonic() - start)
+            else:
+                delay = (event.get("think_s") or 0.0) / speed
+            if delay > 0:
+                time.sleep(delay)
+            together = [event]
+            if event.get("scene") not in (None, "round_robin"):
+                for later in turns[index + 1:]:
+                    if later.get("scene") != event["scene"] or later["t"] != event["t"]:
+                        break
+                    together.append(later)
+            if len(together) == 1:
+                send(event)
+            else:
+                speakers = [threading.Thread(target=send, args=(e,), daemon=True) for e in together]
+                for thread in speakers:
+                    thread.start()
+                for thread in speakers:
+                    thread.join()
+            index += len(together)
+    
+    try:
+        for (_, anon), name in scratch.items():
+            requests.post(f"{api}/characters", json={"name": name, "personality": filler(personas[anon])},
+                          timeout=30).raise_for_status()
+        start = time.monotonic()
+        threads = [threading.Thread(target=run_session, args=(turns,), daemon=True) for turns in sessions.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+    finally:
+        for name in scratch.values():
+            requests.delete(f"{api}/characters/{name}", timeout=30)
+    
+    ok = [r for r in results if r["outcome"] == "ok"]
+    return {
+        "turns": len(results),
+        "sessions": len(sessions),
+        "speed": speed,
+        "elapsed_s": round(elapsed, 3),
+        "outcomes": {o: sum(1 for r in results if r["outcome"] == o) for o in ("ok", "busy", "error")},
+        "throughput_tps": round(len(ok) / max(elapsed, 1e-9), 3),
+        "latency_s": _percentiles(r["latency_s"] for r in ok),
+        "ttft_s": _percentiles(r["ttft_s"] for r in ok),
+        "recorded_latency_s": _percentiles(e.get("duration_s") for e in events if e.get("outcome") == "ok"),
+        "recorded_ttft_s": _percentiles(e.get("ttft_s") for e in events if e.get("outcome") == "ok")
+    }
+
+# ============ HTTP API ============
+
+def create_api():
+    """Headless ASGI API over the same state, storage and LLM client as the Gradio tabs.
+    
+    Routes are plain FastAPI handlers (FastAPI ships with Gradio), so API clients and
+    bots skip Gradio's queue and per-event overhead. Sync handlers run in the threadpool.
+    """
+    from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import StreamingResponse
+    from pydantic import BaseModel
+    from starlette.concurrency import run_in_threadpool
+    
+    class CharacterIn(BaseModel):
+        name: str
+        personality: str
+        backstory: str = ""
+        appearance: str = ""
+        example_dialogue: str = ""
+    
+    class CharacterPatch(BaseModel):
+        personality: str | None = None
+        backstory: str | None = None
+        appearance: str | None = None
+        example_dialogue: str | None = None
+        avatar: str | None = None
+        stop_sequences: list[str] | None = None
+    
+    class ChatIn(BaseModel):
+        character: str
+        message: str
+        model: str | None = None
+        temperature: float = 0.9
+        max_tokens: int = 200
+        auto_memory: bool = True
+        stream: bool = False
+        keep_partial: bool = False
+        user: str | None = None
+        fork_at: int | None = None   # 0-based turn to replace on a new branch (regenerate / edit)
+        candidates: int = 1          # >1: alternative replies, recorded once one is chosen
+    
+    class ChoiceIn(BaseModel):
+        index: int = 0
+    
+    class FactIn(BaseModel):
+        fact: str
+    
+    class MomentIn(BaseModel):
+        moment: str
+        tags: list[str] = []
+    
+    api = FastAPI(title=f"{APP_NAME} API", version=VERSION)
+    if API_CORS_ORIGINS:
+        api.add_middleware(CORSMiddleware, allow_origins=API_CORS_ORIGINS, allow_methods=["*"], allow_headers=["*"])
+    
+    def require_character(name):
+        if name not in characters:
+            raise HTTPException(404, f"Character '{name}' not found")
+        return characters[name]
+    
+    def resolve_chat(body):
+        """Validate a chat request; returns (character, message, model) or raises HTTPException."""
+        if not active_llm:
+            raise HTTPException(503, "No AI backend detected")
+        require_character(body.character)
+        if not body.message.strip():
+            raise HTTPException(400, "Message cannot be empty")
+        if body.fork_at is not None and not 0 <= body.fork_at < len(chat_histories.get(body.character, [])):
+            raise HTTPException(400, f"No turn {body.fork_at} to branch from")
+        if not 1 <= body.candidates <= MAX_CANDIDATES:
+            raise HTTPException(400, f"candidates must be between 1 and {MAX_CANDIDATES}")
+        model = body.model or (available_models[0] if available_models else None)
+        if not model:
+            raise HTTPException(503, "No models available")
+        return body.character, body.message.strip(), model
+    
+    @api.get(f"{API_PREFIX}/health")
+    def health():
+        return {
+            "status": "ok" if active_llm else "no_backend",
+            "version": VERSION,
+            "backend": active_llm,
+            "models": {m: model_warmer.status(m) for m in available_models},
+            "load": admission.status(active_llm) if active_llm else None,
+            "characters": len(characters)
+        }
+    
+    @api.get(f"{API_PREFIX}/characters")
+    def list_characters():
+        return [characters[name] for name in get_character_list()]
+    
+    @api.post(f"{API_PREFIX}/characters", status_code=201)
+    def post_character(body: CharacterIn):
+        try:
+            return add_character(body.name, body.personality, body.backstory, body.appearance, body.example_dialogue)
+        except ValueError as e:
+            raise HTTPException(409 if body.name.strip() in characters else 400, str(e))
+    
+    @api.get(f"{API_PREFIX}/characters/{{name}}")
+    def get_character(name: str):
+        return require_character(name)
+    
+    @api.patch(f"{API_PREFIX}/characters/{{name}}")
+    def patch_character(name: str, body: CharacterPatch):
+        require_character(name)
+        try:
+            return update_character(name, body.model_dump(exclude_none=True))
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+    
+    @api.delete(f"{API_PREFIX}/characters/{{name}}", status_code=204)
+    def remove_character_route(name: str):
+        require_character(name)
+        remove_character(name)
+    
+    @api.get(f"{API_PREFIX}/characters/{{name}}/history")
+    def get_history(name: str):
+        require_character(name)
+        return [{"user": u, "reply": r} for u, r in chat_histories.get(name, [])]
+    
+    @api.delete(f"{API_PREFIX}/characters/{{name}}/history", status_code=204)
+    def delete_history(name: str):
+        require_character(name)
+        try:
+            clear_history(name)
+        except HistoryConflict as e:
+            raise HTTPException(409, str(e))
+    
+    @api.get(f"{API_PREFIX}/characters/{{name}}/branches")
+    def get_branches(name: str):
+        require_character(name)
+        choices, active = list_branches(name)
+        return {"active": active, "branches": [{"id": branch_id, "label": label} for label, branch_id in choices]}
+    
+    @api.post(f"{API_PREFIX}/characters/{{name}}/branches/{{branch_id}}/activate")
+    def activate_branch(name: str, branch_id: int):
+        require_character(name)
+        try:
+            history = switch_branch(name, branch_id)
+        except ValueError as e:
+            raise HTTPException(404, str(e))
+        except HistoryConflict as e:
+            raise HTTPException(409, str(e))
+        return [{"user": u, "reply": r} for u, r in history]
+    
+    @api.get(f"{API_PREFIX}/characters/{{name}}/memory")
+    def get_memory(name: str):
+        require_character(name)
+        return character_memories[name].to_dict()
+    
+    @api.post(f"{API_PREFIX}/characters/{{name}}/memory/facts", status_code=201)
+    def post_fact(name: str, body: FactIn):
+        require_character(name)
+        if not body.fact.strip():
+            raise HTTPException(400, "Fact cannot be empty")
+        character_memories[name].add_user_fact(body.fact.strip())
+        save_character(name)
+        return character_memories[name].to_dict()
+    
+    @api.post(f"{API_PREFIX}/characters/{{name}}/memory/moments", status_code=201)
+    def post_moment(name: str, body: MomentIn):
+        require_character(name)
+        if not body.moment.strip():
+            raise HTTPException(400, "Moment cannot be empty")
+        character_memories[name].add_important_moment(body.moment.strip(), [t.strip() for t in body.tags if t.strip()])
+        save_character(name)
+        return character_memories[name].to_dict()
+    
+    @api.delete(f"{API_PREFIX}/characters/{{name}}/memory", status_code=204)
+    def delete_memory(name: str):
+        require_character(name)
+        character_memories[name] = MemoryBank(name)
+        save_character(name, merge_memory=False)
+    
+    def busy(e):
+        return {"error": str(e), "retry_after": e.retry_after}
+    
+    def chat_candidates(body, name, message, model, user):
+        """Generate alternatives without recording; the client keeps one via /chat/candidates/{choice}."""
+        replies = []
+        base = list(chat_histories.get(name, []))
+        try:
+            for replies in stream_candidates(name, message, model, body.candidates, body.temperature, body.max_tokens,
+                                             user=user, fork_at=body.fork_at, auto_memory=body.auto_memory):
+                pass
+        except Overloaded as e:
+            raise HTTPException(503, str(e), headers={"Retry-After": str(e.retry_after)})
+        except Exception as e:
+            raise HTTPException(502, str(e))
+        choice = candidate_replies.hold(None, name, message, replies, body.auto_memory, base, body.fork_at)
+        return {"character": name, "response": replies[0], "candidates": replies, "choice": choice}
+    
+    @api.post(f"{API_PREFIX}/chat")
+    def chat(body: ChatIn, request: Request):
+        name, message, model = resolve_chat(body)
+        if body.candidates > 1:
+            if body.stream:
+                raise HTTPException(400, "candidates need \"stream\": false")
+            return chat_candidates(body, name, message, model,
+                                   body.user or (request.client.host if request.client else None))
+        cancel = threading.Event()
+        turn = stream_chat_turn(name, message, model, body.temperature, body.max_tokens, body.auto_memory,
+                                cancel=cancel, keep_partial=body.keep_partial,
+                                user=body.user or (request.client.host if request.client else None), fork_at=body.fork_at)
+        
+        if not body.stream:
+            try:
+                return {"character": name, "response": "".join(turn).strip()}
+            except Overloaded as e:
+                raise HTTPException(503, str(e), headers={"Retry-After": str(e.retry_after)})
+            except Exception as e:
+                raise HTTPException(502, str(e))
+        
+        async def sse():
+            # Starlette cancels this generator when the client disconnects. Each chunk is
+            # awaited unshielded so that happens even mid-prefill; the flag then makes the
+            # worker thread close the backend stream, and the turn is closed once it's out.
+            parts = []
+            chunk = None
+            try:
+                while True:
+                    chunk = asyncio.ensure_future(run_in_threadpool(next, turn, None))
+                    await asyncio.wait({chunk})
+                    piece = chunk.result()
+                    if piece is None:
+                        break
+                    parts.append(piece)
+                    yield f"data: {json.dumps({'token': piece})}\n\n"
+                yield f"data: {json.dumps({'done': True, 'response': ''.join(parts).strip()})}\n\n"
+            except Overloaded as e:
+                yield f"data: {json.dumps(busy(e))}\n\n"
+            except Exception as e:
+                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            finally:
+                cancel.set()
+                if chunk is not None and not chunk.done():
+                    chunk.add_done_callback(lambda _: turn.close())
+                else:
+                    turn.close()
+        
+        return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    
+    @api.post(f"{API_PREFIX}/chat/candidates/{{choice}}")
+    def choose_candidate(choice: str, body: ChoiceIn):
+        """Record candidate `index` as the turn (memory learns from it); the others are dropped."""
+        try:
+            reply = candidate_replies.keep(choice, body.index)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        except HistoryConflict as e:
+            raise HTTPException(409, str(e))
+        if reply is None:
+            raise HTTPException(404, f"No pending candidates '{choice}'")
+        return {"response": reply}
     
-    if llm_backends:
-        status += "<h3 style='color: var(--success);'>✅ LLM Active</h3><ul>"
-        for key, name in llm_backends:
-            if key == 'ollama':
-                models = BackendDetector.get_ollama_models()
-                if models:
-                    status += f"<li><strong>{name}</strong>: {len(models)} models</li>"
-                    if not active_llm:
-                        active_llm = key
-                        available_models = models
-        status += "</ul>"
-    else:
-        status += "<h3 style='color: var(--error);'>❌ No LLM Detected</h3>"
-        status += "<p>Install <a href='https://ollama.ai' target='_blank'>Ollama</a></p>"
+    @api.websocket(f"{API_PREFIX}/chat/ws")
+    async def chat_ws(websocket: WebSocket):
+        """One JSON ChatIn per message in; {"token"} frames then {"done", "response"} or {"error"} out.
+        
+        Send {"stop": true} while a reply is streaming to cancel it; disconnecting cancels too.
+        """
+        await websocket.accept()
+        listener = None
+        try:
+            while True:
+                try:
+                    data = await (listener or websocket.receive_json())
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    await websocket.send_json({"error": f"Bad frame: {e}"})
+                    continue
+                finally:
+                    listener = None
+                if not isinstance(data, dict):
+                    await websocket.send_json({"error": "Bad frame: expected a JSON object"})
+                    continue
+                if data.get("stop"):
+                    continue
+                try:
+                    body = ChatIn(**data)
+                    name, message, model = resolve_chat(body)
+                    if body.candidates > 1:
+                        raise HTTPException(400, f"candidates need POST {API_PREFIX}/chat")
+                except HTTPException as e:
+                    await websocket.send_json({"error": e.detail})
+                    continue
+                except Exception as e:
+                    await websocket.send_json({"error": str(e)})
+                    continue
+                
+                cancel = threading.Event()
+                turn = stream_chat_turn(name, message, model, body.temperature, body.max_tokens, body.auto_memory,
+                                        cancel=cancel, keep_partial=body.keep_partial,
+                                        user=body.user or (websocket.client.host if websocket.client else None),
+                                        fork_at=body.fork_at)
+                listener = asyncio.ensure_future(websocket.receive_json())
+                chunk = asyncio.ensure_future(run_in_threadpool(next, turn, None))
+                parts = []
+                try:
+                    while True:
+                        # Wait on the client as well as the reply, so a stop or a disconnect
+                        # during prefill cancels the backend right away, not at the next token.
+                        await asyncio.wait({chunk, listener}, return_when=asyncio.FIRST_COMPLETED)
+                        if listener.done():
+                            error = listener.exception()
+                            if isinstance(error, WebSocketDisconnect):
+                                cancel.set()
+                                raise error
+                            if error is not None:
+                                await websocket.send_json({"error": f"Bad frame: {error}"})
+                            elif isinstance(listener.result(), dict) and listener.result().get("stop"):
+                                cancel.set()
+                            else:
+                                await websocket.send_json({"error": "Busy: send {\"stop\": true} or wait for the reply"})
+                            listener = asyncio.ensure_future(websocket.receive_json())
+                            continue
+                        piece = chunk.result()
+                        if piece is None:
+                            break
+                        parts.append(piece)
+                        await websocket.send_json({"token": piece})
+                        chunk = asyncio.ensure_future(run_in_threadpool(next, turn, None))
+                    await websocket.send_json({"done": True, "stopped": cancel.is_set(), "response": "".join(parts).strip()})
+                except WebSocketDisconnect:
+                    cancel.set()
+                    raise
+                except Overloaded as e:
+                    await websocket.send_json(busy(e))
+                except Exception as e:
+                    await websocket.send_json({"error": str(e)})
+                finally:
+                    if not chunk.done():
+                        cancel.set()
+                        await asyncio.wait({chunk})   # the worker is still inside the turn; close it once it's out
+                    turn.close()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if listener and not listener.done():
+                listener.cancel()
     
-    status += "</div>"
-    return status
+    return api
 
-def refresh_models():
+# ============ INITIALIZATION ============
+
+def probe_backends():
+    """Detect the LLM backend and its models. Runs in the background once the server is listening."""
     global active_llm, available_models
     
-    llm_backends = BackendDetector.detect_llm_backends()
-    
-    if llm_backends:
-        for key, name in llm_backends:
+    llm = BackendDetector.detect_llm_backends()
+    if llm:
+        for key, _ in llm:
             if key == 'ollama':
                 models = BackendDetector.get_ollama_models()
                 if models:
-                    active_llm = key
                     available_models = models
-                    return (
-                        gr.Dropdown(choices=models, value=models[0]),
-                        gr.Dropdown(choices=models, value=models[0]),
-                        f"<div class='alert alert-success'>✅ Found {len(models)} models</div>"
-                    )
-    
-    return (
-        gr.Dropdown(choices=["No models"], value="No models"),
-        gr.Dropdown(choices=["No models"], value="No models"),
-        "<div class='alert alert-error'>❌ No backends detected</div>"
-    )
+                    active_llm = key
+                    print(f"✅ Models: {', '.join(models[:3])}")
+    else:
+        print("⚠️  No LLM detected")
 
-# ============ INITIALIZATION ============
+def sync_model_dropdowns(current):
+    """Page-load hook: the UI may be built before the background probe finished."""
+    if not available_models:
+        return gr.update(), gr.update()
+    value = current if current in available_models else available_models[0]
+    return gr.Dropdown(choices=available_models, value=value), gr.Dropdown(choices=available_models, value=value)
 
-load_characters_from_files()
+def report_time_to_listening(what):
+    elapsed = time.perf_counter() - _PROCESS_START
+    marker = "⏱️ " if elapsed <= STARTUP_TARGET_SECONDS else "🐢"
+    print(f"{marker} {what} listening after {elapsed:.2f}s (target {STARTUP_TARGET_SECONDS:.1f}s)")
+    return elapsed
 
 # ============ UI CONSTRUCTION ============
 
-with gr.Blocks(title=f"{APP_NAME} - AI Character Sandbox", css=CUSTOM_CSS, theme=gr.themes.Base()) as app:
+def build_ui():
+    """Build the Gradio app. Initial dropdown values and info panels are computed once from the loaded index."""
+    char_list = get_character_list()
+    first_character = char_list[0] if char_list else None
+    first_character_info = get_character_info(first_character)
     
-    gr.HTML(f"""
-    <div class="header-container">
-        <h1 class="header-title">🎭 {APP_NAME}</h1>
-        <p style="text-align: center; color: var(--text-secondary); font-size: 16px; margin-top: 10px;">
-            v{VERSION} · Enhanced Memory · Self-hosted & Private
-        </p>
-    </div>
-    """)
-    
-    gr.HTML("""
-    <div style="text-align: center; padding: 15px; background: rgba(245, 158, 11, 0.1); 
-                border: 1px solid var(--warning); border-radius: 12px; margin: 20px 0;">
-        <span style="color: var(--warning); font-weight: 600;">
-            ⚠️ 18+ Only · Local AI · Characters Remember You! 🧠
-        </span>
-    </div>
-    """)
+    # Gradio finds progress trackers by a gr.Progress() default, which can't be created before gradio is imported.
+    def import_archive(archive, dry_run, overwrite, progress=gr.Progress()):
+        return import_characters_ui(archive, dry_run, overwrite, progress)
+    
+    def export_archive(progress=gr.Progress()):
+        return export_characters_ui(progress)
+    
+    # Each browser tab gets its own cancel flag, keyed by the Gradio session.
+    def chat_stream(character_name, user_message, history, model, temperature, max_tokens, auto_memory,
+                    keep_partial, candidates, request: gr.Request):
+        yield from chat_with_character(character_name, user_message, history, model, temperature, max_tokens,
+                                       auto_memory, keep_partial, session=request.session_hash,
+                                       candidates=int(candidates))
+    
+    def stop_chat(request: gr.Request):
+        stop_generation(request.session_hash)
+    
+    def regenerate_stream(character_name, history, model, temperature, max_tokens, auto_memory, keep_partial,
+                          candidates, request: gr.Request):
+        for chat_history, _ in regenerate_reply(character_name, history, model, temperature, max_tokens, auto_memory,
+                                                keep_partial, session=request.session_hash, candidates=int(candidates)):
+            yield chat_history
+    
+    def edit_stream(character_name, turn_number, new_message, history, model, temperature, max_tokens, auto_memory,
+                    keep_partial, candidates, request: gr.Request):
+        yield from edit_message(character_name, turn_number, new_message, history, model, temperature, max_tokens,
+                                auto_memory, keep_partial, session=request.session_hash, candidates=int(candidates))
+    
+    # Candidate swipes are held per session; anything that moves the chat on keeps the one on screen.
+    def show_candidates(request: gr.Request):
+        return candidate_bar(request.session_hash)
+    
+    def swipe_prev(history, request: gr.Request):
+        return swipe_candidate(history, -1, request.session_hash)
+    
+    def swipe_next(history, request: gr.Request):
+        return swipe_candidate(history, 1, request.session_hash)
+    
+    def keep_shown(request: gr.Request):
+        candidate_replies.settle(request.session_hash)
+        return candidate_bar(request.session_hash)
+    
+    def select_character(name, request: gr.Request):
+        candidate_replies.settle(request.session_hash)
+        return (get_character_info(name), load_chat_history(name)) + candidate_bar(request.session_hash)
+    
+    def select_branch(name, branch_id, request: gr.Request):
+        candidate_replies.settle(request.session_hash)
+        # A refused switch (reply in flight, another window) snaps the dropdown back to the shown branch.
+        return (switch_branch_ui(name, branch_id),) + candidate_bar(request.session_hash) + (branch_selector(name),)
+    
+    def clear_conversation(name, request: gr.Request):
+        candidate_replies.discard(request.session_hash)
+        return (clear_chat(name),) + candidate_bar(request.session_hash)
     
-    with gr.Tabs():
-        with gr.Tab("💬 Chat"):
-            with gr.Row():
-                with gr.Column(scale=1, min_width=300):
-                    gr.Markdown("### 🎭 Character")
+    def pick_turn(name, history, evt: gr.SelectData):
+        row = evt.index[0] if isinstance(evt.index, (list, tuple)) else evt.index
+        turn = history_index_for_row(name, history, row)
+        if turn is None:
+            return gr.update(), gr.update()
+        return turn + 1, load_chat_history(name)[turn][0]
+    
+    def scene_chat(members, user_message, history, model, temperature, max_tokens, mode, auto_memory, request: gr.Request):
+        return group_chat(members, user_message, history, model, temperature, max_tokens, mode, auto_memory,
+                          session=request.session_hash)
+    
+    # Named fonts only: the default theme would pull Source Sans Pro and IBM Plex Mono from Google Fonts.
+    # Font objects, not strings: Gradio 5 compares themes via Font.__eq__, which breaks on plain names.
+    theme = gr.themes.Base(font=[gr.themes.Font(name) for name in ("Poppins", "Segoe UI", "system-ui", "sans-serif")],
+                           font_mono=[gr.themes.Font(name) for name in ("ui-monospace", "Consolas", "monospace")])
+    
+    with gr.Blocks(title=f"{APP_NAME} - AI Character Sandbox", head=get_static_assets().head(), theme=theme) as app:
+    
+        gr.HTML(f"""
+        <div class="header-container">
+            <h1 class="header-title">🎭 {APP_NAME}</h1>
+            <p style="text-align: center; color: var(--text-secondary); font-size: 16px; margin-top: 10px;">
+                v{VERSION} · Enhanced Memory · Self-hosted & Private
+            </p>
+        </div>
+        """)
+    
+        gr.HTML("""
+        <div style="text-align: center; padding: 15px; background: rgba(245, 158, 11, 0.1); 
+                    border: 1px solid var(--warning); border-radius: 12px; margin: 20px 0;">
+            <span style="color: var(--warning); font-weight: 600;">
+                ⚠️ 18+ Only · Local AI · Characters Remember You! 🧠
+            </span>
+        </div>
+        """)
+    
+        with gr.Tabs():
+            with gr.Tab("💬 Chat"):
+                with gr.Row():
+                    with gr.Column(scale=1, min_width=300):
+                        gr.Markdown("### 🎭 Character")
                     
-                    character_select = gr.Dropdown(
-                        choices=get_character_list(),
-                        value=get_character_list()[0] if get_character_list() else None,
-                        label="Select Character",
-                        interactive=True
-                    )
+                        character_select = gr.Dropdown(
+                            choices=char_list,
+                            value=first_character,
+                            label="Select Character",
+                            interactive=True
+                        )
                     
-                    character_info_display = gr.HTML(
-                        get_character_info(get_character_list()[0] if get_character_list() else None)
-                    )
+                        character_info_display = gr.HTML(
+                            first_character_info
+                        )
                     
-                    gr.Markdown("---")
-                    gr.Markdown("### ⚙️ AI Settings")
+                        gr.Markdown("---")
+                        gr.Markdown("### ⚙️ AI Settings")
                     
-                    model_select = gr.Dropdown(
-                        choices=available_models if available_models else ["No models"],
-                        value=available_models[0] if available_models else "No models",
-                        label="Model"
-                    )
+                        model_select = gr.Dropdown(
+                            choices=available_models if available_models else ["No models"],
+                            value=available_models[0] if available_models else "No models",
+                            label="Model"
+                        )
                     
-                    temperature = gr.Slider(0.1, 2.0, 0.9, step=0.1, label="🔥 Creativity")
-                    max_tokens = gr.Slider(50, 500, 200, step=50, label="📏 Length")
+                        model_status = gr.HTML(get_model_status(available_models[0] if available_models else None))
                     
-                    gr.Markdown("---")
-                    gr.Markdown("### 🧠 Memory")
+                        temperature = gr.Slider(0.1, 2.0, 0.9, step=0.1, label="🔥 Creativity")
+                        max_tokens = gr.Slider(50, 500, 200, step=50, label="📏 Length")
+                        candidates = gr.Slider(
+                            1, MAX_CANDIDATES, 1, step=1,
+                            label="🎲 Candidates",
+                            info="Generate several replies at once and swipe between them"
+                        )
                     
-                    auto_memory = gr.Checkbox(
-                        label="Auto-learn from conversation",
-                        value=True
-                    )
+                        gr.Markdown("---")
+                        gr.Markdown("### 🧠 Memory")
                     
-                    gr.Markdown("---")
+                        auto_memory = gr.Checkbox(
+                            label="Auto-learn from conversation",
+                            value=True
+                        )
                     
-                    clear_btn = gr.Button("🗑️ Clear Chat", variant="secondary", size="lg")
-                
-                with gr.Column(scale=3):
-                    chatbot = gr.Chatbot(
-                        label="Conversation",
-                        value=[],
-                        height=650,
-                        type="tuples"
-                    )
+                        prefetch_enabled = gr.Checkbox(
+                            label="⚡ Prefetch prompt while typing",
+                            value=False,
+                            info="Warms the model's cache with persona and history before you hit Send"
+                        )
                     
-                    with gr.Row():
-                        msg_input = gr.Textbox(
-                            placeholder="Type your message... ✨",
-                            show_label=False,
-                            scale=4,
-                            lines=2
+                        keep_partial = gr.Checkbox(
+                            label="Keep partial replies when stopped",
+                            value=True
+                        )
+                    
+                        gr.Markdown("---")
+                    
+                        clear_btn = gr.Button("🗑️ Clear Chat", variant="secondary", size="lg")
+                
+                    with gr.Column(scale=3):
+                        chatbot = gr.Chatbot(
+                            label="Conversation",
+                            value=[],
+                            height=650,
+                            type="tuples"
                         )
-                        send_btn = gr.Button("Send ➤", variant="primary", scale=1, size="lg")
+                    
+                        with gr.Row(visible=False) as candidate_row:
+                            prev_btn = gr.Button("◀", size="sm", scale=1)
+                            candidate_label = gr.Markdown("")
+                            next_btn = gr.Button("▶", size="sm", scale=1)
+                            keep_btn = gr.Button("✅ Keep this reply", variant="primary", size="sm", scale=2)
+                    
+                        with gr.Row():
+                            msg_input = gr.Textbox(
+                                placeholder="Type your message... ✨",
+                                show_label=False,
+                                scale=4,
+                                lines=2
+                            )
+                            send_btn = gr.Button("Send ➤", variant="primary", scale=1, size="lg")
+                            stop_btn = gr.Button("⏹️ Stop", variant="stop", scale=1, size="lg")
+                    
+                        with gr.Row():
+                            first_branches, first_branch = list_branches(first_character)
+                            branch_select = gr.Dropdown(
+                                choices=first_branches,
+                                value=first_branch,
+                                label="🌿 Branch",
+                                scale=4
+                            )
+                            regen_btn = gr.Button("🔄 Regenerate", variant="secondary", scale=1)
+                    
+                        with gr.Accordion("✏️ Edit a message", open=False):
+                            gr.Markdown("Click one of your messages above, change it and resend. The old version stays on its own branch.")
+                            with gr.Row():
+                                edit_turn = gr.Number(label="Turn #", precision=0, minimum=1, scale=1)
+                                edit_text = gr.Textbox(label="New message", lines=2, scale=4)
+                                edit_btn = gr.Button("✏️ Resend", variant="primary", scale=1)
             
-            character_select.change(
-                fn=lambda name: (get_character_info(name), load_chat_history(name)),
-                inputs=[character_select],
-                outputs=[character_info_display, chatbot]
-            )
+                character_select.change(
+                    fn=select_character,
+                    inputs=[character_select],
+                    outputs=[character_info_display, chatbot, candidate_row, candidate_label]
+                )
             
-            msg_input.submit(
-                chat_with_character,
-                [character_select, msg_input, chatbot, model_select, temperature, max_tokens, auto_memory],
-                [chatbot, msg_input]
-            )
+                character_select.change(branch_selector, [character_select], [branch_select], show_progress="hidden")
+                character_select.change(warm_selected_model, [model_select], [model_status], show_progress="hidden")
+                model_select.change(warm_selected_model, [model_select], [model_status], show_progress="hidden")
             
-            send_btn.click(
-                chat_with_character,
-                [character_select, msg_input, chatbot, model_select, temperature, max_tokens, auto_memory],
-                [chatbot, msg_input]
-            )
+                for typing_event in (msg_input.focus, msg_input.input):
+                    typing_event(
+                        prefetch_prompt,
+                        [character_select, model_select, prefetch_enabled],
+                        None,
+                        show_progress="hidden",
+                        queue=False,
+                        trigger_mode="always_last"
+                    )
             
-            clear_btn.click(
-                lambda name: clear_chat(name),
-                [character_select],
-                [chatbot]
-            )
+                for send_event in (msg_input.submit, send_btn.click):
+                    send_event(
+                        chat_stream,
+                        [character_select, msg_input, chatbot, model_select, temperature, max_tokens, auto_memory,
+                         keep_partial, candidates],
+                        [chatbot, msg_input],
+                        concurrency_limit=UI_GENERATION_LIMIT,
+                        concurrency_id="generation"
+                    ).then(branch_selector, [character_select], [branch_select], show_progress="hidden"
+                    ).then(show_candidates, None, [candidate_row, candidate_label], show_progress="hidden")
+            
+                stop_btn.click(stop_chat, None, None, queue=False)
+            
+                regen_btn.click(
+                    regenerate_stream,
+                    [character_select, chatbot, model_select, temperature, max_tokens, auto_memory, keep_partial, candidates],
+                    [chatbot],
+                    concurrency_limit=UI_GENERATION_LIMIT,
+                    concurrency_id="generation"
+                ).then(branch_selector, [character_select], [branch_select], show_progress="hidden"
+                ).then(show_candidates, None, [candidate_row, candidate_label], show_progress="hidden")
+            
+                for edit_event in (edit_text.submit, edit_btn.click):
+                    edit_event(
+                        edit_stream,
+                        [character_select, edit_turn, edit_text, chatbot, model_select, temperature, max_tokens,
+                         auto_memory, keep_partial, candidates],
+                        [chatbot, edit_text],
+                        concurrency_limit=UI_GENERATION_LIMIT,
+                        concurrency_id="generation"
+                    ).then(branch_selector, [character_select], [branch_select], show_progress="hidden"
+                    ).then(show_candidates, None, [candidate_row, candidate_label], show_progress="hidden")
+            
+                prev_btn.click(swipe_prev, [chatbot], [chatbot, candidate_row, candidate_label], queue=False)
+                next_btn.click(swipe_next, [chatbot], [chatbot, candidate_row, candidate_label], queue=False)
+                keep_btn.click(keep_shown, None, [candidate_row, candidate_label]
+                ).then(branch_selector, [character_select], [branch_select], show_progress="hidden")
+            
+                chatbot.select(pick_turn, [character_select, chatbot], [edit_turn, edit_text])
+                branch_select.input(select_branch, [character_select, branch_select],
+                                    [chatbot, candidate_row, candidate_label, branch_select])
+            
+                clear_btn.click(
+                    clear_conversation,
+                    [character_select],
+                    [chatbot, candidate_row, candidate_label]
+                ).then(branch_selector, [character_select], [branch_select], show_progress="hidden")
         
-        with gr.Tab("🧠 Memory Bank"):
-            gr.HTML("""
-            <div class='panel-container'>
-                <h2 style='color: var(--accent-primary);'>Character Memory Management</h2>
-                <p>View and manage what your characters remember about you.</p>
-            </div>
-            """)
+            with gr.Tab("👥 Group Scene"):
+                with gr.Row():
+                    with gr.Column(scale=1, min_width=300):
+                        gr.Markdown("### 🎭 Cast")
+                    
+                        scene_members = gr.Dropdown(
+                            choices=char_list,
+                            value=[],
+                            multiselect=True,
+                            label="Characters in the scene"
+                        )
+                    
+                        scene_mode = gr.Radio(
+                            choices=SCENE_MODES,
+                            value="parallel",
+                            label="Who replies"
+                        )
+                    
+                        gr.Markdown("---")
+                    
+                        scene_clear_btn = gr.Button("🗑️ Clear Scene", variant="secondary", size="lg")
+                
+                    with gr.Column(scale=3):
+                        scene_chatbot = gr.Chatbot(
+                            label="Scene",
+                            value=[],
+                            height=650,
+                            type="tuples"
+                        )
+                    
+                        with gr.Row():
+                            scene_input = gr.Textbox(
+                                placeholder="Say something to the group... ✨",
+                                show_label=False,
+                                scale=4,
+                                lines=2
+                            )
+                            scene_send_btn = gr.Button("Send ➤", variant="primary", scale=1, size="lg")
             
-            with gr.Row():
-                with gr.Column(scale=1):
-                    memory_character_select = gr.Dropdown(
-                        choices=get_character_list(),
-                        value=get_character_list()[0] if get_character_list() else None,
-                        label="Select Character"
+                scene_members.change(load_group_scene, [scene_members], [scene_chatbot])
+            
+                for scene_event in (scene_input.submit, scene_send_btn.click):
+                    scene_event(
+                        scene_chat,
+                        [scene_members, scene_input, scene_chatbot, model_select, temperature, max_tokens, scene_mode, auto_memory],
+                        [scene_chatbot, scene_input],
+                        concurrency_limit=UI_GENERATION_LIMIT,
+                        concurrency_id="generation"
                     )
+            
+                scene_clear_btn.click(clear_group_scene, [scene_members], [scene_chatbot])
+        
+            with gr.Tab("🧠 Memory Bank"):
+                gr.HTML("""
+                <div class='panel-container'>
+                    <h2 style='color: var(--accent-primary);'>Character Memory Management</h2>
+                    <p>View and manage what your characters remember about you.</p>
+                </div>
+                """)
+            
+                with gr.Row():
+                    with gr.Column(scale=1):
+                        memory_character_select = gr.Dropdown(
+                            choices=char_list,
+                            value=first_character,
+                            label="Select Character"
+                        )
                     
-                    gr.Markdown("### ➕ Add Memory")
+                        gr.Markdown("### ➕ Add Memory")
                     
-                    manual_fact = gr.Textbox(
-                        label="Add Fact",
-                        placeholder="e.g., User is a software engineer",
-                        lines=2
-                    )
+                        manual_fact = gr.Textbox(
+                            label="Add Fact",
+                            placeholder="e.g., User is a software engineer",
+                            lines=2
+                        )
                     
-                    add_fact_btn = gr.Button("➕ Add Fact", variant="primary")
+                        add_fact_btn = gr.Button("➕ Add Fact", variant="primary")
                     
-                    gr.Markdown("---")
-                    gr.Markdown("### ⭐ Tag Moment")
+                        gr.Markdown("---")
+                        gr.Markdown("### ⭐ Tag Moment")
                     
-                    moment_text = gr.Textbox(
-                        label="Describe Moment",
-                        placeholder="e.g., User shared their dream",
-                        lines=3
-                    )
+                        moment_text = gr.Textbox(
+                            label="Describe Moment",
+                            placeholder="e.g., User shared their dream",
+                            lines=3
+                        )
                     
-                    moment_tags = gr.Textbox(
-                        label="Tags (comma-separated)",
-                        placeholder="e.g., personal, dreams",
-                        lines=1
-                    )
+                        moment_tags = gr.Textbox(
+                            label="Tags (comma-separated)",
+                            placeholder="e.g., personal, dreams",
+                            lines=1
+                        )
                     
-                    tag_moment_btn = gr.Button("⭐ Tag Moment", variant="primary")
+                        tag_moment_btn = gr.Button("⭐ Tag Moment", variant="primary")
                     
-                    gr.Markdown("---")
+                        gr.Markdown("---")
                     
-                    clear_memory_btn = gr.Button("🗑️ Clear Memories", variant="stop")
+                        clear_memory_btn = gr.Button("🗑️ Clear Memories", variant="stop")
                     
-                    memory_status = gr.HTML()
+                        memory_status = gr.HTML()
                 
-                with gr.Column(scale=2):
-                    memory_display = gr.HTML(
-                        get_memory_display(get_character_list()[0] if get_character_list() else None)
-                    )
+                    with gr.Column(scale=2):
+                        memory_display = gr.HTML(
+                            get_memory_display(first_character)
+                        )
             
-            memory_character_select.change(
-                fn=get_memory_display,
-                inputs=[memory_character_select],
-                outputs=[memory_display]
-            )
+                memory_character_select.change(
+                    fn=get_memory_display,
+                    inputs=[memory_character_select],
+                    outputs=[memory_display]
+                )
             
-            add_fact_btn.click(
-                add_manual_memory,
-                [memory_character_select, manual_fact],
-                [memory_status, memory_display]
-            )
+                add_fact_btn.click(
+                    add_manual_memory,
+                    [memory_character_select, manual_fact],
+                    [memory_status, memory_display]
+                )
             
-            tag_moment_btn.click(
-                tag_moment,
-                [memory_character_select, moment_text, moment_tags],
-                [memory_status, memory_display]
-            )
+                tag_moment_btn.click(
+                    tag_moment,
+                    [memory_character_select, moment_text, moment_tags],
+                    [memory_status, memory_display]
+                )
             
-            clear_memory_btn.click(
-                clear_memories,
-                [memory_character_select],
-                [memory_status, memory_display]
-            )
+                clear_memory_btn.click(
+                    clear_memories,
+                    [memory_character_select],
+                    [memory_status, memory_display]
+                )
         
-        with gr.Tab("➕ Create Character"):
-            gr.HTML("""
-            <div class='panel-container'>
-                <h2 style='color: var(--accent-primary);'>✨ Create a New Character</h2>
-                <p>Design your perfect AI companion.</p>
-            </div>
-            """)
+            with gr.Tab("➕ Create Character"):
+                gr.HTML("""
+                <div class='panel-container'>
+                    <h2 style='color: var(--accent-primary);'>✨ Create a New Character</h2>
+                    <p>Design your perfect AI companion.</p>
+                </div>
+                """)
             
-            with gr.Column():
-                char_name = gr.Textbox(label="Character Name", placeholder="e.g., Sarah")
-                char_personality = gr.Textbox(
-                    label="Personality (Required)",
-                    placeholder="e.g., Witty engineer who loves coffee",
-                    lines=3
-                )
-                char_backstory = gr.Textbox(
-                    label="Backstory (Optional)",
-                    placeholder="e.g., Former game developer...",
-                    lines=5
-                )
-                char_appearance = gr.Textbox(
-                    label="Appearance (Optional)",
-                    placeholder="e.g., Mid-30s, brown hair",
-                    lines=2
-                )
-                char_example = gr.Textbox(
-                    label="Example Dialogue (Optional)",
-                    placeholder="User: Hi!\nSarah: Hey there!",
-                    lines=3
-                )
+                with gr.Column():
+                    char_name = gr.Textbox(label="Character Name", placeholder="e.g., Sarah")
+                    char_personality = gr.Textbox(
+                        label="Personality (Required)",
+                        placeholder="e.g., Witty engineer who loves coffee",
+                        lines=3
+                    )
+                    char_backstory = gr.Textbox(
+                        label="Backstory (Optional)",
+                        placeholder="e.g., Former game developer...",
+                        lines=5
+                    )
+                    char_appearance = gr.Textbox(
+                        label="Appearance (Optional)",
+                        placeholder="e.g., Mid-30s, brown hair",
+                        lines=2
+                    )
+                    char_example = gr.Textbox(
+                        label="Example Dialogue (Optional)",
+                        placeholder="User: Hi!\nSarah: Hey there!",
+                        lines=3
+                    )
                 
-                create_btn = gr.Button("✨ Create Character", variant="primary", size="lg")
-                create_output = gr.HTML()
+                    create_btn = gr.Button("✨ Create Character", variant="primary", size="lg")
+                    create_output = gr.HTML()
             
-            create_btn.click(
-                create_character,
-                [char_name, char_personality, char_backstory, char_appearance, char_example],
-                [create_output, character_select, char_name]
-            )
+                create_btn.click(
+                    create_character,
+                    [char_name, char_personality, char_backstory, char_appearance, char_example],
+                    [create_output, character_select, char_name]
+                )
         
-        with gr.Tab("📋 Manage Characters"):
-            gr.HTML("""
-            <div class='panel-container'>
-                <h2 style='color: var(--accent-primary);'>📋 Manage Your Characters</h2>
-                <p>View or delete characters.</p>
-            </div>
-            """)
+            with gr.Tab("📋 Manage Characters"):
+                gr.HTML("""
+                <div class='panel-container'>
+                    <h2 style='color: var(--accent-primary);'>📋 Manage Your Characters</h2>
+                    <p>View or delete characters.</p>
+                </div>
+                """)
             
-            with gr.Column():
-                manage_character_select = gr.Dropdown(
-                    choices=get_character_list(),
-                    value=get_character_list()[0] if get_character_list() else None,
-                    label="Select Character"
-                )
+                with gr.Column():
+                    manage_character_select = gr.Dropdown(
+                        choices=char_list,
+                        value=first_character,
+                        label="Select Character"
+                    )
                 
-                manage_character_info = gr.HTML(
-                    get_character_info(get_character_list()[0] if get_character_list() else None)
-                )
+                    manage_character_info = gr.HTML(
+                        first_character_info
+                    )
                 
-                gr.Markdown("---")
+                    gr.Markdown("---")
+                
+                    stop_input = gr.Textbox(
+                        value=get_stop_sequences_text(first_character),
+                        label="🛑 Stop sequences",
+                        lines=3,
+                        info="One per line; replies are cut where one appears. Write \\n for a line break. "
+                             "New speaker lines (\\nUser:, \\nName:) always stop a reply."
+                    )
+                    save_stops_btn = gr.Button("💾 Save Stop Sequences", variant="secondary")
+                    stops_output = gr.HTML()
+                
+                    gr.Markdown("---")
+                
+                    delete_btn = gr.Button("❌ Delete This Character", variant="stop", size="lg")
+                    delete_output = gr.HTML()
+                
+                    gr.Markdown("---")
+                    gr.Markdown("### 📦 Bulk Import / Export")
+                
+                    with gr.Row():
+                        import_file = gr.File(label="Archive (.zip or .jsonl)", file_types=[".zip", ".jsonl"])
+                        export_file = gr.File(label="Exported Archive", interactive=False)
                 
-                delete_btn = gr.Button("❌ Delete This Character", variant="stop", size="lg")
-                delete_output = gr.HTML()
+                    with gr.Row():
+                        import_dry_run = gr.Checkbox(label="Dry run (validate only)", value=True)
+                        import_overwrite = gr.Checkbox(label="Overwrite existing characters", value=False)
+                
+                    with gr.Row():
+                        import_btn = gr.Button("📥 Import", variant="primary")
+                        export_btn = gr.Button("📤 Export All", variant="secondary")
+                
+                    bulk_output = gr.HTML()
             
-            manage_character_select.change(
-                fn=get_character_info,
-                inputs=[manage_character_select],
-                outputs=[manage_character_info]
-            )
+                manage_character_select.change(
+                    fn=get_character_info,
+                    inputs=[manage_character_select],
+                    outputs=[manage_character_info]
+                )
             
-            delete_btn.click(
-                delete_character,
-                [manage_character_select],
-                [delete_output, character_select]
-            )
-        
-        with gr.Tab("⚙️ Setup"):
-            gr.HTML("""
-            <div class='panel-container'>
-                <h2 style='color: var(--accent-primary);'>⚙️ System Configuration</h2>
-            </div>
-            """)
+                manage_character_select.change(get_stop_sequences_text, [manage_character_select], [stop_input])
+                save_stops_btn.click(save_stop_sequences, [manage_character_select, stop_input], [stops_output])
             
-            check_btn = gr.Button("🔍 Check AI Backends", variant="primary", size="lg")
-            status_display = gr.HTML()
+                delete_btn.click(
+                    delete_character,
+                    [manage_character_select],
+                    [delete_output, character_select]
+                )
             
-            gr.Markdown("---")
-            gr.Markdown("### 🤖 Model Management")
+                import_btn.click(
+                    import_archive,
+                    [import_file, import_dry_run, import_overwrite],
+                    [bulk_output, character_select]
+                )
             
-            with gr.Row():
-                model_dropdown_global = gr.Dropdown(
-                    choices=available_models if available_models else ["No models"],
-                    value=available_models[0] if available_models else "No models",
-                    label="Available Models",
-                    scale=3
+                export_btn.click(
+                    export_archive,
+                    None,
+                    [bulk_output, export_file]
                 )
+        
+            with gr.Tab("⚙️ Setup") as setup_tab:
+                gr.HTML("""
+                <div class='panel-container'>
+                    <h2 style='color: var(--accent-primary);'>⚙️ System Configuration</h2>
+                </div>
+                """)
+            
+                check_btn = gr.Button("🔍 Check AI Backends", variant="primary", size="lg")
+                status_display = gr.HTML()
+            
+                gr.Markdown("---")
+                gr.Markdown("### 🤖 Model Management")
+            
+                with gr.Row():
+                    model_dropdown_global = gr.Dropdown(
+                        choices=available_models if available_models else ["No models"],
+                        value=available_models[0] if available_models else "No models",
+                        label="Available Models",
+                        scale=3
+                    )
                 
-                refresh_models_btn = gr.Button("🔄 Refresh", variant="primary", size="lg", scale=1)
+                    refresh_models_btn = gr.Button("🔄 Refresh", variant="primary", size="lg", scale=1)
+            
+                refresh_status = gr.HTML()
+            
+                keep_alive_select = gr.Dropdown(
+                    choices=KEEP_ALIVE_CHOICES,
+                    value=MODEL_KEEP_ALIVE,
+                    label="Keep model loaded for",
+                    allow_custom_value=True,
+                    info="Warm models answer instantly; pinned models never unload"
+                )
+            
+                gr.Markdown("---")
+                gr.Markdown("### 🎨 Appearance")
+            
+                lite_theme = gr.Checkbox(
+                    label="🪶 Reduced motion / low-GPU theme",
+                    value=LOW_MOTION_DEFAULT,
+                    info="No animated background, transitions or glow. Saved in this browser"
+                )
+            
+                gr.Markdown("---")
+                gr.Markdown("### 🔬 Profiling")
+            
+                with gr.Row():
+                    profile_mode = gr.Radio(
+                        choices=PROFILE_MODES,
+                        value=request_profiler.mode,
+                        label="Profile chat turns",
+                        scale=2
+                    )
+                    profile_count = gr.Number(value=request_profiler.count, label="N", precision=0, minimum=1, scale=1)
+                    profile_alloc = gr.Checkbox(
+                        label="Track allocations",
+                        value=request_profiler.allocations,
+                        info="tracemalloc, only while a turn is profiled",
+                        scale=1
+                    )
             
-            refresh_status = gr.HTML()
+                profile_btn = gr.Button("🔬 Apply", variant="secondary")
+                profile_status = gr.HTML(request_profiler.status())
             
-            gr.HTML("""
-            <div class='panel-container' style='margin-top: 30px;'>
-                <h2>📚 Quick Start</h2>
-                <ol>
-                    <li>Install <a href='https://ollama.ai' target='_blank'>Ollama</a></li>
-                    <li>Run: <code>ollama pull llama3.2</code></li>
-                    <li>Click "Check AI Backends"</li>
-                    <li>Create a character</li>
-                    <li>Start chatting!</li>
-                </ol>
+                gr.HTML("""
+                <div class='panel-container' style='margin-top: 30px;'>
+                    <h2>📚 Quick Start</h2>
+                    <ol>
+                        <li>Install <a href='https://ollama.ai' target='_blank'>Ollama</a></li>
+                        <li>Run: <code>ollama pull llama3.2</code></li>
+                        <li>Click "Check AI Backends"</li>
+                        <li>Create a character</li>
+                        <li>Start chatting!</li>
+                    </ol>
                 
-                <h3>🧠 Memory Features</h3>
-                <p>Characters automatically learn:</p>
-                <ul>
-                    <li>Your name, job, interests</li>
-                    <li>Your preferences</li>
-                    <li>Important moments</li>
-                </ul>
+                    <h3>🧠 Memory Features</h3>
+                    <p>Characters automatically learn:</p>
+                    <ul>
+                        <li>Your name, job, interests</li>
+                        <li>Your preferences</li>
+                        <li>Important moments</li>
+                    </ul>
                 
-                <h3>🎨 Model Recommendations</h3>
-                <ul>
-                    <li><strong>llama3.2:1b</strong> - Fast (1GB)</li>
-                    <li><strong>llama3.2</strong> - Balanced (3GB) ⭐</li>
-                    <li><strong>llama3.1:8b</strong> - Best quality (8GB)</li>
-                </ul>
-            </div>
-            """)
+                    <h3>🎨 Model Recommendations</h3>
+                    <ul>
+                        <li><strong>llama3.2:1b</strong> - Fast (1GB)</li>
+                        <li><strong>llama3.2</strong> - Balanced (3GB) ⭐</li>
+                        <li><strong>llama3.1:8b</strong> - Best quality (8GB)</li>
+                    </ul>
+                </div>
+                """)
             
-            check_btn.click(check_backends, None, status_display)
+                check_btn.click(check_backends, None, status_display)
+                lite_theme.input(None, [lite_theme], None, js=TOGGLE_LITE_THEME_JS)
+                profile_btn.click(set_profiling, [profile_mode, profile_count, profile_alloc], [profile_status])
+                setup_tab.select(request_profiler.status, None, [profile_status], show_progress="hidden")
             
-            refresh_models_btn.click(
-                refresh_models,
-                None,
-                [model_select, model_dropdown_global, refresh_status]
-            )
+                refresh_models_btn.click(
+                    refresh_models,
+                    None,
+                    [model_select, model_dropdown_global, refresh_status]
+                )
+    
+        seen_character_version = gr.State(character_index_version)
+        character_refresh_timer = gr.Timer(UI_REFRESH_INTERVAL)
+        character_refresh_timer.tick(
+            refresh_character_dropdowns,
+            [seen_character_version, character_select, memory_character_select, manage_character_select, scene_members],
+            [seen_character_version, character_select, memory_character_select, manage_character_select, scene_members],
+            show_progress="hidden", concurrency_limit=None
+        )
+        character_refresh_timer.tick(get_model_status, [model_select], [model_status], show_progress="hidden",
+                                     concurrency_limit=None)
+    
+        keep_alive_select.change(set_keep_alive, [keep_alive_select, model_select], [model_status])
+        app.load(None, None, [lite_theme], js=LITE_THEME_JS)
+        app.unload(stop_chat)   # a closed or reloaded tab stops its reply instead of generating for nobody
+        app.load(
+            sync_model_dropdowns, [model_select], [model_select, model_dropdown_global], show_progress="hidden"
+        ).then(warm_selected_model, [model_select], [model_status], show_progress="hidden")
+    
+    return app
+
+def run_bulk_command(args):
+    def report(done, total):
+        print(f"  {done}/{total if total else '?'} records")
+    
+    if args.export_path:
+        count = export_characters_archive(args.export_path, progress=report)
+        print(f"✅ Exported {count} characters to {args.export_path}")
+    
+    if args.import_path:
+        summary = import_characters_archive(args.import_path, dry_run=args.dry_run, overwrite=args.overwrite, progress=report)
+        verb = "would be imported" if args.dry_run else "imported"
+        print(f"{'🔎' if args.dry_run else '✅'} {summary['imported']} {verb}, "
+              f"{summary['skipped']} skipped, {summary['invalid']} invalid, {summary['scenes']} scenes")
+        for error in summary['errors']:
+            print(f"  ❌ {error}")
+        return 1 if summary['invalid'] else 0
+    
+    return 0
+
+def run_batch_command(args):
+    """Read {"prompt"} or {"character", "message"} JSONL records and write responses in input order."""
+    global active_llm
+    
+    if not any(key == 'ollama' for key, _ in BackendDetector.detect_llm_backends()):
+        print("❌ No LLM backend detected")
+        return 1
+    active_llm = 'ollama'
+    model = args.model or next(iter(BackendDetector.get_ollama_models()), None)
+    if not model:
+        print("❌ No models available")
+        return 1
+    
+    records = []
+    with open(args.batch_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                print(f"❌ {args.batch_path}, line {line_number}: bad JSON ({e})")
+                return 1
+    
+    rows = [{"index": index, "character": record.get("character")} for index, record in enumerate(records)]
+    todo, prompts, stops = [], [], []
+    for row, record in zip(rows, records):
+        if record.get("prompt"):
+            prompts.append(record["prompt"])
+            stops.append(None)   # raw prompts bring their own format
+        elif record.get("character") in characters:
+            prompts.append(build_prompt(record["character"], record.get("message", "")))
+            stops.append(chat_stop_sequences(record["character"], model))
+        else:
+            row["error"] = f"unknown character '{record.get('character')}'"
+            continue
+        todo.append(row)
+    
+    started = time.monotonic()
+    results = LocalLLMClient(active_llm).generate_batch(
+        prompts, model, args.temperature, args.max_tokens, concurrency=args.concurrency, stops=stops,
+        progress=lambda done, total: print(f"  {done}/{total} generated", file=sys.stderr)
+    )
+    elapsed = time.monotonic() - started
+    for row, (response, error) in zip(todo, results):
+        row.update({"error": error} if error else {"response": response})
+    
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for row in rows:
+            out.write(json.dumps(row) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    
+    failed = sum(1 for row in rows if "error" in row)
+    print(f"✅ {len(rows) - failed}/{len(rows)} generated with {model} in {elapsed:.1f}s "
+          f"({len(results) / max(elapsed, 1e-9):.2f} req/s)", file=sys.stderr)
+    return 1 if failed else 0
+
+def run_replay_command(args):
+    """Replay a recorded trace against --target and print throughput and latency percentiles."""
+    events = load_trace(args.replay_path)
+    if not events:
+        print("❌ Trace is empty")
+        return 1
+    if args.speed <= 0:
+        print("❌ --speed must be positive")
+        return 1
+    
+    span = events[-1]["t"] - events[0]["t"]
+    print(f"▶️ Replaying {len(events)} turns ({span:.0f}s recorded) against {args.target} at {args.speed:g}×", file=sys.stderr)
+    report = replay_trace(events, args.target, args.speed, model=args.model,
+                          progress=lambda done, total: print(f"  {done}/{total} turns", file=sys.stderr))
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    
+    outcomes = report["outcomes"]
+    print(f"✅ {outcomes['ok']} ok, {outcomes['busy']} busy, {outcomes['error']} failed in {report['elapsed_s']:.1f}s "
+          f"({report['throughput_tps']:.2f} turns/s)")
+    for label, key in (("Latency", "latency_s"), ("First token", "ttft_s"),
+                       ("Recorded latency", "recorded_latency_s"), ("Recorded first token", "recorded_ttft_s")):
+        p = report[key]
+        if p:
+            print(f"  {label:<21} p50 {p['p50']:.2f}s  p90 {p['p90']:.2f}s  p99 {p['p99']:.2f}s  max {p['max']:.2f}s")
+    return 1 if outcomes['error'] else 0
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description=f"{APP_NAME} - AI Character Sandbox")
+    parser.add_argument("--export", dest="export_path", metavar="ARCHIVE", help="export all characters to a zip archive and exit")
+    parser.add_argument("--import", dest="import_path", metavar="ARCHIVE", help="import characters from a zip/JSONL archive and exit")
+    parser.add_argument("--dry-run", action="store_true", help="with --import: validate the archive without saving anything")
+    parser.add_argument("--overwrite", action="store_true", help="with --import: replace characters that already exist")
+    parser.add_argument("--batch", dest="batch_path", metavar="JSONL", help='generate for each {"prompt"} or {"character", "message"} line and exit')
+    parser.add_argument("--output", metavar="FILE", help="with --batch: write results here instead of stdout; with --replay: write the JSON report here")
+    parser.add_argument("--model", help="with --batch or --replay: model to use (default: first available)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="with --batch: parallel requests (default: %(default)s)")
+    parser.add_argument("--temperature", type=float, default=0.9, help="with --batch: sampling temperature")
+    parser.add_argument("--max-tokens", type=int, default=200, help="with --batch: max tokens per response")
+    parser.add_argument("--api", action="store_true", help=f"also serve the HTTP/WebSocket API under {API_PREFIX} on the same port")
+    parser.add_argument("--headless", action="store_true", help="serve only the HTTP/WebSocket API, no web UI")
+    parser.add_argument("--state-store", default=STATE_STORE_URL, metavar="URL", help="'files' (default) or 'sqlite:///eliza.db' to share state between workers")
+    parser.add_argument("--port", type=int, default=7861, help="port to listen on (default: %(default)s)")
+    parser.add_argument("--no-watch", action="store_true", help="don't hot-reload characters edited in the characters folder")
+    parser.add_argument("--record-trace", metavar="JSONL", default=TRACE_PATH, help="append anonymized per-turn sizes and timings here for --replay")
+    parser.add_argument("--replay", dest="replay_path", metavar="JSONL", help="replay a recorded trace against --target and report latencies")
+    parser.add_argument("--target", default="http://127.0.0.1:7861", help="with --replay: URL of an instance running with --api or --headless")
+    parser.add_argument("--speed", type=float, default=1.0, help="with --replay: time compression, e.g. 10 for 10× (default: %(default)s)")
+    parser.add_argument("--mock-llm", type=int, nargs="?", const=11434, metavar="PORT",
+                        help="serve a fake Ollama API for load tests (default port 11434) and exit when stopped")
+    cli_args = parser.parse_args()
+    
+    if cli_args.mock_llm:
+        run_mock_llm(cli_args.mock_llm)
+        sys.exit(0)
+    if cli_args.replay_path:
+        sys.exit(run_replay_command(cli_args))
+    
+    state_store = open_state_store(cli_args.state_store)
+    state_store.load_all()
+    
+    if cli_args.export_path or cli_args.import_path:
+        sys.exit(run_bulk_command(cli_args))
+    if cli_args.batch_path:
+        sys.exit(run_batch_command(cli_args))
+    
     print("=" * 70)
     print(f"🎭 {APP_NAME} v{VERSION} - Enhanced UI Edition")
     print("=" * 70)
-    print("🎨 Enhanced UI: ENABLED")
+    print("🎨 Enhanced UI: " + ("DISABLED (headless)" if cli_args.headless else "ENABLED"))
     print("🧠 Memory System: ACTIVE")
     print("🔒 Security: Localhost only")
+    print(f"🎭 Characters: {len(characters)}")
     
-    llm = BackendDetector.detect_llm_backends()
-    if llm:
-        for key, _ in llm:
-            if key == 'ollama':
-                models = BackendDetector.get_ollama_models()
-                if models:
-                    available_models = models
-                    active_llm = key
-                    print(f"✅ Models: {', '.join(models[:3])}")
-    else:
-        print("⚠️  No LLM detected")
+    print(f"💾 State: {state_store.describe()}")
     
-    print("\n🌐 Starting web interface...")
-    print("=" * 70)
+    if cli_args.record_trace:
+        turn_recorder = TurnRecorder(cli_args.record_trace)
+        print(f"⏺️ Recording anonymized turn trace to {turn_recorder.path}")
     
-    app.launch(
-        server_name="127.0.0.1",
-        server_port=7861,
-        share=False
-    )
\ No newline at end of file
+    if state_store.shared:
+        start_state_sync()
+        print(f"🔁 Syncing with other workers every {STATE_SYNC_INTERVAL:.0f}s")
+    elif not cli_args.no_watch:
+        character_watcher = CharacterWatcher().start()
+        print(f"👀 Hot reload: {character_watcher.mode} on {CHARACTERS_DIR}/")
+    
+    # Backend probes can take seconds when nothing is running; do them after the port is open.
+    backend_probe = threading.Thread(target=probe_backends, name="backend-probe", daemon=True)
+    
+    if cli_args.api or cli_args.headless:
+        import uvicorn
+        
+        server_app = create_api()
+        if not cli_args.headless:
+            server_app.router.routes.extend(get_static_assets().routes())
+            server_app = gr.mount_gradio_app(server_app, build_ui(), path="/")
+        server = uvicorn.Server(uvicorn.Config(server_app, host="127.0.0.1", port=cli_args.port))
+        
+        def announce():
+            while not server.started and not server.should_exit:
+                time.sleep(0.01)
+            if server.started:
+                report_time_to_listening("API" if cli_args.headless else "Web UI + API")
+                print(f"🔌 API: http://127.0.0.1:{cli_args.port}{API_PREFIX}  (docs at /docs)")
+                backend_probe.start()
+        
+        threading.Thread(target=announce, name="startup-report", daemon=True).start()
+        print("=" * 70)
+        server.run()
+    else:
+        app = build_ui()
+        print("\n🌐 Starting web interface...")
+        print("=" * 70)
+        
+        app.launch(
+            server_name="127.0.0.1",
+            server_port=cli_args.port,
+            share=False,
+            prevent_thread_lock=True,
+            max_threads=max(40, UI_GENERATION_LIMIT + 8),
+            app_kwargs={"routes": get_static_assets().routes()}
+        )
+        report_time_to_listening("Web UI")
+        backend_probe.start()
+        app.block_thread()